@@ -0,0 +1,177 @@
+"""benchmarks of qsubpy's own overhead
+
+Fake qsub, qstat and qacct in benchmarks/bin are put on PATH, so no scheduler is needed.
+Results are written as json lines, one benchmark per line, e.g.
+
+    python benchmarks/run_benchmarks.py --output bench.jsonl
+    python benchmarks/run_benchmarks.py --quick --qsub_latency 0.3
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIN = os.path.join(ROOT, "benchmarks", "bin")
+sys.path.insert(0, ROOT)
+
+
+def timeit(fn: Callable, repeat: int) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def result(name: str, params: Dict, times: List[float]) -> Dict:
+    return {
+        "name": name,
+        "params": params,
+        "repeat": len(times),
+        "mean": statistics.mean(times),
+        "min": min(times),
+        "max": max(times),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+    }
+
+
+def write_workflow(path: str, n_stages: int):
+    import yaml
+
+    stages = [{"name": f"stage{i}", "cmd": f"echo {i}"} for i in range(n_stages)]
+    with open(path, "w") as f:
+        yaml.safe_dump({"job-name": "bench", "mode": "ord", "stages": stages}, f)
+
+
+def bench_read_config(repeat: int) -> List[Dict]:
+    from qsubpy.config import read_config, clear_config_cache
+
+    def cold():
+        clear_config_cache()
+        read_config()
+
+    return [
+        result("read_config", {"cache": "cold"}, timeit(cold, repeat)),
+        result("read_config", {"cache": "warm"}, timeit(read_config, repeat)),
+    ]
+
+
+def bench_make_sh_file(repeat: int, sizes: List[int]) -> List[Dict]:
+    from qsubpy.utils import make_sh_file
+
+    ret = [
+        result(
+            "make_sh_file",
+            {"array": 0},
+            timeit(lambda: make_sh_file(["echo a"], None, None, "bench"), repeat),
+        )
+    ]
+    for n in sizes:
+        times = timeit(
+            lambda: make_sh_file(["echo $elem"], None, None, "bench", array_command=f"seq 1 {n}"),
+            repeat,
+        )
+        ret.append(result("make_sh_file", {"array": n}, times))
+    return ret
+
+
+def bench_bash_array_len(repeat: int, sizes: List[int]) -> List[Dict]:
+    from qsubpy.config import read_config
+
+    config = read_config()
+    return [
+        result(
+            "bash_array_len",
+            {"array": n},
+            timeit(lambda: config.bash_array_len(f"seq 1 {n}"), repeat),
+        )
+        for n in sizes
+    ]
+
+
+def bench_qsub_with_jid(repeat: int, latency: float) -> List[Dict]:
+    from qsubpy.qsub import qsub_with_jid
+
+    with open("bench.sh", "w") as f:
+        f.write("echo a\n")
+    times = timeit(lambda: qsub_with_jid(["qsub", "bench.sh"]), repeat)
+    return [result("qsub_with_jid", {"qsub_latency": latency}, times)]
+
+
+def bench_workflow(repeat: int, sizes: List[int], latency: float) -> List[Dict]:
+    from qsubpy.run import workflow_mode
+
+    ret = []
+    for n in sizes:
+        path = f"bench_{n}.yml"
+        write_workflow(path, n)
+        args = argparse.Namespace(
+            workflow=path,
+            dry_run=False,
+            common_variables=[],
+            force=False,
+            auto_resources=False,
+            backend=None,
+            prometheus=None,
+            compile=False,
+            via_daemon=False,
+        )
+        times = timeit(lambda: workflow_mode(args), repeat)
+        ret.append(result("workflow_mode", {"stages": n, "qsub_latency": latency}, times))
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks of qsubpy with fake qsub")
+    parser.add_argument("--output", type=str, default=None, help="json lines output. default is stdout")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--qsub_latency", type=float, default=0.0, help="latency of fake qsub in seconds")
+    parser.add_argument("--quick", action="store_true", help="run only small sizes")
+    args = parser.parse_args()
+
+    array_sizes = [1000, 10000] if args.quick else [1000, 10000, 100000, 1000000]
+    stage_sizes = [10, 100] if args.quick else [10, 100, 1000]
+
+    workdir = tempfile.mkdtemp(prefix="qsubpy_bench_")
+    config = os.path.join(workdir, "qsubpy_config.toml")
+    shutil.copy(os.path.join(ROOT, "config.toml"), config)
+    os.environ["QSUBPY_CONFIG"] = config
+    os.environ["PATH"] = BIN + os.pathsep + os.environ["PATH"]
+    os.environ["FAKE_QSUB_LATENCY"] = str(args.qsub_latency)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+
+    results = []
+    try:
+        results += bench_read_config(args.repeat)
+        results += bench_make_sh_file(args.repeat, array_sizes)
+        results += bench_bash_array_len(args.repeat, array_sizes)
+        results += bench_qsub_with_jid(args.repeat, args.qsub_latency)
+        results += bench_workflow(1, stage_sizes, args.qsub_latency)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True
+    ).stdout.decode("utf-8").strip()
+    out = open(args.output, "a") if args.output is not None else sys.stdout
+    for r in results:
+        r["commit"] = commit
+        out.write(json.dumps(r) + "\n")
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""execution backends of generated scripts
+
+sge runs scripts with qsub. local runs scripts in a pool of processes on the
+submit host, emulating array tasks by setting the array task id of config
+(e.g. SGE_TASK_ID) for each task, and holding dependencies between jobs.
+daemon hands scripts to qsubpy serve, which submits them with qsub later
+(see qsubpy.daemon).
+"""
+import os
+import itertools
+import threading
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Iterable, List, Optional
+
+from qsubpy.config import Config, read_config
+from qsubpy.profiling import traced
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+LOCAL_PREFIX = "local-"
+
+
+def is_local_jid(jid: str) -> bool:
+    return jid.startswith(LOCAL_PREFIX)
+
+
+class Backend:
+    name: str = ""
+
+    def __init__(self, config: Optional[Config] = None):
+        self.config = config if config is not None else read_config()
+
+    def submit(self, sh_file: str, hold_jids: List[str], array_hold_jids: Optional[List[str]] = None) -> str:
+        """submit the script after all hold_jids finish and return its jid.
+        Each task of the script waits for the same task of array_hold_jids, if the backend can.
+        """
+        raise NotImplementedError
+
+    def wait(self, jids: Iterable[str]) -> Dict[str, Optional[int]]:
+        """wait until all jids finish and return their exit status"""
+        raise NotImplementedError
+
+
+class SGEBackend(Backend):
+    name = "sge"
+
+    @traced("submit")
+    def submit(self, sh_file: str, hold_jids: List[str], array_hold_jids: Optional[List[str]] = None) -> str:
+        from qsubpy.qsub import qsub_with_jid
+
+        array_hold_jids = array_hold_jids or []
+        # sge cannot hold local jobs, so wait for them here
+        local_jids = [jid for jid in hold_jids + array_hold_jids if is_local_jid(jid)]
+        if local_jids:
+            logger.info(f"wait for local jobs {local_jids} before qsub {sh_file}")
+            get_backend("local").wait(local_jids)
+        hold_jids = [jid for jid in hold_jids if not is_local_jid(jid)]
+        array_hold_jids = [jid for jid in array_hold_jids if not is_local_jid(jid)]
+
+        cmd = self.config.ord_qsub_command(",".join(hold_jids), ",".join(array_hold_jids)) + [sh_file]
+        logger.debug(" ".join(cmd))
+        return qsub_with_jid(cmd)
+
+    def wait(self, jids: Iterable[str]) -> Dict[str, Optional[int]]:
+        from qsubpy.monitor import get_monitor
+
+        return get_monitor().wait(jids)
+
+
+class LocalBackend(Backend):
+    """run scripts with bash in a pool of max_workers processes.
+    stdout and stderr of each task are written to <script>.o<jid>[.<task>]
+    and <script>.e<jid>[.<task>] in the working directory, like sge.
+    """
+
+    name = "local"
+
+    def __init__(self, config: Optional[Config] = None, max_workers: Optional[int] = None):
+        super().__init__(config)
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Future] = {}
+        # jobs wait for their holds in their own threads, and run their tasks in the pool
+        self._jobs_executor = ThreadPoolExecutor()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count())
+
+    def _run_task(self, sh_file: str, jid: str, task: Optional[int]) -> int:
+        env = dict(os.environ)
+        env[self.config.job_id[1:]] = jid
+        name = os.path.basename(sh_file)
+        suffix = jid
+        if task is not None:
+            env[self.config.array_job_id[1:]] = str(task)
+            suffix += f".{task}"
+
+        with open(f"{name}.o{suffix}", "w") as out, open(f"{name}.e{suffix}", "w") as err:
+            p = subprocess.run(["bash", sh_file], stdout=out, stderr=err, env=env)
+        return p.returncode
+
+    def _run_job(self, sh_file: str, jid: str, hold_jids: List[str]) -> int:
+        local_jids = [j for j in hold_jids if is_local_jid(j)]
+        sge_jids = [j for j in hold_jids if not is_local_jid(j)]
+        if local_jids:
+            self.wait(local_jids)
+        if sge_jids:
+            get_backend("sge").wait(sge_jids)
+
+        with open(sh_file) as f:
+            tasks = self.config.array_tasks(f.read().splitlines())
+        if tasks is None:
+            tasks = [None]
+
+        logger.debug(f"run {sh_file} as {jid}")
+        futures = [self._pool.submit(self._run_task, sh_file, jid, task) for task in tasks]
+        return max(future.result() for future in futures)
+
+    @traced("submit")
+    def submit(self, sh_file: str, hold_jids: List[str], array_hold_jids: Optional[List[str]] = None) -> str:
+        # jobs are run as a whole, so element-wise holds are whole-job holds
+        hold_jids = hold_jids + (array_hold_jids or [])
+        with self._lock:
+            jid = f"{LOCAL_PREFIX}{os.getpid()}-{next(self._counter)}"
+            self._jobs[jid] = self._jobs_executor.submit(self._run_job, sh_file, jid, hold_jids)
+        return jid
+
+    def wait(self, jids: Iterable[str]) -> Dict[str, Optional[int]]:
+        ret = {}
+        for jid in jids:
+            with self._lock:
+                future = self._jobs.get(jid)
+            if future is None:
+                raise ValueError(f"{jid} is not a job of this process")
+            ret[jid] = future.result()
+        return ret
+
+    def wait_all(self) -> Dict[str, Optional[int]]:
+        with self._lock:
+            jids = list(self._jobs)
+        return self.wait(jids)
+
+
+class DaemonBackend(Backend):
+    """submit scripts via qsubpy serve. submit returns a ticket of the daemon instead of a jid,
+    and the daemon records the job to the journal when it is submitted.
+    """
+
+    name = "daemon"
+
+    def submit(
+        self, sh_file: str, hold_jids: List[str], array_hold_jids: Optional[List[str]] = None, **record
+    ) -> str:
+        from qsubpy.daemon import request
+
+        if any(is_local_jid(jid) for jid in hold_jids + (array_hold_jids or [])):
+            raise ValueError(f"{sh_file} submitted via the daemon cannot hold local jobs")
+        return request(
+            "submit",
+            path=self.config.daemon_socket,
+            script=os.path.abspath(sh_file),
+            cwd=os.getcwd(),
+            hold_jids=hold_jids,
+            array_hold_jids=array_hold_jids or [],
+            record=record,
+        )["ticket"]
+
+    def wait(self, jids: Iterable[str]) -> Dict[str, Optional[int]]:
+        from qsubpy.daemon import request
+
+        return request("wait", path=self.config.daemon_socket, jids=list(jids))["status"]
+
+
+BACKENDS = {"sge": SGEBackend, "local": LocalBackend, "daemon": DaemonBackend}
+
+_BACKENDS: Dict[str, Backend] = {}
+_BACKENDS_LOCK = threading.Lock()
+
+
+def get_backend(name: str) -> Backend:
+    """process-wide backend of the name"""
+    if name not in BACKENDS:
+        raise ValueError(f"invalid backend {name}, plz use {' or '.join(BACKENDS)}")
+    with _BACKENDS_LOCK:
+        if name not in _BACKENDS:
+            _BACKENDS[name] = BACKENDS[name]()
+        return _BACKENDS[name]
@@ -0,0 +1,95 @@
+"""cost-balanced order of array elements
+
+Elements are ordered at submission by their estimated cost, so that long tasks
+start first (longest processing time first) and tasks of a stage finish
+together. The cost of an element is its past runtime in the resource history
+of the stage if any, else its file size scaled by the runtime per byte of
+elements with both. With chunks, elements are packed into bins of chunks
+elements whose total costs are balanced.
+"""
+import os
+import heapq
+import statistics
+
+from typing import Dict, List, Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def element_runtimes(stage: Optional[str], history: Optional[List[Dict]] = None) -> Dict[str, float]:
+    """mean wallclock of each element in the resource history of the stage"""
+    from qsubpy.history import load_history
+
+    if stage is None:
+        return {}
+    if history is None:
+        history = load_history()
+
+    runtimes: Dict[str, List[float]] = {}
+    for r in history:
+        if r.get("stage") == stage and r.get("element") is not None:
+            runtimes.setdefault(r["element"], []).append(r["wallclock"])
+    return {elem: statistics.mean(v) for elem, v in runtimes.items()}
+
+
+def estimate_costs(elements: List[str], runtimes: Optional[Dict[str, float]] = None) -> List[float]:
+    runtimes = runtimes or {}
+    sizes = [os.path.getsize(e) if os.path.isfile(e) else None for e in elements]
+
+    both = [(runtimes[e], s) for e, s in zip(elements, sizes) if e in runtimes and s]
+    seconds_per_byte = sum(r for r, _ in both) / sum(s for _, s in both) if both else None
+
+    costs: List[Optional[float]] = []
+    for elem, size in zip(elements, sizes):
+        if elem in runtimes:
+            costs.append(runtimes[elem])
+        elif size is not None and (seconds_per_byte is not None or not runtimes):
+            costs.append(size * (seconds_per_byte or 1))
+        else:
+            costs.append(None)
+
+    # elements without runtime nor size cost the mean of the others
+    known = [c for c in costs if c is not None]
+    default = statistics.mean(known) if known else 1.0
+    return [c if c is not None else default for c in costs]
+
+
+def balance_elements(elements: List[str], costs: List[float], chunks: Optional[int] = None) -> List[str]:
+    """order elements so that consecutive chunks elements are balanced bins, heaviest first.
+    Without chunks, elements are sorted by cost in descending order.
+    """
+    order = sorted(range(len(elements)), key=lambda i: -costs[i])
+    if chunks is None or chunks <= 1:
+        return [elements[i] for i in order]
+
+    n_bins = (len(elements) + chunks - 1) // chunks
+    # the last bin is short, since tasks take chunks elements from their offset
+    capacity = [chunks] * n_bins
+    capacity[-1] = len(elements) - chunks * (n_bins - 1)
+
+    bins: List[List[int]] = [[] for _ in range(n_bins)]
+    loads = [0.0] * n_bins
+    heap = [(0.0, b) for b in range(n_bins)]
+    for i in order:
+        load, b = heapq.heappop(heap)
+        bins[b].append(i)
+        loads[b] = load + costs[i]
+        if len(bins[b]) < capacity[b]:
+            heapq.heappush(heap, (loads[b], b))
+
+    full = sorted(range(n_bins - 1), key=lambda b: -loads[b])
+    return [elements[i] for b in full + [n_bins - 1] for i in bins[b]]
+
+
+def balancer(stage: Optional[str], chunks: Optional[int] = None):
+    """order function of elements for Config.freeze_elements"""
+
+    def order(elements: List[str]) -> List[str]:
+        costs = estimate_costs(elements, element_runtimes(stage))
+        balanced = balance_elements(elements, costs, chunks)
+        logger.debug(f"balanced elements of {stage}: {balanced}")
+        return balanced
+
+    return order
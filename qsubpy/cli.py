@@ -5,10 +5,8 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-from qsubpy import run
-from qsubpy.utils import add_default_args
+from qsubpy.utils import add_default_args, add_bulk_args, add_common_args
 from qsubpy.validator import CommonVariableValidator
-from qsubpy.config import generate_default_config
 
 # set color logger
 mapping = {
@@ -30,17 +28,85 @@ class ColorfulHandler(logging.StreamHandler):
 
 
 def command_mode_handler(args: argparse.Namespace):
+    from qsubpy import run
+
     run.command_mode(args)
 
 
 def file_mode_handler(args: argparse.Namespace):
+    from qsubpy import run
+
     run.file_mode(args)
 
 
 def workflow_mode_handler(args: argparse.Namespace):
+    from qsubpy import run
+
     run.workflow_mode(args)
 
 
+def retry_mode_handler(args: argparse.Namespace):
+    from qsubpy import run
+
+    run.retry_mode(args)
+
+
+def logs_mode_handler(args: argparse.Namespace):
+    from qsubpy import run
+
+    run.logs_mode(args)
+
+
+def serve_mode_handler(args: argparse.Namespace):
+    from qsubpy import run
+
+    run.serve_mode(args)
+
+
+def report_mode_handler(args: argparse.Namespace):
+    from qsubpy import run
+
+    run.report_mode(args)
+
+
+def gc_mode_handler(args: argparse.Namespace):
+    from qsubpy import run
+
+    run.gc_mode(args)
+
+
+def run_with_profile(args: argparse.Namespace):
+    """run the handler with span trace and/or cProfile, and print the summary to stderr"""
+    from qsubpy import profiling
+
+    name = args.handler.__name__.replace("_mode_handler", "")
+    profiler = None
+    if args.cprofile is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+    profiling.enable()
+    try:
+        with profiling.span(name):
+            if profiler is not None:
+                profiler.runcall(args.handler, args)
+            else:
+                args.handler(args)
+    finally:
+        profiling.disable()
+        print(profiling.summary(), file=sys.stderr)
+        if args.profile is not None:
+            profiling.write_trace(args.profile)
+            logger.info(f"trace is written to {args.profile}")
+        if profiler is not None:
+            import pstats
+
+            profiler.dump_stats(args.cprofile)
+            print("", file=sys.stderr)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(20)
+
+
 def __main__():
     parser = argparse.ArgumentParser(
         description="wrapper for qsub. Easy to use array job and build workflow."
@@ -57,8 +123,10 @@ def __main__():
         "command",
         metavar="Command",
         type=str,
-        help="command you would like to run with qsub",
+        nargs="+",
+        help="commands you would like to run with qsub",
     )
+    add_bulk_args(cmd_parser)
     cmd_parser.add_argument(
         "--ls",
         type=str,
@@ -71,6 +139,51 @@ def __main__():
         default=None,
         help="command for array job. You can use elem variable in command or the sh file.",
     )
+    cmd_parser.add_argument(
+        "--manifest",
+        action="store_true",
+        help="freeze elements of array job to a manifest at submission. each task reads only its own element.",
+    )
+    cmd_parser.add_argument(
+        "--chunks",
+        type=int,
+        default=None,
+        help="number of elements packed into one task of array job.",
+    )
+    cmd_parser.add_argument(
+        "--chunk_parallel",
+        action="store_true",
+        help="run elements of a chunk in parallel up to slot.",
+    )
+    cmd_parser.add_argument(
+        "--balance",
+        action="store_true",
+        help="order elements by file size or past runtime so that tasks finish together. implies --manifest",
+    )
+    cmd_parser.add_argument(
+        "--max_concurrent",
+        type=int,
+        default=None,
+        help="max number of running tasks of the array job",
+    )
+    cmd_parser.add_argument(
+        "--scatter",
+        type=str,
+        default=None,
+        help="file whose lines are scattered over tasks by a byte offset index. each task reads only its own lines.",
+    )
+    cmd_parser.add_argument(
+        "--aggregate_logs",
+        action="store_true",
+        default=None,
+        help="append stdout and stderr of array tasks to a compressed log bundle instead of .o and .e files. see qsubpy logs",
+    )
+    cmd_parser.add_argument(
+        "--lines_per_task",
+        type=int,
+        default=1,
+        help="number of lines of --scatter file in one task. with 1, elem is the line, else qsubpy_chunk is the lines.",
+    )
     add_default_args(cmd_parser, handler=command_mode_handler)
 
     # file
@@ -89,12 +202,59 @@ def __main__():
         default=None,
         help="command for array job. You can use elem variable in command or the sh file.",
     )
+    file_parser.add_argument(
+        "--manifest",
+        action="store_true",
+        help="freeze elements of array job to a manifest at submission. each task reads only its own element.",
+    )
+    file_parser.add_argument(
+        "--chunks",
+        type=int,
+        default=None,
+        help="number of elements packed into one task of array job.",
+    )
+    file_parser.add_argument(
+        "--chunk_parallel",
+        action="store_true",
+        help="run elements of a chunk in parallel up to slot.",
+    )
+    file_parser.add_argument(
+        "--balance",
+        action="store_true",
+        help="order elements by file size or past runtime so that tasks finish together. implies --manifest",
+    )
+    file_parser.add_argument(
+        "--max_concurrent",
+        type=int,
+        default=None,
+        help="max number of running tasks of the array job",
+    )
+    file_parser.add_argument(
+        "--scatter",
+        type=str,
+        default=None,
+        help="file whose lines are scattered over tasks by a byte offset index. each task reads only its own lines.",
+    )
+    file_parser.add_argument(
+        "--aggregate_logs",
+        action="store_true",
+        default=None,
+        help="append stdout and stderr of array tasks to a compressed log bundle instead of .o and .e files. see qsubpy logs",
+    )
+    file_parser.add_argument(
+        "--lines_per_task",
+        type=int,
+        default=1,
+        help="number of lines of --scatter file in one task. with 1, elem is the line, else qsubpy_chunk is the lines.",
+    )
     file_parser.add_argument(
         "file",
         metavar="Script File Path",
         type=str,
-        help="File you would like to run with qsub",
+        nargs="+",
+        help="Files or glob patterns you would like to run with qsub",
     )
+    add_bulk_args(file_parser)
     add_default_args(file_parser, handler=file_mode_handler)
 
     # workflow
@@ -112,12 +272,125 @@ def __main__():
     workflow_parser.add_argument(
         "-cv", "--common_variables", type=str, nargs="*", metavar="", default=[], choices=CommonVariableValidator()
     )
+    workflow_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="run all stages even if their inputs and scripts are unchanged",
+    )
+    workflow_parser.add_argument(
+        "--auto_resources",
+        action="store_true",
+        help="fill mem and slot of stages from resource usage history",
+    )
+    workflow_parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="compile the workflow to a plan used by later runs until the workflow or config changes",
+    )
+    workflow_parser.add_argument(
+        "--prometheus",
+        type=str,
+        default=None,
+        help="write stage and task timings as a prometheus textfile to the path at the end",
+    )
+    workflow_parser.add_argument(
+        "--via_daemon",
+        action="store_true",
+        help="hand scripts to qsubpy serve, which submits them with rate limit, and return at once. ord mode only",
+    )
     add_default_args(workflow_parser, handler=workflow_mode_handler)
 
+    # retry
+    retry_parser = subparsers.add_parser(
+        "retry", help="resubmit only failed tasks of a job or the last job of a stage"
+    )
+    retry_parser.add_argument(
+        "target",
+        metavar="jid or stage",
+        type=str,
+        help="jid or stage name of the job you would like to retry",
+    )
+    add_common_args(retry_parser, handler=retry_mode_handler)
+
+    # serve
+    serve_parser = subparsers.add_parser(
+        "serve", help="run the daemon submitting jobs of workflows with --via_daemon"
+    )
+    serve_parser.add_argument(
+        "--socket",
+        type=str,
+        default=None,
+        help="path of the unix socket. daemon.socket of config by default",
+    )
+    serve_parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="max number of qsub per second. daemon.rate of config by default",
+    )
+    serve_parser.add_argument(
+        "--burst",
+        type=int,
+        default=None,
+        help="max number of qsub at once after idle. daemon.burst of config by default",
+    )
+    add_common_args(serve_parser, handler=serve_mode_handler)
+
+    # logs
+    logs_parser = subparsers.add_parser(
+        "logs", help="show aggregated logs of array tasks of a job or a stage"
+    )
+    logs_parser.add_argument(
+        "target",
+        metavar="jid or stage",
+        type=str,
+        help="jid or stage name. tasks of a stage show the logs of their last run including retries",
+    )
+    logs_parser.add_argument(
+        "--task",
+        type=int,
+        default=None,
+        help="show stdout and stderr of the task",
+    )
+    logs_parser.add_argument(
+        "--failed",
+        action="store_true",
+        help="show stdout and stderr of failed tasks",
+    )
+    add_common_args(logs_parser, handler=logs_mode_handler)
+
+    # report
+    report_parser = subparsers.add_parser(
+        "report", help="show used and wasted resources per stage"
+    )
+    report_parser.add_argument(
+        "--collect",
+        action="store_true",
+        help="collect resource usage of finished jobs from qacct before report",
+    )
+    report_parser.add_argument(
+        "--prometheus",
+        type=str,
+        default=None,
+        help="write stage and task timings as a prometheus textfile to the path",
+    )
+    add_common_args(report_parser, handler=report_mode_handler)
+
+    # gc
+    gc_parser = subparsers.add_parser(
+        "gc", help="remove stored scripts whose jobs are no longer in the scheduler"
+    )
+    gc_parser.add_argument(
+        "--min_age",
+        type=float,
+        default=3600,
+        help="keep scripts newer than min_age seconds, which may be about to be submitted",
+    )
+    add_common_args(gc_parser, handler=gc_mode_handler)
+
     args = parser.parse_args()
     logger.debug(args)
 
-    generate_default_config()
     # set log level
     if hasattr(args, "log_level"):
         if args.log_level == "error":
@@ -138,7 +411,10 @@ def __main__():
 
     # run handler
     if hasattr(args, "handler"):
-        args.handler(args)
+        if args.profile is not None or args.cprofile is not None:
+            run_with_profile(args)
+        else:
+            args.handler(args)
     else:
         parser.print_help()
         sys.exit(1)
@@ -1,9 +1,12 @@
 import os
 import re
-import toml
-import subprocess
+import copy
+import threading
 
-from typing import Dict, Optional, List
+from types import MappingProxyType
+from typing import Callable, Dict, Optional, List, Tuple
+
+from qsubpy.profiling import span
 
 import logging
 
@@ -21,15 +24,22 @@ class Resource:
         self.resource_params: str = config["resource"]["header"].rstrip("\n")
         self.default_mem: str = config["resource"]["default_mem"]
         self.default_slot: str = config["resource"]["default_slot"]
+        # rendered resource headers keyed by (mem, slot)
+        self._rendered: Dict[Tuple[str, str], str] = {}
 
     def _resource(self, mem: str = None, slot: str = None) -> str:
         if mem is None:
             mem = self.default_mem
         if slot is None:
             slot = self.default_slot
-        return self.resource_params.replace("{mem}", str(mem)).replace(
-            "{slot}", str(slot)
-        )
+        key = (str(mem), str(slot))
+        rendered = self._rendered.get(key)
+        if rendered is None:
+            rendered = self.resource_params.replace("{mem}", key[0]).replace(
+                "{slot}", key[1]
+            )
+            self._rendered[key] = rendered
+        return rendered
 
 
 class SingularityConfig:
@@ -37,11 +47,18 @@ class SingularityConfig:
         singularity = config.get("singularity")
         if singularity is None:
             logger.warn(no_exist_msg("singularity"))
+            singularity = {}
             self.singularity_image_root = None
             self.singularity_default_ext = None
         else:
             self.singularity_image_root = singularity.get("image_root")
             self.singularity_default_ext = singularity.get("default_ext")
+        self.check_image: bool = bool(singularity.get("check_image", True))
+        # node-local directory where images are staged with stage_image
+        self.stage_dir: str = singularity.get("stage_dir", "${TMPDIR:-/tmp}")
+        # (image, root) -> checked path
+        self._resolved: Dict[Tuple[str, Optional[str]], str] = {}
+        self._resolved_lock = threading.Lock()
 
     def singularity_image(self, image: str, root: Optional[str]) -> str:
         if self.singularity_default_ext is None:
@@ -65,10 +82,35 @@ class SingularityConfig:
         # return image only
         return image
 
+    def resolve_image(self, image: str, root: Optional[str] = None) -> str:
+        """singularity_image which is checked to exist once per process.
+        Images of URI like docker://ubuntu are not checked.
+        """
+        key = (image, root)
+        with self._resolved_lock:
+            if key in self._resolved:
+                return self._resolved[key]
+
+        path = self.singularity_image(image, root)
+        if self.check_image and "://" not in path and not os.path.isfile(os.path.expanduser(path)):
+            raise FileNotFoundError(
+                f"singularity image {path} of {image} is not found. "
+                "check runs_on, or image_root and default_ext in config"
+            )
+        with self._resolved_lock:
+            self._resolved[key] = path
+        return path
+
 
 #!TODO: add log path
 #!TODO: add singularity
 class Config:
+    """parsed qsubpy_config.toml
+
+    Config objects returned by read_config are shared process-wide, so they are frozen
+    after construction. Use with_common_variables to get an overlay with extra variables.
+    """
+
     def __init__(self, config: dict):
         self.header: str = config["scripts"]["header"].rstrip("\n")
         self.body: str = config["scripts"]["body"].rstrip("\n")
@@ -83,16 +125,41 @@ class Config:
         else:
             self.array_job_id = "$" + config["arrayjob"]["id"]
         self.array_params: str = config["arrayjob"]["header"].rstrip("\n")
+        # regex of array header like "#$ -t 1-10:1" with groups start, end and step
+        array_header_re = re.escape(self.array_params)
+        for key in ["start", "end", "step"]:
+            array_header_re = array_header_re.replace(
+                re.escape("{" + key + "}"), f"(?P<{key}>\\d+)"
+            )
+        self.array_header_re: re.Pattern = re.compile("^" + array_header_re + "$")
+        # throttle of running tasks of an array job
+        self.max_concurrent_params: str = config["arrayjob"].get(
+            "max_concurrent", "#$ -tc {max_concurrent}"
+        ).rstrip("\n")
+        job_id = config["arrayjob"].get("job_id", "JOB_ID")
+        self.job_id: str = job_id if job_id.startswith("$") else "$" + job_id
 
         # qsub option
         options = config.get("options")
         if options is None:
             logger.warn(no_exist_msg("Options"))
-            self.sync_options = None
             self.ord_options = None
+            self.order_array_options = None
+            self.alter_hold_options = None
         else:
-            self.sync_options: Optional[List[str]] = options.get("sync")
             self.ord_options: Optional[List[str]] = options.get("order")
+            # hold each task of an array job on the same task of other array jobs
+            self.order_array_options: Optional[List[str]] = options.get("order_array")
+            self.alter_hold_options: Optional[List[str]] = options.get("alter_hold")
+
+        # job monitor
+        monitor = config.get("monitor", {})
+        self.qstat_command: List[str] = monitor.get("qstat", ["qstat"])
+        self.qacct_command: List[str] = monitor.get("qacct", ["qacct", "-j", "{JID}"])
+        self.poll_interval: float = float(monitor.get("interval", 5))
+        self.max_poll_interval: float = float(monitor.get("max_interval", 60))
+        # qacct may have no record for a while after a job leaves qstat
+        self.qacct_timeout: float = float(monitor.get("qacct_timeout", 300))
 
         # jid re
         jid = config.get("jid")
@@ -105,43 +172,193 @@ class Config:
         # common variables
         common_variables = config.get("common_variables")
         if common_variables is None:
-            self.common_variables = {}
+            self.common_variables = MappingProxyType({})
         else:
-            self.common_variables = common_variables
+            self.common_variables = MappingProxyType(dict(common_variables))
 
         # singularity
         self.singularity_config = SingularityConfig(config)
 
+        # script store
+        store = config.get("store", {})
+        self.store_dir: str = os.path.expanduser(store.get("dir", "~/.cache/qsubpy/scripts"))
+
+        # shell
+        shell = config.get("shell", {})
+        self.persistent_shell: bool = bool(shell.get("persistent", False))
+
+        # submission daemon
+        daemon = config.get("daemon", {})
+        self.daemon_socket: str = os.path.expanduser(daemon.get("socket", "~/.cache/qsubpy/serve.sock"))
+        self.daemon_journal: str = os.path.expanduser(daemon.get("journal", "~/.cache/qsubpy/serve.jsonl"))
+        self.daemon_rate: float = float(daemon.get("rate", 2))
+        self.daemon_burst: int = int(daemon.get("burst", 10))
+
+        # aggregate logs of array tasks
+        logs = config.get("logs", {})
+        self.aggregate_logs: bool = bool(logs.get("aggregate", False))
+        self.log_dir: str = logs.get("dir", ".qsubpy/logs")
+        self.log_header: str = logs.get("header", "#$ -o /dev/null\n#$ -e /dev/null").strip("\n")
+
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"Config is immutable, cannot set {name}")
+        super().__setattr__(name, value)
+
+    def with_common_variables(self, common_variables: Optional[Dict]) -> "Config":
+        """return a config whose common variables are overlaid by common_variables.
+        The shared config is not modified.
+        """
+        if not common_variables:
+            return self
+
+        merged = dict(self.common_variables)
+        merged.update(common_variables)
+        overlay = copy.copy(self)
+        object.__setattr__(overlay, "common_variables", MappingProxyType(merged))
+        return overlay
+
     def resource(self, mem: Optional[str] = None, slot: Optional[str] = None) -> str:
         return self.resources._resource(mem=mem, slot=slot)
 
-    def array_header_with_cmd(self, command: str) -> tuple:
-        length = self.bash_array_len(command)
-        array_header = (
+    def array_header(self, length: int) -> str:
+        return (
             self.array_params.replace("{start}", "1")
             .replace("{end}", str(length))
             .replace("{step}", "1")
         )
+
+    def max_concurrent_header(self, max_concurrent: int) -> str:
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent should be positive integer")
+        return self.max_concurrent_params.replace("{max_concurrent}", str(max_concurrent))
+
+    def array_tasks(self, script: List[str]) -> Optional[List[int]]:
+        """task ids of the array job script. None if the script is not an array job."""
+        for line in script:
+            m = self.array_header_re.match(line)
+            if m is not None:
+                start, end, step = (int(m.group(k)) for k in ["start", "end", "step"])
+                return list(range(start, end + 1, step))
+        return None
+
+    def array_header_with_cmd(self, command: str) -> tuple:
+        length = self.bash_array_len(command)
+        array_header = self.array_header(length)
         array = f"array=($({command}))"
         # like following
         # elem=${array[$(($SGE_TASK_ID-1))]}
         elem = "elem=${array[$((" + self.array_job_id + "-1))]}"
         return array_header, "\n".join([array, elem])
 
-    def sync_qsub_command(self) -> list:
-        return ["qsub"] + self.sync_options
+    def freeze_elements(
+        self, command: str, manifest_path: str, order: Optional[Callable] = None
+    ) -> Tuple[str, int]:
+        """write elements of command to the manifest and return its absolute path and length.
+        If manifest_path is a directory, the manifest is named by the hash of the elements.
+        order reorders the elements, e.g. by cost (see qsubpy.balance).
+        """
+        from qsubpy.manifest import write_manifest, content_manifest_path
+
+        elements = self.bash_array(command)
+        if order is not None:
+            elements = order(elements)
+        if os.path.isdir(manifest_path):
+            manifest_path = os.path.abspath(content_manifest_path(elements, manifest_path))
+            # running jobs may read the same manifest, so do not rewrite it
+            if os.path.exists(manifest_path + ".idx"):
+                return manifest_path, len(elements)
+        manifest_path = os.path.abspath(manifest_path)
+        length = write_manifest(elements, manifest_path)
+        return manifest_path, length
+
+    def array_header_with_manifest(
+        self, command: str, manifest_path: str, order: Optional[Callable] = None
+    ) -> tuple:
+        """run command once at submission, freeze its elements to the manifest
+        and look up each task's element from it.
+        """
+        from qsubpy.manifest import bash_lookup
+
+        manifest_path, length = self.freeze_elements(command, manifest_path, order)
+        return self.array_header(length), bash_lookup(
+            manifest_path, self.array_job_id + "-1"
+        )
+
+    def array_header_with_chunks(
+        self,
+        command: str,
+        chunks: int,
+        manifest_path: Optional[str] = None,
+        order: Optional[Callable] = None,
+    ) -> tuple:
+        """pack chunks elements into one task. qsubpy_chunk is set to the elements of the task
+        and qsubpy_offset to the 0-origin index of its first element.
+        """
+        from qsubpy.manifest import bash_lookup
+
+        if chunks < 1:
+            raise ValueError("chunks should be positive integer")
+
+        # like following
+        # qsubpy_offset=$((($SGE_TASK_ID-1)*100))
+        offset = "qsubpy_offset=$(((" + self.array_job_id + f"-1)*{chunks}))"
+        if manifest_path is not None:
+            manifest_path, length = self.freeze_elements(command, manifest_path, order)
+            array = bash_lookup(manifest_path, "$qsubpy_offset", count=chunks)
+        else:
+            length = self.bash_array_len(command)
+            array = "\n".join(
+                [
+                    f"array=($({command}))",
+                    'qsubpy_chunk=("${array[@]:$qsubpy_offset:' + str(chunks) + '}")',
+                ]
+            )
+        n_tasks = (length + chunks - 1) // chunks
+        return self.array_header(n_tasks), "\n".join([offset, array])
+
+    def array_header_with_scatter(self, path: str, lines_per_task: int, index: str) -> tuple:
+        """index lines of path at submission and read only lines_per_task lines in each task.
+        If index is a directory, the index is named by the path, size and mtime of the file.
+        """
+        from qsubpy.scatter import bash_scatter, content_index_path, scatter_len, write_line_index
+
+        if os.path.isdir(index):
+            index = content_index_path(path, lines_per_task, index)
+            # running jobs may read the same index, so do not rewrite it
+            if os.path.exists(index):
+                return self.array_header(scatter_len(index)), bash_scatter(
+                    path, index, self.array_job_id + "-1", lines_per_task
+                )
+        n_tasks = write_line_index(path, index, lines_per_task)
+        return self.array_header(n_tasks), bash_scatter(
+            path, index, self.array_job_id + "-1", lines_per_task
+        )
 
-    def ord_qsub_command(self, jid: str) -> list:
+    def ord_qsub_command(self, jid: Optional[str], array_jid: Optional[str] = None) -> list:
+        """qsub holding jid and holding each task on the same task of array_jid"""
         cmd = ["qsub"]
-        for s in self.ord_options:
-            if "{JID}" in s:
-                cmd.append(s.replace("{JID}", jid))
-            else:
-                cmd.append(s)
+        if jid:
+            cmd += [s.replace("{JID}", jid) for s in self.ord_options]
+        if array_jid:
+            if self.order_array_options is None:
+                raise ValueError(no_exist_msg("options.order_array"))
+            cmd += [s.replace("{JID}", array_jid) for s in self.order_array_options]
         return cmd
 
+    def alter_hold_command(self, jid: str, target: str) -> list:
+        """command to change hold jids of the pending job target"""
+        if self.alter_hold_options is None:
+            raise ValueError(no_exist_msg("options.alter_hold"))
+        return [s.replace("{JID}", jid) for s in self.alter_hold_options] + [target]
+
+    def qacct_command_of(self, jid: str) -> List[str]:
+        return [s.replace("{JID}", jid) for s in self.qacct_command]
+
     def make_common_variables_list(self):
-        if self.common_variables == {}:
+        if len(self.common_variables) == 0:
             return []
 
         ret = []
@@ -162,6 +379,34 @@ class Config:
     def make_common_variables_params(self):
         return "\n".join(self.make_common_variables_list())
 
+    def bash_array(self, command: str) -> List[str]:
+        """elements of bash array
+        Args:
+            command (str): command
+        Returns:
+            list: elements of array in bash
+
+        >>> bash_array("echo 'a b'")
+        ['a', 'b']
+        """
+        from qsubpy.shell import run_shell
+
+        array_command = " ".join(
+            [f"t=($({command}))", "&&", 'for e in "${t[@]}"; do echo "$e"; done']
+        )
+
+        logger.debug(f"array_command: {array_command}")
+        with span("array_sizing", command=command):
+            proc = run_shell(
+                array_command,
+                self.make_common_variables_list(),
+                persistent=self.persistent_shell,
+            )
+        if proc.returncode != 0:
+            logger.error(f"{array_command} exit code {proc.returncode}")
+            raise ValueError("Please check your array command!")
+        return proc.stdout.decode("utf-8").splitlines()
+
     def bash_array_len(self, command: str) -> int:
         """array length of bash
         Args:
@@ -172,22 +417,7 @@ class Config:
         >>> bash_array_len("echo 'a b'")
         2
         """
-        len_command = self.common_variables_1linear()
-
-        len_command += " ".join([f"t=($({command}))", "&&", "echo ${#t[@]}"])
-
-        logger.debug(f"len_command: {len_command}")
-        proc = subprocess.run(
-            len_command, shell=True, capture_output=True, executable="/bin/bash"
-        )
-        try:
-            ret = int(proc.stdout)
-        except:
-            logger.error(f"{len_command} results cannot to convert integer")
-            raise ValueError(
-                "Invalid literal for int(). Please check your array command!"
-            )
-        return ret
+        return len(self.bash_array(command))
 
     def __str__(self):
         ret = ["-" * 20]
@@ -202,11 +432,41 @@ def get_default_config_path() -> str:
     return path
 
 
+# path -> (mtime_ns, Config)
+_CONFIG_CACHE: Dict[str, Tuple[int, Config]] = {}
+_CONFIG_CACHE_LOCK = threading.Lock()
+
+
 def read_config(path: str = None) -> Config:
-    path = get_default_config_path()
-    config_dict = toml.load(open(path))
+    """read config toml. the parsed config is cached by path and mtime,
+    so the same frozen Config is returned until the file is modified.
+    The default config is generated if it does not exist.
+    """
+    if path is None:
+        path = get_default_config_path()
+        generate_default_config()
+    path = os.path.abspath(os.path.expanduser(path))
+    mtime = os.stat(path).st_mtime_ns
+
+    with _CONFIG_CACHE_LOCK:
+        cached = _CONFIG_CACHE.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with span("config_load", path=path):
+            import toml
+
+            with open(path) as f:
+                config_dict = toml.load(f)
+            config = Config(config_dict)
+        _CONFIG_CACHE[path] = (mtime, config)
+
+    return config
 
-    return Config(config_dict)
+
+def clear_config_cache():
+    with _CONFIG_CACHE_LOCK:
+        _CONFIG_CACHE.clear()
 
 
 SHIROKANE_CONFIG = '''
@@ -232,18 +492,50 @@ header = """
 
 [arrayjob]
 id = "SGE_TASK_ID"
+job_id = "JOB_ID"
 header = "#$ -t {start}-{end}:{step}"
+max_concurrent = "#$ -tc {max_concurrent}"
 
 [options]
-sync = ["-sync", "y"]
 order = ["-hold_jid", "{JID}"]
+order_array = ["-hold_jid_ad", "{JID}"]
+alter_hold = ["qalter", "-hold_jid", "{JID}"]
+
+[monitor]
+qstat = ["qstat"]
+qacct = ["qacct", "-j", "{JID}"]
+interval = 5
+max_interval = 60
+qacct_timeout = 300
 
 [jid]
-"Your (job|job-array) (?P<jid>\\d{8})"
+re = "Your (job|job-array) (?P<jid>\\\\d{8})"
 
 [singularity]
 image_root = "~/singularity_img"
 default_ext = "sif"
+check_image = true
+stage_dir = "${TMPDIR:-/tmp}"
+
+[store]
+dir = "~/.cache/qsubpy/scripts"
+
+[shell]
+persistent = false
+
+[daemon]
+socket = "~/.cache/qsubpy/serve.sock"
+journal = "~/.cache/qsubpy/serve.jsonl"
+rate = 2
+burst = 10
+
+[logs]
+aggregate = false
+dir = ".qsubpy/logs"
+header = """
+#$ -o /dev/null
+#$ -e /dev/null
+"""
 '''
 
 
@@ -253,5 +545,6 @@ def generate_default_config():
     if os.path.exists(path):
         return
 
+    os.makedirs(os.path.dirname(path), exist_ok=True)
     with open(path, "w") as f:
         f.write(SHIROKANE_CONFIG)
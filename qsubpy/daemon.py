@@ -0,0 +1,347 @@
+"""submission daemon
+
+qsubpy serve listens on a unix socket of config, and submits scripts handed
+by qsubpy workflow --via_daemon. Each request is answered with a ticket at
+once, and queued. A single submitter thread runs qsub for the queue in order
+of arrival, at most rate qsub per second (with bursts of burst), so that many
+workflows on the login node never flood the scheduler. Holds on tickets are
+replaced with the jids of their jobs, which are submitted earlier. Submitted
+jobs are recorded to the job journal of the working directory of the client,
+and waits of all clients share the job monitor of the daemon.
+
+Requests and results are appended to the journal of the daemon, so requests
+queued when the daemon stops are submitted when it starts again. A request is
+marked as submitting right before its qsub. A request which was submitting
+when the daemon stopped is never submitted again; its job is looked up in qstat
+by the name of the script, and the request fails if it is not found.
+
+The protocol is a json object per line, like following
+
+    > {"op": "submit", "script": "/path/to/b.sh", "cwd": "/path/to", "hold_jids": ["daemon-42-1700000000-1"]}
+    < {"ticket": "daemon-42-1700000000-2"}
+"""
+import os
+import json
+import time
+import queue
+import shlex
+import socket
+import threading
+import socketserver
+
+from typing import Callable, Dict, List, Optional
+
+from qsubpy.config import Config, read_config
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+TICKET_PREFIX = "daemon-"
+
+
+def is_ticket(jid: str) -> bool:
+    return jid.startswith(TICKET_PREFIX)
+
+
+class DaemonError(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    """rate limit of rate events per second, allowing bursts of burst events"""
+
+    def __init__(self, rate: float, burst: int = 1, clock: Callable[[], float] = time.monotonic):
+        if rate <= 0:
+            raise ValueError("rate of daemon should be positive")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.clock = clock
+        self.tokens = float(self.burst)
+        self.updated = clock()
+
+    def delay(self) -> float:
+        """take a token and return seconds to wait before the event"""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def qsub_in(cwd: str, hold_jids: List[str], array_hold_jids: List[str], script: str, config: Config) -> str:
+    """qsub the script in cwd, which is the working directory of #$ -cwd"""
+    from qsubpy.qsub import get_jid
+    from qsubpy.shell import run_shell
+
+    cmd = config.ord_qsub_command(",".join(hold_jids), ",".join(array_hold_jids)) + [script]
+    # a long-lived daemon always reuses bash sessions
+    p = run_shell(f"cd {shlex.quote(cwd)} && " + " ".join(cmd), persistent=True)
+    if p.returncode != 0:
+        raise DaemonError(f'{" ".join(cmd)} exit code {p.returncode}: {p.stderr.decode("utf-8").strip()}')
+    return get_jid(p.stdout.decode("utf-8"))
+
+
+def submitted_jid(script: str, config: Config) -> Optional[str]:
+    """jid of the job of the script in qstat, whose job name is the name of the script"""
+    from qsubpy.monitor import parse_full_jobnames, query
+
+    out = query(config.qstat_command + ["-r"])
+    if out is None:
+        return None
+    jids = [jid for jid, name in parse_full_jobnames(out).items() if name == os.path.basename(script)]
+    return max(jids, key=int) if jids else None
+
+
+class Daemon:
+    def __init__(
+        self,
+        config: Optional[Config] = None,
+        journal: Optional[str] = None,
+        rate: Optional[float] = None,
+        burst: Optional[int] = None,
+        submit: Callable = qsub_in,
+        lookup: Callable = submitted_jid,
+    ):
+        self.config = config if config is not None else read_config()
+        self.journal = journal if journal is not None else self.config.daemon_journal
+        self.bucket = TokenBucket(
+            rate if rate is not None else self.config.daemon_rate,
+            burst if burst is not None else self.config.daemon_burst,
+        )
+        self._submit = submit
+        self._lookup = lookup
+        self._lock = threading.Lock()
+        self._counter = 0
+        # ticket -> {"jid": ...} or {"error": ...} of handled requests
+        self.results: Dict[str, Dict] = {}
+        self._done = threading.Condition(self._lock)
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self._replay()
+
+    def _append(self, entry: Dict):
+        os.makedirs(os.path.dirname(os.path.abspath(self.journal)), exist_ok=True)
+        with open(self.journal, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def _replay(self):
+        """queue requests which were not handled, and compact the journal to them and their holds"""
+        if not os.path.exists(self.journal):
+            return
+        requests = {}
+        submitting = set()
+        with open(self.journal) as f:
+            for line in f:
+                if line.strip() == "":
+                    continue
+                entry = json.loads(line)
+                if "request" in entry:
+                    requests[entry["ticket"]] = entry["request"]
+                elif "submitting" in entry:
+                    submitting.add(entry["ticket"])
+                else:
+                    self.results[entry["ticket"]] = entry["result"]
+
+        for ticket in requests:
+            if ticket in submitting and ticket not in self.results:
+                self.results[ticket] = self._reconcile(dict(requests[ticket], ticket=ticket))
+        pending = [t for t in requests if t not in self.results]
+        held = {j for t in pending for j in requests[t].get("hold_jids", []) + requests[t].get("array_hold_jids", [])}
+        self.results = {t: r for t, r in self.results.items() if t in held}
+        tmp = f"{self.journal}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            for ticket, result in self.results.items():
+                f.write(json.dumps({"ticket": ticket, "result": result}) + "\n")
+            for ticket in pending:
+                f.write(json.dumps({"ticket": ticket, "request": requests[ticket]}) + "\n")
+                self._queue.put(dict(requests[ticket], ticket=ticket))
+        os.replace(tmp, self.journal)
+        if pending:
+            logger.info(f"resume {len(pending)} requests queued before the daemon stopped")
+
+    def start(self):
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def stop(self):
+        """stop the worker after queued requests are handled"""
+        self._queue.put(None)
+        if self._worker is not None:
+            self._worker.join()
+
+    def enqueue(self, request: Dict) -> str:
+        with self._lock:
+            self._counter += 1
+            ticket = f"{TICKET_PREFIX}{os.getpid()}-{int(time.time())}-{self._counter}"
+            self._append({"ticket": ticket, "request": request})
+        self._queue.put(dict(request, ticket=ticket))
+        return ticket
+
+    def _resolve(self, jids: List[str]) -> List[str]:
+        resolved = []
+        for jid in jids:
+            if not is_ticket(jid):
+                resolved.append(jid)
+                continue
+            result = self.results.get(jid)
+            if result is None or "jid" not in result:
+                raise DaemonError(f"held job {jid} is not submitted")
+            resolved.append(result["jid"])
+        return resolved
+
+    def _reconcile(self, request: Dict) -> Dict:
+        """result of the request which was submitting when the daemon stopped"""
+        try:
+            hold_jids = self._resolve(request.get("hold_jids", []))
+            array_hold_jids = self._resolve(request.get("array_hold_jids", []))
+            jid = self._lookup(request["script"], self.config)
+            if jid is None:
+                raise DaemonError(
+                    f"{request['script']} of {request['ticket']} may be submitted before the daemon stopped, "
+                    "but its job is not found in qstat"
+                )
+            self._record(request, jid, hold_jids, array_hold_jids)
+        except Exception as e:
+            logger.error(f"cannot resume {request['script']} of {request['ticket']}: {e}")
+            return {"error": str(e)}
+        logger.info(f"{request['script']} of {request['ticket']} was submitted as {jid}")
+        return {"jid": jid}
+
+    def _handle(self, request: Dict) -> Dict:
+        hold_jids = self._resolve(request.get("hold_jids", []))
+        array_hold_jids = self._resolve(request.get("array_hold_jids", []))
+        self.bucket.acquire()
+        with self._lock:
+            self._append({"ticket": request["ticket"], "submitting": True})
+        jid = self._submit(request["cwd"], hold_jids, array_hold_jids, request["script"], self.config)
+        self._record(request, jid, hold_jids, array_hold_jids)
+        logger.info(f"submit {request['script']} of {request['ticket']} as {jid}")
+        return {"jid": jid}
+
+    def _record(self, request: Dict, jid: str, hold_jids: List[str], array_hold_jids: List[str]):
+        from qsubpy.journal import JOURNAL_DIR, record_job
+        from qsubpy.store import record_submission
+
+        record = dict(request.get("record", {}))
+        if array_hold_jids:
+            record["array_hold_jids"] = array_hold_jids
+        record_job(
+            jid,
+            request["script"],
+            hold_jids=hold_jids,
+            root=os.path.join(request["cwd"], JOURNAL_DIR),
+            backend="sge",
+            ticket=request["ticket"],
+            **record,
+        )
+        record_submission(self.config.store_dir, jid, request["script"])
+
+    def _run(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                return
+            try:
+                result = self._handle(request)
+            except Exception as e:
+                logger.error(f"cannot submit {request['script']} of {request['ticket']}: {e}")
+                result = {"error": str(e)}
+            with self._lock:
+                self._append({"ticket": request["ticket"], "result": result})
+                self.results[request["ticket"]] = result
+                self._done.notify_all()
+
+    def result(self, ticket: str, timeout: Optional[float] = None) -> Dict:
+        """result of the ticket, after waiting until it is handled"""
+        with self._lock:
+            if not self._done.wait_for(lambda: ticket in self.results, timeout=timeout):
+                raise DaemonError(f"{ticket} is not handled in {timeout} seconds")
+            return self.results[ticket]
+
+    def dispatch(self, request: Dict) -> Dict:
+        op = request.get("op")
+        if op == "ping":
+            return {"pid": os.getpid(), "queued": self.queued()}
+        if op == "submit":
+            keys = ["script", "cwd", "hold_jids", "array_hold_jids", "record"]
+            return {"ticket": self.enqueue({k: request[k] for k in keys if k in request})}
+        if op == "wait":
+            from qsubpy.monitor import get_monitor
+
+            jids = {}
+            for ticket in request["jids"]:
+                result = self.result(ticket) if is_ticket(ticket) else {"jid": ticket}
+                if "error" in result:
+                    raise DaemonError(result["error"])
+                jids[ticket] = result["jid"]
+            status = get_monitor().wait(jids.values())
+            return {"status": {ticket: status[jid] for ticket, jid in jids.items()}}
+        raise DaemonError(f"invalid op {op}")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.qsubpy_daemon.dispatch(json.loads(line))
+            except Exception as e:
+                response = {"error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(daemon: Daemon, path: str) -> _Server:
+    """listen on the unix socket of path. A stale socket of a stopped daemon is removed."""
+    path = os.path.expanduser(path)
+    if os.path.exists(path):
+        try:
+            request("ping", path=path)
+        except DaemonError:
+            os.remove(path)
+        else:
+            raise DaemonError(f"qsubpy serve is already running on {path}")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    old = os.umask(0o177)
+    try:
+        server = _Server(path, _Handler)
+    finally:
+        os.umask(old)
+    server.qsubpy_daemon = daemon
+    daemon.start()
+    return server
+
+
+def request(op: str, path: Optional[str] = None, timeout: Optional[float] = None, **payload) -> Dict:
+    """send a request to the daemon and return its response"""
+    if path is None:
+        path = read_config().daemon_socket
+    path = os.path.expanduser(path)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect(path)
+            s.sendall((json.dumps(dict(payload, op=op)) + "\n").encode("utf-8"))
+            with s.makefile("rb") as f:
+                line = f.readline()
+    except OSError as e:
+        raise DaemonError(f"cannot connect to qsubpy serve on {path}: {e}")
+    if line == b"":
+        raise DaemonError(f"qsubpy serve on {path} closed the connection")
+    response = json.loads(line)
+    if "error" in response:
+        raise DaemonError(response["error"])
+    return response
@@ -0,0 +1,96 @@
+"""dependency graph of workflow stages"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional, TypeVar
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+R = TypeVar("R")
+
+
+def build_dag(names: List[str], needs: List[Optional[List[str]]]) -> Dict[str, List[str]]:
+    """build {stage: [parent stages]}.
+    A stage without needs depends on the previous stage, same as the ordered workflow.
+
+    >>> build_dag(["a", "b", "c"], [None, [], ["a", "b"]])
+    {'a': [], 'b': [], 'c': ['a', 'b']}
+    """
+    if len(set(names)) != len(names):
+        raise ValueError("stage names should be unique in workflow")
+
+    dag = {}
+    for i, (name, parents) in enumerate(zip(names, needs)):
+        if parents is None:
+            parents = [] if i == 0 else [names[i - 1]]
+        for parent in parents:
+            if parent not in names:
+                raise ValueError(f"{name} needs unknown stage {parent}")
+        dag[name] = list(parents)
+    return dag
+
+
+def topological_sort(dag: Dict[str, List[str]]) -> List[str]:
+    """sort stages so that every stage comes after its parents.
+    The order of stages in the workflow is kept as far as possible.
+    """
+    indegree = {name: len(parents) for name, parents in dag.items()}
+    children: Dict[str, List[str]] = {name: [] for name in dag}
+    for name, parents in dag.items():
+        for parent in parents:
+            children[parent].append(name)
+
+    ready = [name for name in dag if indegree[name] == 0]
+    order = []
+    while ready:
+        name = ready.pop(0)
+        order.append(name)
+        for child in children[name]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+
+    if len(order) != len(dag):
+        cycle = [name for name in dag if name not in order]
+        raise ValueError(f"workflow has a cycle in {cycle}")
+    return order
+
+
+def run_dag(
+    dag: Dict[str, List[str]],
+    run: Callable[[str, List[R]], R],
+    max_workers: Optional[int] = None,
+) -> Dict[str, R]:
+    """run every stage as soon as all of its parents are finished.
+    run is called with the stage name and the results of its parents.
+    If max_workers is 1, stages are run one by one in topological order.
+    """
+    order = topological_sort(dag)
+    results: Dict[str, R] = {}
+
+    if max_workers == 1:
+        for name in order:
+            results[name] = run(name, [results[p] for p in dag[name]])
+        return results
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        pending = list(order)
+        while pending or running:
+            for name in list(pending):
+                if all(p in results for p in dag[name]):
+                    pending.remove(name)
+                    parents = [results[p] for p in dag[name]]
+                    running[executor.submit(run, name, parents)] = name
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception:
+                    logger.error(f"{name} failed, wait for running stages...")
+                    pending.clear()
+                    wait(running)
+                    raise
+    return results
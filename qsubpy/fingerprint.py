@@ -0,0 +1,117 @@
+"""fingerprints of workflow stages for incremental re-runs
+
+A stage is up to date if the fingerprint of its rendered script, common variables,
+singularity image and inputs is the same as the last run, and all of its outputs exist.
+"""
+import os
+import json
+import glob
+import hashlib
+import threading
+
+from typing import Dict, List, Optional
+
+from qsubpy.utils import STATE_DIR
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_DIR = os.path.join(STATE_DIR, "fingerprints")
+
+
+def expand_globs(patterns: List[str]) -> List[str]:
+    paths = []
+    for pattern in patterns:
+        paths += sorted(glob.glob(os.path.expanduser(pattern)))
+    return paths
+
+
+def outputs_intact(patterns: List[str]) -> bool:
+    """all output patterns match at least one file"""
+    return all(len(glob.glob(os.path.expanduser(p))) > 0 for p in patterns)
+
+
+def _file_stat(path: str) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def stage_fingerprint(
+    script: str,
+    common_variables: Dict,
+    image: Optional[str] = None,
+    inputs: Optional[List[str]] = None,
+) -> str:
+    """sha256 of the rendered script, common variables, singularity image and
+    size and mtime of inputs.
+    """
+    inputs = [] if inputs is None else inputs
+    contents = {
+        "script": script,
+        "common_variables": {k: str(v) for k, v in common_variables.items()},
+        "image": None,
+        "inputs": {path: _file_stat(path) for path in expand_globs(inputs)},
+    }
+    if image is not None:
+        image = os.path.expanduser(image)
+        contents["image"] = [image, _file_stat(image)]
+
+    h = hashlib.sha256(json.dumps(contents, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class FingerprintStore:
+    """fingerprint and jid of the last run of each stage"""
+
+    def __init__(self, root: str = FINGERPRINT_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, stage: str) -> str:
+        return os.path.join(self.root, stage + ".json")
+
+    def get(self, stage: str) -> Optional[Dict]:
+        try:
+            with open(self._path(stage)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, stage: str, fingerprint: str, jid: Optional[str] = None):
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            tmp = self._path(stage) + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"fingerprint": fingerprint, "jid": jid}, f)
+            os.replace(tmp, self._path(stage))
+
+    def up_to_date(self, stage: str, fingerprint: str, outputs: List[str]) -> bool:
+        record = self.get(stage)
+        if record is None or record.get("fingerprint") != fingerprint:
+            return False
+        if not outputs_intact(outputs):
+            return False
+
+        from qsubpy.daemon import is_ticket
+        from qsubpy.journal import job_of_ticket
+
+        jid = record.get("jid")
+        if jid is not None and is_ticket(jid):
+            # the job submitted via the daemon is recorded to the job journal by its ticket
+            ticket, jid = jid, job_of_ticket(jid)
+            if jid is None:
+                logger.debug(f"last run of {stage} ({ticket}) is not submitted")
+                return False
+        if jid is not None:
+            from qsubpy.monitor import get_monitor
+
+            status = get_monitor().exit_status(jid)
+            # no accounting record means the last run is unknown, not succeeded
+            if status != 0:
+                logger.debug(f"last run of {stage} ({jid}) exit code {status}")
+                return False
+        return True
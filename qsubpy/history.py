@@ -0,0 +1,242 @@
+"""resource usage history of finished jobs
+
+maxvmem, ru_wallclock and cpu of each finished task are collected from qacct
+to .qsubpy/history.jsonl, keyed by stage name and the fingerprint of its command.
+The history is used to suggest mem and slot of the next run.
+"""
+import os
+import re
+import json
+import math
+import hashlib
+
+from typing import Dict, List, Optional, Tuple
+
+from qsubpy.config import Config, read_config
+from qsubpy.utils import STATE_DIR
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+HISTORY_PATH = os.path.join(STATE_DIR, "history.jsonl")
+
+UNITS = {"": 1, "B": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def command_fingerprint(cmd: List[str]) -> str:
+    return hashlib.sha256("\n".join(cmd).encode("utf-8")).hexdigest()[:16]
+
+
+def parse_bytes(value: str) -> float:
+    """parse memory like 1.953G, 512.000M or 1024"""
+    m = re.match(r"^([\d.]+)\s*([BKMGT]?)", value.strip().upper())
+    if m is None:
+        raise ValueError(f"invalid memory {value}")
+    return float(m.group(1)) * UNITS[m.group(2)]
+
+
+def parse_seconds(value: str) -> float:
+    """parse time like 12s, 1.23 or 12.000s"""
+    return float(value.strip().rstrip("s"))
+
+
+def format_bytes(value: float) -> str:
+    """format memory to the unit of resource request, e.g. 4G or 512M"""
+    if value >= UNITS["G"]:
+        return f"{math.ceil(value / UNITS['G'])}G"
+    return f"{max(1, math.ceil(value / UNITS['M']))}M"
+
+
+def parse_qacct_records(out: str) -> List[Dict[str, str]]:
+    """split qacct output into records. records are separated by ==== lines."""
+    records = []
+    record: Dict[str, str] = {}
+    for line in out.splitlines():
+        if line.startswith("="):
+            if record:
+                records.append(record)
+            record = {}
+            continue
+        m = re.match(r"^(\w+)\s+(.*?)\s*$", line)
+        if m is not None:
+            record[m.group(1)] = m.group(2)
+    if record:
+        records.append(record)
+    return records
+
+
+def usage_of(record: Dict[str, str]) -> Optional[Dict]:
+    try:
+        return {
+            "task": None if record.get("taskid", "undefined") == "undefined" else int(record["taskid"]),
+            "maxvmem": parse_bytes(record["maxvmem"]),
+            "wallclock": parse_seconds(record["ru_wallclock"]),
+            "cpu": parse_seconds(record["cpu"]),
+            "slots": int(record.get("slots", "1")),
+        }
+    except (KeyError, ValueError):
+        return None
+
+
+def collect(job: Dict, config: Optional[Config] = None, path: str = HISTORY_PATH) -> Optional[int]:
+    """append resource usage of the recorded job to history.
+    returns the number of tasks, or None if qacct fails.
+    """
+    from qsubpy.metrics import record_tasks
+    from qsubpy.monitor import query
+
+    if config is None:
+        config = read_config()
+
+    out = query(config.qacct_command_of(job["jid"]))
+    if out is None:
+        return None
+
+    records = parse_qacct_records(out)
+    record_tasks(job, records)
+    usages = [usage_of(r) for r in records]
+    usages = [u for u in usages if u is not None]
+    elements = _elements_of(job)
+    for usage in usages:
+        if usage["task"] is not None and usage["task"] in elements:
+            usage["element"] = elements[usage["task"]]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        for usage in usages:
+            usage.update(
+                {
+                    "jid": job["jid"],
+                    "stage": job.get("stage"),
+                    "fingerprint": job.get("fingerprint"),
+                    "mem": job.get("mem"),
+                    "slot": job.get("slot"),
+                }
+            )
+            f.write(json.dumps(usage) + "\n")
+    return len(usages)
+
+
+def _elements_of(job: Dict) -> Dict[int, str]:
+    """{task: element} of the job whose tasks read one element each from a manifest"""
+    from qsubpy.manifest import manifest_of_script, manifest_len, read_element
+
+    try:
+        with open(job["script"]) as f:
+            manifest = manifest_of_script(f.read())
+        if manifest is None:
+            return {}
+        tasks = job.get("tasks") or range(1, manifest_len(manifest) + 1)
+        return {task: read_element(manifest, task) for task in tasks}
+    except (OSError, IndexError):
+        return {}
+
+
+def collect_finished(config: Optional[Config] = None, path: str = HISTORY_PATH) -> int:
+    """collect all journaled jobs which are finished and not collected yet"""
+    from qsubpy.journal import list_jobs, update_job
+    from qsubpy.monitor import get_monitor
+
+    active = get_monitor().active_jids()
+    n = 0
+    for job in list_jobs():
+        if job.get("collected") or job["jid"] in active:
+            continue
+        collected = collect(job, config, path)
+        if collected is None:
+            continue
+        n += collected
+        update_job(job["jid"], collected=True)
+    return n
+
+
+def load_history(path: str = HISTORY_PATH) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """nearest-rank percentile"""
+    values = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(values)))
+    return values[rank - 1]
+
+
+def suggest(
+    stage: str,
+    fingerprint: Optional[str] = None,
+    q: float = 95,
+    headroom: float = 1.2,
+    history: Optional[List[Dict]] = None,
+) -> Optional[Tuple[str, str]]:
+    """suggest (mem, slot) from the q percentile of past usage of the stage plus headroom.
+    Runs with the same fingerprint are preferred if there are any.
+    """
+    if history is None:
+        history = load_history()
+
+    records = [r for r in history if r["stage"] == stage]
+    same = [r for r in records if fingerprint is not None and r.get("fingerprint") == fingerprint]
+    if len(same) > 0:
+        records = same
+    if len(records) == 0:
+        return None
+
+    mem = percentile([r["maxvmem"] for r in records], q) * headroom
+    parallelism = [r["cpu"] / r["wallclock"] for r in records if r["wallclock"] > 0]
+    slot = 1
+    if len(parallelism) > 0:
+        slot = max(1, math.ceil(percentile(parallelism, q)))
+    return format_bytes(mem), str(slot)
+
+
+def report(history: Optional[List[Dict]] = None) -> List[Dict]:
+    """used and wasted resources per stage"""
+    if history is None:
+        history = load_history()
+
+    stages: Dict[str, List[Dict]] = {}
+    for r in history:
+        stages.setdefault(r["stage"], []).append(r)
+
+    rows = []
+    for stage, records in stages.items():
+        requested_mem = [parse_bytes(r["mem"]) for r in records if r.get("mem") is not None]
+        used_mem = sum(r["maxvmem"] for r in records)
+        slot_seconds = sum(r["wallclock"] * r["slots"] for r in records)
+        cpu = sum(r["cpu"] for r in records)
+        row = {
+            "stage": stage,
+            "tasks": len(records),
+            "max_mem": format_bytes(max(r["maxvmem"] for r in records)),
+            "mem_used": None,
+            "cpu_used": None if slot_seconds == 0 else cpu / slot_seconds,
+        }
+        if len(requested_mem) == len(records) and sum(requested_mem) > 0:
+            row["mem_used"] = used_mem / sum(requested_mem)
+        rows.append(row)
+    return rows
+
+
+def format_report(rows: List[Dict]) -> str:
+    def ratio(v: Optional[float]) -> str:
+        return "-" if v is None else f"{v * 100:.1f}%"
+
+    lines = ["\t".join(["stage", "tasks", "max_mem", "mem_used", "mem_wasted", "cpu_used"])]
+    for row in rows:
+        wasted = None if row["mem_used"] is None else 1 - row["mem_used"]
+        lines.append(
+            "\t".join(
+                [
+                    str(row["stage"]),
+                    str(row["tasks"]),
+                    row["max_mem"],
+                    ratio(row["mem_used"]),
+                    ratio(wasted),
+                    ratio(row["cpu_used"]),
+                ]
+            )
+        )
+    return "\n".join(lines)
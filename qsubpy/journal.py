@@ -0,0 +1,93 @@
+"""journal of submitted jobs
+
+Each submitted job is recorded to .qsubpy/jobs/<jid>.json, so that later commands
+(retry, report, gc, ...) can find the script, stage and dependencies of a job.
+"""
+import os
+import json
+import time
+
+from typing import Dict, List, Optional
+
+from qsubpy.utils import STATE_DIR
+
+JOURNAL_DIR = os.path.join(STATE_DIR, "jobs")
+
+
+def _path(jid: str, root: str) -> str:
+    return os.path.join(root, jid + ".json")
+
+
+def record_job(
+    jid: str,
+    script: str,
+    stage: Optional[str] = None,
+    hold_jids: Optional[List[str]] = None,
+    root: str = JOURNAL_DIR,
+    **extra,
+) -> Dict:
+    """record the submitted job. stage defaults to the name of the script."""
+    if stage is None:
+        stage = os.path.splitext(os.path.basename(script))[0]
+    record = {
+        "jid": jid,
+        "script": os.path.abspath(script),
+        "stage": stage,
+        "hold_jids": hold_jids if hold_jids is not None else [],
+        "submitted_at": time.time(),
+    }
+    record.update(extra)
+
+    os.makedirs(root, exist_ok=True)
+    tmp = _path(jid, root) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(record, f)
+    os.replace(tmp, _path(jid, root))
+    return record
+
+
+def load_job(jid: str, root: str = JOURNAL_DIR) -> Dict:
+    try:
+        with open(_path(jid, root)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"job {jid} is not found in {root}")
+
+
+def update_job(jid: str, root: str = JOURNAL_DIR, **values) -> Dict:
+    record = load_job(jid, root)
+    record.update(values)
+    tmp = _path(jid, root) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(record, f)
+    os.replace(tmp, _path(jid, root))
+    return record
+
+
+def list_jobs(root: str = JOURNAL_DIR) -> List[Dict]:
+    """all recorded jobs, oldest first"""
+    if not os.path.isdir(root):
+        return []
+
+    records = []
+    for entry in os.listdir(root):
+        if not entry.endswith(".json"):
+            continue
+        with open(os.path.join(root, entry)) as f:
+            records.append(json.load(f))
+    return sorted(records, key=lambda r: r["submitted_at"])
+
+
+def latest_job_of_stage(stage: str, root: str = JOURNAL_DIR) -> Dict:
+    records = [r for r in list_jobs(root) if r.get("stage") == stage]
+    if len(records) == 0:
+        raise ValueError(f"no job of stage {stage} is found in {root}")
+    return records[-1]
+
+
+def job_of_ticket(ticket: str, root: str = JOURNAL_DIR) -> Optional[str]:
+    """jid of the job submitted by qsubpy serve for the ticket, or None if not submitted yet"""
+    for record in list_jobs(root):
+        if record.get("ticket") == ticket:
+            return record["jid"]
+    return None
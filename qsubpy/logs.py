@@ -0,0 +1,90 @@
+"""aggregated logs of array tasks
+
+With aggregate logs, tasks of an array job do not write their own
+<script>.o<jid>.<task> and .e<jid>.<task>. Each task writes stdout and stderr
+to node local files, and at exit appends them under flock to the bundle of
+the job as two gzip members:
+
+    <log dir>/<stage>.<jid>.log.gz      concatenated gzip members
+    <log dir>/<stage>.<jid>.log.gz.idx  fixed width record of each task
+
+The record of task i is at (i - 1) * INDEX_RECORD in the index, like
+"<offset>\t<stdout length>\t<stderr length>\t<exit code>\n", so the log of a
+task is read with two seeks. Records of unfinished tasks are NUL bytes.
+"""
+import os
+import re
+import gzip
+
+from typing import Dict, Iterator, Optional, Tuple
+
+from qsubpy.utils import STATE_DIR
+
+LOG_DIR = os.path.join(STATE_DIR, "logs")
+
+# digits of offset and lengths, and of exit code
+LENGTH_WIDTH = 16
+STATUS_WIDTH = 3
+INDEX_RECORD = (LENGTH_WIDTH + 1) * 3 + STATUS_WIDTH + 1
+
+
+def index_path(bundle: str) -> str:
+    return bundle + ".idx"
+
+
+def bundle_path(stage: str, jid: str, log_dir: str = LOG_DIR) -> str:
+    return os.path.join(log_dir, f"{stage}.{jid}.log.gz")
+
+
+def _parse_record(record: bytes) -> Optional[Dict[str, int]]:
+    if len(record) != INDEX_RECORD or record.startswith(b"\0"):
+        return None
+    offset, out_len, err_len, status = (int(v) for v in record.split())
+    return {"offset": offset, "stdout": out_len, "stderr": err_len, "status": status}
+
+
+def read_record(bundle: str, task_id: int) -> Optional[Dict[str, int]]:
+    """record of task_id (1-origin), or None if the task has not finished"""
+    path = index_path(bundle)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        f.seek((task_id - 1) * INDEX_RECORD)
+        return _parse_record(f.read(INDEX_RECORD))
+
+
+def records(bundle: str) -> Iterator[Tuple[int, Dict[str, int]]]:
+    """(task id, record) of finished tasks"""
+    path = index_path(bundle)
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        task_id = 0
+        while True:
+            record = f.read(INDEX_RECORD)
+            if len(record) == 0:
+                return
+            task_id += 1
+            parsed = _parse_record(record)
+            if parsed is not None:
+                yield task_id, parsed
+
+
+def read_task_log(bundle: str, record: Dict[str, int]) -> Tuple[str, str]:
+    """stdout and stderr of the task of record"""
+    with open(bundle, "rb") as f:
+        f.seek(record["offset"])
+        out = f.read(record["stdout"])
+        err = f.read(record["stderr"])
+    return (
+        gzip.decompress(out).decode("utf-8", errors="replace"),
+        gzip.decompress(err).decode("utf-8", errors="replace"),
+    )
+
+
+def bundle_of_script(script: str, jid: str) -> Optional[str]:
+    """bundle of the job of the script whose tasks aggregate logs, or None"""
+    m = re.search(r"^qsubpy_log=(\S+)$", script, flags=re.MULTILINE)
+    if m is None:
+        return None
+    return re.sub(r"\$\{\w+\}", jid, m.group(1), count=1)
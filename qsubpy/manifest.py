@@ -0,0 +1,102 @@
+"""element manifest for array jobs
+
+A manifest freezes the element list of an array job at submission time.
+It is made of two files:
+
+    <path>      elements, one per line
+    <path>.idx  fixed width byte offsets of each line in <path>
+
+Each record of the index has the same width, so a task can read its own
+offset with a single seek and then read only its own line from the manifest.
+"""
+import os
+import re
+import hashlib
+
+from typing import List, Optional
+
+# digits of a byte offset. each index record is INDEX_WIDTH digits and "\n"
+INDEX_WIDTH = 16
+INDEX_RECORD = INDEX_WIDTH + 1
+
+
+def index_path(path: str) -> str:
+    return path + ".idx"
+
+
+def content_manifest_path(elements: List[str], directory: str) -> str:
+    """path of the manifest named by sha256 of the elements"""
+    h = hashlib.sha256("\n".join(elements).encode("utf-8")).hexdigest()
+    return os.path.join(directory, h + ".manifest")
+
+
+def write_manifest(elements: List[str], path: str) -> int:
+    """write elements and its offset index.
+    Args:
+        elements (list): elements of array job. Must not contain newline.
+        path (str): path to the manifest
+    Returns:
+        int: number of elements
+    """
+    offset = 0
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as manifest, open(index_path(tmp), "wb") as index:
+        for elem in elements:
+            line = (elem + "\n").encode("utf-8")
+            index.write(str(offset).zfill(INDEX_WIDTH).encode("ascii") + b"\n")
+            manifest.write(line)
+            offset += len(line)
+    # the index is replaced last, so a complete index means a complete manifest
+    os.replace(tmp, path)
+    os.replace(index_path(tmp), index_path(path))
+    return len(elements)
+
+
+def read_element(path: str, task_id: int) -> str:
+    """read the element of task_id (1-origin) from the manifest"""
+    with open(index_path(path), "rb") as index:
+        index.seek((task_id - 1) * INDEX_RECORD)
+        record = index.read(INDEX_WIDTH)
+    if len(record) != INDEX_WIDTH:
+        raise IndexError(f"task {task_id} is out of range of {path}")
+
+    with open(path, "rb") as manifest:
+        manifest.seek(int(record))
+        return manifest.readline().decode("utf-8").rstrip("\n")
+
+
+def manifest_len(path: str) -> int:
+    return os.path.getsize(index_path(path)) // INDEX_RECORD
+
+
+def bash_lookup(path: str, index: str, count: Optional[int] = None) -> str:
+    """bash lines to read elements from the manifest.
+    index is a bash arithmetic expression of the 0-origin element index.
+    If count is None, set elem to the element, like following
+
+    offset=$(dd if=/path/to/manifest.idx bs=17 skip=$(($SGE_TASK_ID-1)) count=1 2>/dev/null)
+    IFS= read -r elem < <(tail -c +$((10#$offset+1)) /path/to/manifest)
+
+    else set qsubpy_chunk to count elements from the index.
+    """
+    offset = (
+        f"offset=$(dd if={index_path(path)} bs={INDEX_RECORD} "
+        + "skip=$(("
+        + index
+        + ")) count=1 2>/dev/null)"
+    )
+    if count is None:
+        elem = "IFS= read -r elem < <(tail -c +$((10#$offset+1)) " + path + ")"
+    else:
+        elem = (
+            "mapfile -t qsubpy_chunk < <(tail -c +$((10#$offset+1)) "
+            + path
+            + f" | head -n {count})"
+        )
+    return "\n".join([offset, elem])
+
+
+def manifest_of_script(script: str) -> Optional[str]:
+    """manifest of the script whose tasks read one element each, or None"""
+    m = re.search(r"dd if=(\S+)\.idx bs=\d+ .*\nIFS= read -r elem", script)
+    return m.group(1) if m is not None else None
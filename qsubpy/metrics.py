@@ -0,0 +1,132 @@
+"""timing metrics of stages and tasks
+
+Metrics are appended to .qsubpy/metrics.jsonl as json lines. Stages record
+render_seconds (make sh file), qsub_seconds (round trip of qsub),
+submit_seconds (from the start of the stage to its jid) and, in sync mode,
+wait_seconds (from the submission to the end of the job). Tasks record
+queue_wait_seconds and wallclock_seconds from qacct, when resource usage
+is collected. Metrics can be exported as a prometheus textfile for the
+textfile collector of node exporter.
+"""
+import os
+import json
+import time
+import threading
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from qsubpy.utils import STATE_DIR
+
+METRICS_PATH = os.path.join(STATE_DIR, "metrics.jsonl")
+
+# qacct of SGE and UGE
+QACCT_TIME_FORMATS = ["%a %b %d %H:%M:%S %Y", "%m/%d/%Y %H:%M:%S.%f", "%m/%d/%Y %H:%M:%S"]
+
+_LOCK = threading.Lock()
+
+
+def record(kind: str, path: str = METRICS_PATH, **values) -> Dict:
+    metric = {"kind": kind, "time": time.time()}
+    metric.update(values)
+    with _LOCK:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps(metric) + "\n")
+    return metric
+
+
+def load_metrics(path: str = METRICS_PATH) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip() != ""]
+
+
+def parse_qacct_time(value: str) -> Optional[float]:
+    for fmt in QACCT_TIME_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt).timestamp()
+        except ValueError:
+            continue
+    return None
+
+
+def task_metrics(job: Dict, records: List[Dict[str, str]]) -> List[Dict]:
+    """queue wait and wallclock of each task from qacct records"""
+    from qsubpy.history import parse_seconds
+
+    metrics = []
+    for r in records:
+        submitted = parse_qacct_time(r.get("qsub_time", ""))
+        started = parse_qacct_time(r.get("start_time", ""))
+        try:
+            wallclock = parse_seconds(r["ru_wallclock"])
+        except (KeyError, ValueError):
+            wallclock = None
+        metrics.append(
+            {
+                "jid": job["jid"],
+                "stage": job.get("stage"),
+                "task": None if r.get("taskid", "undefined") == "undefined" else int(r["taskid"]),
+                "queue_wait_seconds": None if submitted is None or started is None else started - submitted,
+                "wallclock_seconds": wallclock,
+            }
+        )
+    return metrics
+
+
+def record_tasks(job: Dict, records: List[Dict[str, str]], path: str = METRICS_PATH) -> int:
+    metrics = task_metrics(job, records)
+    for metric in metrics:
+        record("task", path, **metric)
+    return len(metrics)
+
+
+def _labels(stage: Optional[str]) -> str:
+    stage = str(stage).replace("\\", "\\\\").replace('"', '\\"')
+    return f'{{stage="{stage}"}}'
+
+
+def prometheus_text(metrics: List[Dict]) -> str:
+    """latest stage timings as gauges and task timings as summaries per stage"""
+    stages: Dict[str, Dict] = {}
+    tasks: Dict[str, Dict[str, List[float]]] = {}
+    for m in metrics:
+        if m["kind"] == "stage":
+            stages[m["stage"]] = m
+        elif m["kind"] == "task":
+            t = tasks.setdefault(m["stage"], {"queue_wait_seconds": [], "wallclock_seconds": []})
+            for key in t:
+                if m.get(key) is not None:
+                    t[key].append(m[key])
+
+    lines = []
+    for key in ["render_seconds", "qsub_seconds", "submit_seconds", "wait_seconds"]:
+        name = f"qsubpy_stage_{key}"
+        values = [(stage, m[key]) for stage, m in stages.items() if m.get(key) is not None]
+        if len(values) == 0:
+            continue
+        lines.append(f"# TYPE {name} gauge")
+        lines += [f"{name}{_labels(stage)} {value}" for stage, value in values]
+
+    for key in ["queue_wait_seconds", "wallclock_seconds"]:
+        name = f"qsubpy_task_{key}"
+        values = [(stage, t[key]) for stage, t in tasks.items() if len(t[key]) > 0]
+        if len(values) == 0:
+            continue
+        lines.append(f"# TYPE {name} summary")
+        for stage, v in values:
+            lines.append(f"{name}_sum{_labels(stage)} {sum(v)}")
+            lines.append(f"{name}_count{_labels(stage)} {len(v)}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str, metrics: Optional[List[Dict]] = None):
+    """write atomically, so node exporter never reads a partial file"""
+    if metrics is None:
+        metrics = load_metrics()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(prometheus_text(metrics))
+    os.replace(tmp, path)
@@ -0,0 +1,197 @@
+"""job monitor
+
+Track any number of submitted jobs with a single periodic qstat query
+instead of keeping one blocking `qsub -sync y` per job.
+"""
+import re
+import time
+import threading
+import subprocess
+
+from typing import Dict, Iterable, List, Optional, Set
+
+from qsubpy.config import Config, read_config
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def query(cmd: List[str]) -> Optional[str]:
+    """stdout of the scheduler query. None if the query fails."""
+    try:
+        p = subprocess.run(cmd, capture_output=True)
+    except OSError as e:
+        logger.warning(f'{" ".join(cmd)} failed: {e}')
+        return None
+    if p.returncode != 0:
+        logger.warning(f'{" ".join(cmd)} exit code {p.returncode}')
+        return None
+    return p.stdout.decode("utf-8")
+
+
+def parse_qstat(out: str) -> Set[str]:
+    """jids in qstat output. jid is the first column of each job line."""
+    jids = set()
+    for line in out.splitlines():
+        cols = line.split()
+        if len(cols) > 0 and cols[0].isdigit():
+            jids.add(cols[0])
+    return jids
+
+
+def parse_full_jobnames(out: str) -> Dict[str, str]:
+    """jid -> full job name in qstat -r output"""
+    names = {}
+    jid = None
+    for line in out.splitlines():
+        cols = line.split()
+        if len(cols) > 0 and cols[0].isdigit():
+            jid = cols[0]
+        elif jid is not None and line.strip().startswith("Full jobname:"):
+            names[jid] = line.split(":", 1)[1].strip()
+    return names
+
+
+def parse_qacct(out: str) -> Dict[str, List[str]]:
+    """values of each key in qacct output. array jobs have one record per task."""
+    records: Dict[str, List[str]] = {}
+    for line in out.splitlines():
+        m = re.match(r"^(\w+)\s+(.*?)\s*$", line)
+        if m is None:
+            continue
+        records.setdefault(m.group(1), []).append(m.group(2))
+    return records
+
+
+def exit_status_of(records: Dict[str, List[str]]) -> Optional[int]:
+    """worst exit status of all tasks. None if qacct has no record."""
+    statuses = []
+    for key in ["exit_status", "failed"]:
+        for value in records.get(key, []):
+            try:
+                statuses.append(int(value.split()[0]))
+            except (IndexError, ValueError):
+                continue
+    if len(statuses) == 0:
+        return None
+    return max(statuses)
+
+
+class JobMonitor:
+    """poll qstat in a background thread while there are unfinished jobs.
+    The interval starts from config.poll_interval, and is extended up to
+    config.max_poll_interval while no job finishes.
+    A job which left qstat is finished when qacct has its record. If qacct has
+    no record for config.qacct_timeout seconds, its exit status is None.
+    """
+
+    def __init__(self, config: Optional[Config] = None):
+        self.config = config if config is not None else read_config()
+        self._cond = threading.Condition()
+        self._running: Set[str] = set()
+        self._finished: Dict[str, Optional[int]] = {}
+        # jid -> time when the job left qstat, of jobs without qacct record
+        self._left: Dict[str, float] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def track(self, jids: Iterable[str]):
+        with self._cond:
+            for jid in jids:
+                if jid not in self._finished:
+                    self._running.add(jid)
+            if self._running and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._poll_loop, daemon=True)
+                self._thread.start()
+
+    def active_jids(self) -> Set[str]:
+        p = subprocess.run(self.config.qstat_command, capture_output=True)
+        if p.returncode != 0:
+            raise RuntimeError(
+                f'{" ".join(self.config.qstat_command)} exit code {p.returncode}'
+            )
+        return parse_qstat(p.stdout.decode("utf-8"))
+
+    def exit_status(self, jid: str) -> Optional[int]:
+        out = query(self.config.qacct_command_of(jid))
+        if out is None:
+            return None
+        return exit_status_of(parse_qacct(out))
+
+    def poll(self) -> Set[str]:
+        """query qstat once and return newly finished jids"""
+        active = self.active_jids()
+        with self._cond:
+            left = self._running - active
+        now = time.time()
+        statuses = {}
+        for jid in left:
+            status = self.exit_status(jid)
+            since = self._left.setdefault(jid, now)
+            if status is not None:
+                statuses[jid] = status
+            elif now - since >= self.config.qacct_timeout:
+                logger.error(f"no qacct record of {jid} in {self.config.qacct_timeout} seconds")
+                statuses[jid] = None
+
+        with self._cond:
+            for jid, status in statuses.items():
+                logger.debug(f"{jid} finished with exit status {status}")
+                self._running.discard(jid)
+                self._left.pop(jid, None)
+                self._finished[jid] = status
+            self._cond.notify_all()
+        return set(statuses)
+
+    def _poll_loop(self):
+        interval = self.config.poll_interval
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                self._cond.wait(interval)
+            try:
+                finished = self.poll()
+            except Exception as e:
+                logger.error(f"failed to poll jobs: {e}")
+                finished = set()
+
+            if finished:
+                interval = self.config.poll_interval
+            else:
+                interval = min(interval * 1.5, self.config.max_poll_interval)
+
+    def wait(self, jids: Iterable[str], timeout: Optional[float] = None) -> Dict[str, Optional[int]]:
+        """wait until all jids finish and return their exit status.
+        exit status is None if the scheduler accounting has no record, which is not a success.
+        """
+        jids = set(jids)
+        self.track(jids)
+        with self._cond:
+            done = self._cond.wait_for(lambda: jids <= self._finished.keys(), timeout)
+            if not done:
+                raise TimeoutError(f"{sorted(jids - self._finished.keys())} are not finished")
+            return {jid: self._finished[jid] for jid in jids}
+
+    def wait_any(self, jids: Iterable[str], timeout: Optional[float] = None) -> Set[str]:
+        """wait until any of jids finishes and return the finished jids"""
+        jids = set(jids)
+        self.track(jids)
+        with self._cond:
+            done = self._cond.wait_for(lambda: jids & self._finished.keys(), timeout)
+            if not done:
+                raise TimeoutError(f"none of {sorted(jids)} is finished")
+            return jids & self._finished.keys()
+
+
+_MONITOR: Optional[JobMonitor] = None
+_MONITOR_LOCK = threading.Lock()
+
+
+def get_monitor() -> JobMonitor:
+    """process-wide job monitor"""
+    global _MONITOR
+    with _MONITOR_LOCK:
+        if _MONITOR is None:
+            _MONITOR = JobMonitor()
+        return _MONITOR
@@ -0,0 +1,95 @@
+"""compiled plans of workflows
+
+qsubpy workflow --compile writes the parsed settings and resolved stages of a
+workflow to .qsubpy/plans/<hash of the workflow path>.json, together with
+scripts of stages without array job rendered ahead of time, whose only hole
+is common variables. Later runs of the workflow load the plan instead of
+parsing the yaml, resolving images and rendering scripts, as long as the
+hashes of the workflow, the config and files of file stages are unchanged.
+"""
+import os
+import json
+import hashlib
+
+from typing import Dict, List, Optional
+
+from qsubpy.utils import STATE_DIR
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+PLAN_DIR = os.path.join(STATE_DIR, "plans")
+# bump when the layout of plans or rendered scripts changes
+PLAN_VERSION = 4
+
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def plan_path(workflow: str, root: str = PLAN_DIR) -> str:
+    h = hashlib.sha256(os.path.abspath(workflow).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(root, h + ".json")
+
+
+def _hashes(workflow: str, config_path: str, files: List[str]) -> Dict[str, str]:
+    paths = [workflow, config_path] + files
+    return {os.path.abspath(p): file_hash(p) for p in paths}
+
+
+def _mtime(path: str) -> Optional[int]:
+    path = os.path.expanduser(path)
+    return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+
+def compile_plan(workflow: str, config_path: str, settings: Dict, stages: List[Dict]) -> Dict:
+    files = [s["file"] for s in settings["stages"] if s.get("file") is not None]
+    # staged images are named by their mtime, and too large to hash
+    images = [s["image"] for s in stages if s.get("stage_image") and s.get("image") is not None]
+    return {
+        "version": PLAN_VERSION,
+        "workflow": os.path.abspath(workflow),
+        "hashes": _hashes(workflow, config_path, files),
+        "images": {image: _mtime(image) for image in images},
+        "settings": settings,
+        "stages": stages,
+    }
+
+
+def write_plan(plan: Dict, root: str = PLAN_DIR) -> str:
+    path = plan_path(plan["workflow"], root)
+    os.makedirs(root, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(plan, f)
+    os.replace(tmp, path)
+    return path
+
+
+def load_plan(workflow: str, config_path: str, root: str = PLAN_DIR) -> Optional[Dict]:
+    """the compiled plan of the workflow, or None if it is not compiled or stale"""
+    path = plan_path(workflow, root)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        logger.info(f"plan {path} is compiled by another version of qsubpy, ignore it")
+        return None
+
+    expected = plan["hashes"]
+    if os.path.abspath(config_path) not in expected:
+        logger.info(f"plan {path} is compiled with another config, ignore it")
+        return None
+    for p, h in expected.items():
+        if not os.path.exists(p) or file_hash(p) != h:
+            logger.info(f"{p} is changed after compile, ignore plan {path}")
+            return None
+    for image, mtime in plan.get("images", {}).items():
+        if _mtime(image) != mtime:
+            logger.info(f"{image} is changed after compile, ignore plan {path}")
+            return None
+    return plan
@@ -0,0 +1,137 @@
+"""profiling of qsubpy's own execution
+
+Internal phases (config load, template render, array sizing, submission,
+stages, ...) are wrapped with span(). Spans are recorded only after enable(),
+so they cost almost nothing by default. Recorded spans are written in the
+chrome trace event format, which can be opened with chrome://tracing or
+https://ui.perfetto.dev, and summarized as a tree of total time per span name.
+"""
+import os
+import json
+import time
+import functools
+import threading
+
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_spans: List[Dict] = []
+# path of the outermost span of the main thread, the parent of spans in other threads
+_root: Optional[str] = None
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def clear():
+    with _lock:
+        _spans.clear()
+
+
+def spans() -> List[Dict]:
+    with _lock:
+        return list(_spans)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[None]:
+    """record the wall time of the block as a child of the current span of the thread"""
+    global _root
+
+    if not _enabled:
+        yield
+        return
+
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    is_root = len(stack) == 0 and threading.current_thread() is threading.main_thread()
+    if stack:
+        path = stack[-1]["path"] + "/" + name
+    elif not is_root and _root is not None:
+        path = _root + "/" + name
+    else:
+        path = name
+    if is_root:
+        _root = path
+    s = {
+        "name": name,
+        "path": path,
+        "attrs": attrs,
+        "thread": threading.get_ident(),
+        "start": time.perf_counter(),
+    }
+    stack.append(s)
+    try:
+        yield
+    finally:
+        stack.pop()
+        if is_root:
+            _root = None
+        s["duration"] = time.perf_counter() - s["start"]
+        with _lock:
+            _spans.append(s)
+
+
+def traced(name: str) -> Callable:
+    """decorator to record each call of the function as a span"""
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def write_trace(path: str, recorded: Optional[List[Dict]] = None):
+    if recorded is None:
+        recorded = spans()
+    events = [
+        {
+            "name": s["name"],
+            "ph": "X",
+            "ts": s["start"] * 1e6,
+            "dur": s["duration"] * 1e6,
+            "pid": os.getpid(),
+            "tid": s["thread"],
+            "args": {k: str(v) for k, v in s["attrs"].items()},
+        }
+        for s in recorded
+    ]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def summary(recorded: Optional[List[Dict]] = None) -> str:
+    """total time and count of spans aggregated by their path, like following
+
+    total(s)  count  span
+       1.234      1  workflow
+       1.100     10    workflow/stage
+    """
+    if recorded is None:
+        recorded = spans()
+
+    totals: Dict[str, List[float]] = {}
+    for s in recorded:
+        totals.setdefault(s["path"], []).append(s["duration"])
+
+    lines = ["total(s)  count  span"]
+    for path in sorted(totals, key=lambda p: p.split("/")):
+        indent = "  " * path.count("/")
+        lines.append(f"{sum(totals[path]):8.3f}  {len(totals[path]):5d}  {indent}{path.rsplit('/', 1)[-1]}")
+    return "\n".join(lines)
@@ -1,45 +1,94 @@
-import subprocess
+import time
 from qsubpy.config import read_config
+from qsubpy.profiling import span
 
-from typing import List
+from typing import Dict, List, Optional
 import logging
 
 logger = logging.Logger(__name__)
 
-CONFIG = read_config()
-
 
 class Qsub:
-    def __init__(self, test: bool = False):
+    def __init__(self, test: bool = False, backend: str = "sge"):
+        from qsubpy.backends import get_backend
+
         self.config = read_config()
         self.test = test
-
-    def sync(self, sh_file):
-        cmd = self.config.sync_qsub_command()
-        cmd += [sh_file]
-        if self.test:
-            logging.info(" ".join(cmd))
-            return
-        else:
-            logging.debug(" ".join(cmd))
-
-        p = subprocess.Popen(cmd)
-        p.wait()
-        if p.returncode != 0:
-            raise RuntimeError(f'{" ".join(cmd)} exit code {p.returncode}')
-
-    def ord(self, sh_file, hold_jid: str = None):
-        if hold_jid is None:
-            cmd = ["qsub", sh_file]
-        else:
-            cmd = self.config.ord_qsub_command(hold_jid) + [sh_file]
+        self.backend = get_backend(backend)
+        # timings of the last submission, recorded to metrics by stages
+        self.qsub_seconds: Optional[float] = None
+        self.submitted_at: Optional[float] = None
+        self.wait_seconds: Optional[float] = None
+
+    def sync(self, sh_file, stage: str = None, retries: int = 0, **extra) -> Optional[str]:
+        """submit sh_file and wait until the job finishes.
+        The job is waited by the backend (the shared job monitor for sge) instead of qsub -sync.
+        Failed tasks are resubmitted up to retries times. Returns the jid of the last job.
+        """
+        from qsubpy.retry import retry_job
+
+        jid = self.ord(sh_file, stage=stage, **extra)
+        if jid is None:
+            return None
+
+        start = time.time()
+        for i in range(retries + 1):
+            with span("wait", jid=jid):
+                status = self.backend.wait([jid])[jid]
+            self.wait_seconds = time.time() - start
+            if self.backend.name == "sge":
+                self._collect_history(jid)
+            # None is no accounting record of the job, which is not a success
+            if status == 0:
+                return jid
+            if i == retries:
+                break
+            logger.warning(f"{sh_file} (jid: {jid}) exit code {status}, retry {i + 1}/{retries}")
+            retry_jid = retry_job(jid, config=self.config)
+            # no task is marked as failed, e.g. the job failed out of tasks
+            if retry_jid is None:
+                break
+            jid = retry_jid
+
+        raise RuntimeError(f"{sh_file} (jid: {jid}) exit code {status}")
+
+    def _collect_history(self, jid: str):
+        from qsubpy.history import collect
+        from qsubpy.journal import load_job, update_job
+
+        try:
+            if collect(load_job(jid), self.config) is not None:
+                update_job(jid, collected=True)
+        except Exception as e:
+            logger.warning(f"cannot collect resource usage of {jid}: {e}")
+
+    def ord(self, sh_file, hold_jid: str = None, stage: str = None, array_hold_jid: str = None, **extra):
+        """submit sh_file holding hold_jid, and holding each task on the same task of array_hold_jid"""
+        from qsubpy.journal import record_job
+        from qsubpy.store import record_submission
+
+        hold_jids = hold_jid.split(",") if hold_jid is not None else []
+        array_hold_jids = array_hold_jid.split(",") if array_hold_jid is not None else []
         if self.test:
-            logging.info(" ".join(cmd))
+            logging.info(f"{self.backend.name}: {sh_file} hold {hold_jids} element-wise hold {array_hold_jids}")
             return
         else:
-            logging.debug(" ".join(cmd))
-
-        next_jid = qsub_with_jid(cmd)
+            logging.debug(f"{self.backend.name}: {sh_file} hold {hold_jids} element-wise hold {array_hold_jids}")
+
+        start = time.time()
+        if self.backend.name == "daemon":
+            # the daemon records the job when it is submitted
+            ticket = self.backend.submit(sh_file, hold_jids, array_hold_jids, stage=stage, **extra)
+            self.submitted_at = time.time()
+            self.qsub_seconds = self.submitted_at - start
+            return ticket
+        next_jid = self.backend.submit(sh_file, hold_jids, array_hold_jids)
+        self.submitted_at = time.time()
+        self.qsub_seconds = self.submitted_at - start
+        if array_hold_jids:
+            extra["array_hold_jids"] = array_hold_jids
+        record_job(next_jid, sh_file, stage=stage, hold_jids=hold_jids, backend=self.backend.name, **extra)
+        record_submission(self.config.store_dir, next_jid, sh_file)
         return next_jid
 
 
@@ -47,7 +96,7 @@ def get_jid(out: str) -> str:
     """get jid from output"""
     import re
 
-    _r = CONFIG.jid_re
+    _r = read_config().jid_re
     if _r is None:
         raise ValueError("not specify jid re in config")
     else:
@@ -65,9 +114,9 @@ def get_jid(out: str) -> str:
 def qsub_with_jid(cmd: List[str], std: str = "stdout") -> str:
     """run qsub and get jid"""
 
-    p = subprocess.run(
-        " ".join(cmd), shell=True, capture_output=True, executable="/bin/bash"
-    )
+    from qsubpy.shell import run_shell
+
+    p = run_shell(" ".join(cmd), persistent=read_config().persistent_shell)
     if std == "stdout":
         out = p.stdout
     elif std == "stderr":
@@ -78,3 +127,25 @@ def qsub_with_jid(cmd: List[str], std: str = "stdout") -> str:
     out = out.decode("utf-8")
     jid = get_jid(out)
     return jid
+
+
+def qsub_many(sh_files: List[str], max_workers: Optional[int] = 4, backend: str = "sge") -> Dict[str, str]:
+    """run qsub of many sh files concurrently and get {sh_file: jid}.
+    max_workers limits the number of qsub running at once.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from qsubpy.backends import get_backend
+    from qsubpy.journal import record_job
+    from qsubpy.store import record_submission
+
+    _backend = get_backend(backend)
+
+    def submit(sh_file: str) -> str:
+        jid = _backend.submit(sh_file, [])
+        record_job(jid, sh_file, backend=backend)
+        record_submission(_backend.config.store_dir, jid, sh_file)
+        return jid
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        jids = executor.map(submit, sh_files)
+        return dict(zip(sh_files, jids))
@@ -0,0 +1,151 @@
+"""resubmit only failed tasks of array jobs
+
+Failed tasks are found from the exit markers written by the generated script
+to .qsubpy/status/<jid>.tasks. Tasks without a marker (e.g. killed by the
+scheduler) are also treated as failed. The retry script is the original script
+with a compact array header and a remap of the task id to the original one,
+so the original element list is reused.
+"""
+import os
+
+from typing import Dict, List, Optional
+
+from qsubpy.config import Config, read_config
+from qsubpy.templates import STATUS_DIR
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def read_task_status(jid: str, status_dir: str = STATUS_DIR) -> Dict[int, int]:
+    """{task id: exit code}. the last marker wins if a task is recorded twice."""
+    path = os.path.join(status_dir, jid + ".tasks")
+    status = {}
+    if not os.path.exists(path):
+        return status
+    with open(path) as f:
+        for line in f:
+            cols = line.split()
+            if len(cols) != 2:
+                continue
+            status[int(cols[0])] = int(cols[1])
+    return status
+
+
+def failed_tasks(record: Dict, config: Config, status_dir: str = STATUS_DIR) -> List[int]:
+    """failed task ids of the recorded job"""
+    tasks = record.get("tasks")
+    if tasks is None:
+        with open(record["script"]) as f:
+            tasks = config.array_tasks(f.read().splitlines())
+    if tasks is None:
+        raise ValueError(f"{record['jid']} is not an array job")
+
+    status = read_task_status(record["jid"], status_dir)
+    return [t for t in tasks if status.get(t) != 0]
+
+
+def make_retry_script(script: List[str], tasks: List[int], config: Config) -> List[str]:
+    """replace the array header with 1-len(tasks) and remap the task id to the original one"""
+    r = config.array_header_re
+    task_var = config.array_job_id[1:]
+
+    ret = []
+    remapped = False
+    in_header = True
+    for line in script:
+        if r.match(line):
+            line = config.array_header(len(tasks))
+        elif in_header and not line.startswith("#") and line.strip() != "":
+            in_header = False
+            ret.append("qsubpy_retry_tasks=(" + " ".join(map(str, tasks)) + ")")
+            ret.append(
+                f"{task_var}=${{qsubpy_retry_tasks[$(({config.array_job_id}-1))]}}"
+            )
+            remapped = True
+        ret.append(line)
+
+    if not remapped:
+        raise ValueError("cannot find the body of the script")
+    return ret
+
+
+def retry_job(jid: str, config: Optional[Config] = None, dry_run: bool = False) -> Optional[str]:
+    """resubmit failed tasks of the job and return the new jid.
+    A job which is not an array job is resubmitted as is.
+    Pending jobs holding the failed job are altered to hold the new job.
+    """
+    from qsubpy.journal import load_job, list_jobs, update_job
+    from qsubpy.monitor import get_monitor
+    from qsubpy.qsub import Qsub
+
+    if config is None:
+        config = read_config()
+
+    record = load_job(jid)
+    # running tasks have no exit code yet, and would be taken as failed
+    active = get_monitor().active_jids() if record.get("backend", "sge") == "sge" else set()
+    if jid in active:
+        raise ValueError(f"{jid} is still in the scheduler, retry it after it finishes")
+    with open(record["script"]) as f:
+        script = f.read().splitlines()
+
+    if config.array_tasks(script) is None and record.get("tasks") is None:
+        retry_script = record["script"]
+        tasks = None
+    else:
+        tasks = failed_tasks(record, config)
+        if len(tasks) == 0:
+            logger.info(f"no failed task in {jid}")
+            return None
+        logger.info(f"retry {len(tasks)} tasks of {jid}: {tasks}")
+
+        original = record.get("retry_of", jid)
+        original_script = load_job(original)["script"]
+        stem, _ = os.path.splitext(original_script)
+        retry_script = f"{stem}.retry_{original}.sh"
+        with open(original_script) as f:
+            retry_lines = make_retry_script(f.read().splitlines(), tasks, config)
+        with open(retry_script, "w") as f:
+            f.write("\n".join(retry_lines))
+
+    if dry_run:
+        logger.info(f"dry_run, retry script: {retry_script}")
+        return None
+
+    # task ids of the retry job differ from the original, so element-wise holds become whole-job holds
+    hold_jids = record.get("hold_jids", []) + record.get("array_hold_jids", [])
+    new_jid = Qsub(backend=record.get("backend", "sge")).ord(
+        retry_script,
+        ",".join(hold_jids) if hold_jids else None,
+        stage=record.get("stage"),
+        retry_of=record.get("retry_of", jid),
+        tasks=tasks,
+    )
+
+    # downstream jobs should wait the retry job
+    for child in list_jobs():
+        if child["jid"] not in active:
+            continue
+        if jid in child.get("hold_jids", []):
+            holds = [new_jid if h == jid else h for h in child["hold_jids"]]
+        elif jid in child.get("array_hold_jids", []):
+            # the element-wise hold on the failed job is kept, and the retry job is held as a whole
+            holds = child.get("hold_jids", []) + [new_jid]
+        else:
+            continue
+        alter_hold(child["jid"], holds, config)
+        update_job(child["jid"], hold_jids=holds)
+
+    return new_jid
+
+
+def alter_hold(jid: str, hold_jids: List[str], config: Config):
+    import subprocess
+
+    cmd = config.alter_hold_command(",".join(hold_jids), jid)
+    logger.debug(" ".join(cmd))
+    p = subprocess.run(cmd)
+    if p.returncode != 0:
+        raise RuntimeError(f'{" ".join(cmd)} exit code {p.returncode}')
@@ -1,77 +1,207 @@
-import yaml
-import subprocess
+import os
+import time
 import argparse
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from qsubpy.config import read_config
 
 from qsubpy.utils import (
     make_sh_file,
+    fill_sh_file,
     read_sh,
     make_singularity_command,
+    stage_image_command,
     sanitize_dict_key,
 )
+from qsubpy.history import command_fingerprint
 from qsubpy.qsub import Qsub
+from qsubpy.profiling import span
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _names(name: Optional[str], n: int) -> List[Optional[str]]:
+    """job names of n scripts. name is suffixed with index if there are many scripts."""
+    if name is None or n == 1:
+        return [name] * n
+    return [f"{name}_{i}" for i in range(1, n + 1)]
+
+
+def _submit_many(sh_files: Dict[str, str], args: argparse.Namespace):
+    """submit sh files concurrently and write jid table as json"""
+    import json
+    from qsubpy.qsub import qsub_many
+
+    backend = args.backend or "sge"
+    jids = qsub_many(list(sh_files.values()), max_workers=args.jobs, backend=backend)
+    if backend == "local":
+        _wait_local(list(jids.values()))
+    table = {key: jids[sh_file] for key, sh_file in sh_files.items()}
+
+    out = json.dumps(table, indent=2)
+    if args.jid_table is None:
+        print(out)
+    else:
+        with open(args.jid_table, "w") as f:
+            f.write(out + "\n")
+
+
+def _submit(sh_file: str, backend: Optional[str] = None):
+    jid = Qsub(backend=backend or "sge").ord(sh_file)
+    logger.info(f"submitted {sh_file} as {jid}")
+    if backend == "local":
+        _wait_local([jid])
+
+
+def _wait_local(jids: List[str]):
+    """local jobs are child processes of qsubpy, so wait them before exit"""
+    from qsubpy.backends import get_backend
+
+    for jid, status in get_backend("local").wait(jids).items():
+        if status != 0:
+            logger.error(f"{jid} exit code {status}")
+
+
 def command_mode(args: argparse.Namespace):
-    cmd = args.command
+    cmds = args.command
     mem = args.mem
     slot = args.slot
-    name = args.name
     ls = args.ls
     array_command = args.array_cmd
     dry_run = args.dry_run
-    name = make_sh_file(
-        cmd=[cmd + "\n"],
-        mem=mem,
-        slot=slot,
-        name=name,
-        array_command=array_command,
-        ls_pattern=ls,
-    )
+    sh_files = {}
+    for cmd, name in zip(cmds, _names(args.name, len(cmds))):
+        sh_files[cmd] = make_sh_file(
+            cmd=[cmd + "\n"],
+            mem=mem,
+            slot=slot,
+            name=name,
+            array_command=array_command,
+            ls_pattern=ls,
+            manifest=args.manifest,
+            chunks=args.chunks,
+            chunk_parallel=args.chunk_parallel,
+            balance=args.balance,
+            max_concurrent=args.max_concurrent,
+            scatter=_scatter_of(args),
+            aggregate_logs=args.aggregate_logs,
+        )
+
+    if dry_run:
+        return
+    if len(sh_files) == 1:
+        _submit(list(sh_files.values())[0], args.backend)
+    else:
+        _submit_many(sh_files, args)
+
 
-    if not dry_run:
-        subprocess.run(["qsub", name])
-    # os.remove(name)
+def _scatter_of(args: argparse.Namespace) -> Optional[Tuple[str, int]]:
+    if args.scatter is None:
+        return None
+    return args.scatter, args.lines_per_task
+
+
+def expand_paths(patterns: List[str]) -> List[str]:
+    """expand glob patterns. paths without magic are kept as is."""
+    import glob
+
+    paths = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matched = sorted(glob.glob(pattern))
+            if len(matched) == 0:
+                raise FileNotFoundError(f"no file matches {pattern}")
+            paths += matched
+        else:
+            paths.append(pattern)
+    return paths
 
 
 def file_mode(args: argparse.Namespace):
     # path, mem, slot, name, ls, dry_run
-    path = args.file
+    paths = expand_paths(args.file)
     mem = args.mem
     slot = args.slot
-    name = args.name
     ls = args.ls
-    cmd = read_sh(path)
-    name = make_sh_file(cmd=cmd, mem=mem, slot=slot, name=name, ls_pattern=ls)
+    sh_files = {}
+    for path, name in zip(paths, _names(args.name, len(paths))):
+        cmd = read_sh(path)
+        sh_files[path] = make_sh_file(
+            cmd=cmd,
+            mem=mem,
+            slot=slot,
+            name=name,
+            ls_pattern=ls,
+            array_command=args.array_cmd,
+            manifest=args.manifest,
+            chunks=args.chunks,
+            chunk_parallel=args.chunk_parallel,
+            balance=args.balance,
+            max_concurrent=args.max_concurrent,
+            scatter=_scatter_of(args),
+            aggregate_logs=args.aggregate_logs,
+        )
 
-    if not args.dry_run:
-        subprocess.run(["qsub", name])
+    if args.dry_run:
+        return
+    if len(sh_files) == 1:
+        _submit(list(sh_files.values())[0], args.backend)
+    else:
+        _submit_many(sh_files, args)
 
 
 class Settings:
-    def __init__(self, path: str, dry_run: bool):
-        with open(path, "r") as f:
-            settings = yaml.safe_load(f)
-            settings = sanitize_dict_key(settings)
+    def __init__(
+        self,
+        path: str,
+        dry_run: bool,
+        force: bool = False,
+        auto_resources: bool = False,
+        backend: Optional[str] = None,
+        settings: Optional[Dict] = None,
+        via_daemon: bool = False,
+    ):
+        """settings parsed from the yaml of path, or given from a compiled plan"""
+        if settings is None:
+            import yaml
+
+            with open(path, "r") as f:
+                settings = yaml.safe_load(f)
+                settings = sanitize_dict_key(settings)
+        self.settings = settings
         self.stages = settings.get("stages")
         if self.stages is None:
             raise ValueError("Stages need")
         self.job_name = settings.get("job_name")
         self.defalut_mem = settings.get("default_mem")
         self.default_slot = settings.get("default_slot")
-        self.common_varialbes = settings.get("common_variables", [])
+        self.common_varialbes = settings.get("common_variables") or {}
         self.remove = settings.get("remove")
         self.mode = settings.get("mode", "ord")
         self.test = settings.get("test") is not None
+        self.force = force
+        self.auto_resources = auto_resources
+        self.backend = backend or settings.get("backend", "sge")
+        self.auto_bundle = bool(settings.get("auto_bundle", False))
+        self.stage_image = bool(settings.get("stage_image", False))
+        self.max_concurrent = settings.get("max_concurrent")
+        self.elementwise = bool(settings.get("elementwise", False))
+        self.aggregate_logs = settings.get("aggregate_logs")
+        self.window = None
+        if settings.get("window") is not None:
+            from qsubpy.window import SubmitWindow
+
+            window = settings["window"]
+            self.window = SubmitWindow(window.get("max_jobs"), window.get("max_tasks"))
 
         if self.mode not in ["sync", "ord", "dry_run"]:
             raise ValueError(f"invalid mode {self.mode}, plz use sync, ord or dry_run")
+        # sge jobs are submitted by qsubpy serve, and the workflow returns without waiting
+        self.via_daemon = via_daemon
+        if via_daemon and self.mode == "sync":
+            raise ValueError("sync mode waits for jobs, and cannot be submitted via the daemon")
 
         self.dry_run = dry_run
         if not self.dry_run:
@@ -92,6 +222,13 @@ class Settings:
         logger.info(f"-------------\n")
 
 
+def _stage_backend(stage: Dict, settings: Settings) -> str:
+    backend = stage.get("backend", settings.backend)
+    if settings.via_daemon and backend != "sge":
+        raise ValueError(f"{stage.get('name')} runs on {backend} backend, and cannot be submitted via the daemon")
+    return "daemon" if settings.via_daemon else backend
+
+
 class Stage:
     def __init__(self, stage: dict, settings: Settings):
         stage = sanitize_dict_key(stage)
@@ -104,6 +241,34 @@ class Stage:
         self.ls_patten = stage.get("ls")
         self.array_cmd = stage.get("array_cmd")
         self.runs_on = stage.get("runs_on")
+        self.manifest = bool(stage.get("manifest", False))
+        self.chunks = stage.get("chunks")
+        self.chunk_parallel = bool(stage.get("chunk_parallel", False))
+        self.balance = bool(stage.get("balance", False))
+        self.scatter = None
+        if stage.get("scatter") is not None:
+            scatter = stage["scatter"]
+            if not isinstance(scatter, dict) or "file" not in scatter:
+                raise ValueError(f"scatter of {self.name} should be {{file: ..., lines_per_task: ...}}")
+            self.scatter = (scatter["file"], int(scatter.get("lines_per_task", 1)))
+        self.max_concurrent = stage.get("max_concurrent", settings.max_concurrent)
+        self.elementwise = bool(stage.get("elementwise", settings.elementwise))
+        self.aggregate_logs = stage.get("aggregate_logs", settings.aggregate_logs)
+        self.needs = stage.get("needs")
+        if isinstance(self.needs, str):
+            self.needs = [self.needs]
+        self.retries = int(stage.get("retries", 0))
+        if self.retries > 0 and settings.mode == "ord":
+            logger.warning(f"retries of {self.name} is used only in sync mode, use qsubpy retry in ord mode")
+        self.backend = _stage_backend(stage, settings)
+        self.bundle = stage.get("bundle")
+        self.inputs = _as_list(stage.get("inputs"))
+        self.outputs = _as_list(stage.get("outputs"))
+        self.image = None
+        self.skipped = False
+        # script rendered by workflow --compile and the mem and slot it is rendered with
+        self.script_template: Optional[str] = None
+        self.template_resources: Optional[List] = None
 
         # set command
         command_keys = ["command", "cmd", "run"]
@@ -119,62 +284,512 @@ class Stage:
             path = stage.get("file")
             if path is None:
                 raise RuntimeError("run (cmd) or file is required in each stage!")
+            self.cmd = read_sh(path)
         else:
             raise ValueError("Unreachable!")
 
+        self.stage_image = bool(stage.get("stage_image", settings.stage_image))
         if self.runs_on is not None and stage.get("file") is None:
             bind_dirs = stage.get("bind_dirs")
             config = read_config()
-            self.cmd = [
+            self.image = config.singularity_config.resolve_image(
+                image=self.runs_on, root=None
+            )
+            image = self.image
+            staging = []
+            if self.stage_image:
+                staging = stage_image_command(self.image, config.singularity_config.stage_dir)
+                image = '"$qsubpy_image"'
+            self.cmd = staging + [
                 make_singularity_command(
                     command=self.cmd,
-                    singularity_img=config.singularity_config.singularity_image(
-                        image=self.runs_on, root=None
-                    ),
+                    singularity_img=image,
                     bind_dirs=bind_dirs,
                 )
             ]
         elif self.runs_on is not None and stage.get("file") is not None:
             raise ValueError("file and runs-on cannot use together")
 
+        self.cmd_fingerprint = command_fingerprint(self.cmd)
+        if settings.auto_resources and self.name is not None:
+            self.auto_resources()
+
+    def to_plan(self) -> Dict:
+        """resolved stage for a compiled plan. Scripts without array job are rendered
+        except common variables, because array jobs are sized at submission.
+        """
+        from qsubpy.utils import render_sh_template
+
+        plan = {k: v for k, v in vars(self).items() if k != "settings"}
+        if self.array_cmd is None and self.ls_patten is None and self.scatter is None:
+            plan["script_template"] = render_sh_template(self.cmd, self.mem, self.slot)
+            plan["template_resources"] = [self.mem, self.slot]
+        return plan
+
+    @classmethod
+    def from_plan(cls, plan: Dict, stage: Dict, settings: Settings) -> "Stage":
+        """restore the stage compiled from the stage dict of settings"""
+        self = cls.__new__(cls)
+        self.__dict__.update(plan)
+        self.settings = settings
+        if self.image is not None:
+            read_config().singularity_config.resolve_image(self.image)
+        # the backend may be given by --backend or --via_daemon at run time
+        self.backend = _stage_backend(stage, settings)
+        if settings.auto_resources and self.name is not None:
+            self.auto_resources()
+        return self
+
+    def auto_resources(self):
+        """fill mem and slot from resource usage history of the stage"""
+        from qsubpy.history import suggest
+
+        suggestion = suggest(self.name, self.cmd_fingerprint)
+        if suggestion is None:
+            logger.info(f"no resource history of {self.name}, use mem: {self.mem}, slot: {self.slot}")
+            return
+        logger.info(
+            f"auto resources of {self.name}: mem {self.mem} -> {suggestion[0]}, slot {self.slot} -> {suggestion[1]}"
+        )
+        self.mem, self.slot = suggestion
+
+    def element_key(self) -> Optional[Tuple]:
+        """elements of each task. Stages with the same key run the same elements in the same tasks.
+        None if the stage is not an array job or its order depends on the stage (balance).
+        """
+        if self.balance:
+            return None
+        if self.scatter is not None:
+            return ("scatter", os.path.abspath(self.scatter[0]), self.scatter[1])
+        if self.array_cmd is not None:
+            return (self.array_cmd, self.chunks)
+        if self.ls_patten is not None:
+            return ("ls " + self.ls_patten, self.chunks)
+        return None
+
     def debug(self):
         logger.debug(f"mem: {self.mem}, slot: {self.slot}")
         logger.debug(f"ls_pattern: {self.ls_patten}")
         logger.debug(f"array_cmd: {self.array_cmd}")
         logger.debug(f'cmd: {" ".join(self.cmd)}')
 
-    def run_stage(self, hold_jid: str = None) -> Optional[str]:
+    def resources(self) -> Dict:
+        """requested resources recorded to the job journal"""
+        config = read_config()
+        return {
+            "mem": str(self.mem if self.mem is not None else config.resources.default_mem),
+            "slot": str(self.slot if self.slot is not None else config.resources.default_slot),
+            "fingerprint": self.cmd_fingerprint,
+        }
+
+    def fingerprint(self, sh_file: str) -> str:
+        from qsubpy.fingerprint import stage_fingerprint
+
+        with open(sh_file) as f:
+            script = f.read()
+        return stage_fingerprint(
+            script,
+            self.settings.common_varialbes,
+            image=self.image,
+            inputs=self.inputs,
+        )
+
+    def run_stage(
+        self, hold_jid: str = None, parents_rerun: bool = True, array_hold_jid: str = None
+    ) -> Optional[str]:
+        """render and submit the stage. If the stage declares outputs, nothing upstream is rerun
+        and its fingerprint is unchanged from the last run, the stage is skipped.
+        Each task waits for the same task of array_hold_jid in ord mode.
+        """
+        from qsubpy.fingerprint import FingerprintStore
+
         if self.settings.mode == "sync":
             logger.info(f"start stage: {self.name}")
 
+        started = time.time()
         self.debug()
+        if self.script_template is not None and self.template_resources == [self.mem, self.slot]:
+            name = fill_sh_file(self.script_template, self.name, self.settings.common_varialbes)
+        else:
+            name = make_sh_file(
+                cmd=self.cmd,
+                mem=self.mem,
+                slot=self.slot,
+                name=self.name,
+                array_command=self.array_cmd,
+                ls_pattern=self.ls_patten,
+                chunks=self.chunks,
+                common_variables=self.settings.common_varialbes,
+                manifest=self.manifest,
+                chunk_parallel=self.chunk_parallel,
+                balance=self.balance,
+                max_concurrent=self.max_concurrent,
+                scatter=self.scatter,
+                aggregate_logs=self.aggregate_logs,
+            )
+        rendered = time.time()
+
+        fingerprint = None
+        store = FingerprintStore()
+        if self.outputs is not None and self.name is not None:
+            fingerprint = self.fingerprint(name)
+            if (
+                not self.settings.force
+                and not parents_rerun
+                and store.up_to_date(self.name, fingerprint, self.outputs)
+            ):
+                logger.info(f"skip {self.name}, it is up to date")
+                self.skipped = True
+                return None
+
+        if self.settings.dry_run and not self.settings.test:
+            logger.debug("dry_run and test is false")
+            return None
+
+        next_jid = None
+        qsub = Qsub(test=self.settings.test, backend=self.backend)
+        if self.settings.mode == "sync":
+            qsub.sync(name, stage=self.name, retries=self.retries, **self.resources())
+        elif self.settings.mode == "ord":
+            next_jid = _ord(
+                qsub, name, hold_jid, self.name, self.settings, array_hold_jid=array_hold_jid, **self.resources()
+            )
+        _record_stage(self.name, next_jid, qsub, started, rendered)
+
+        if fingerprint is not None and not self.settings.test:
+            store.set(self.name, fingerprint, next_jid)
+
+        if self.settings.mode == "sync":
+            logger.info(f"end {self.name}...")
+        return next_jid
+
+
+class Bundle:
+    """stages run as tasks of one array job. task i runs the command of the i-th member."""
+
+    def __init__(self, name: str, members: List[Stage], member_names: List[str], settings: Settings):
+        self.name = name
+        self.members = members
+        self.member_names = member_names
+        self.settings = settings
+        self.skipped = False
+
+        first = members[0]
+        for member, member_name in zip(members, member_names):
+            if any(v is not None for v in [member.array_cmd, member.ls_patten, member.chunks, member.scatter]):
+                raise ValueError(f"{member_name} is an array job, and cannot be bundled into {name}")
+            if (member.mem, member.slot, member.backend) != (first.mem, first.slot, first.backend):
+                raise ValueError(f"mem, slot and backend of {member_name} differ from other stages of {name}")
+        self.mem = first.mem
+        self.slot = first.slot
+        self.backend = first.backend
+        self.retries = max(member.retries for member in members)
+        self.max_concurrent = first.max_concurrent
+        self.cmd_fingerprint = command_fingerprint([c for m in members for c in m.cmd])
+        self.elementwise = False
+
+    def element_key(self) -> Optional[Tuple]:
+        return None
+
+    def resources(self) -> Dict:
+        config = read_config()
+        return {
+            "mem": str(self.mem if self.mem is not None else config.resources.default_mem),
+            "slot": str(self.slot if self.slot is not None else config.resources.default_slot),
+            "fingerprint": self.cmd_fingerprint,
+            "members": self.member_names,
+        }
+
+    def run_stage(
+        self, hold_jid: str = None, parents_rerun: bool = True, array_hold_jid: str = None
+    ) -> Optional[str]:
+        logger.info(f"bundle {', '.join(self.member_names)} into {self.name}")
+        started = time.time()
         name = make_sh_file(
-            cmd=self.cmd,
+            cmd=[],
             mem=self.mem,
             slot=self.slot,
             name=self.name,
-            array_command=self.array_cmd,
-            ls_pattern=self.ls_patten,
-            chunks=None,
             common_variables=self.settings.common_varialbes,
+            bundle=[(n, m.cmd) for n, m in zip(self.member_names, self.members)],
+            max_concurrent=self.max_concurrent,
         )
+        rendered = time.time()
 
         if self.settings.dry_run and not self.settings.test:
-            logger.debug("dry_run and test is false")
             return None
 
         next_jid = None
-        qsub = Qsub(test=self.settings.test)
-        if self.settings.mode == "sync":
-            qsub.sync(name)
-        elif self.settings.mode == "ord":
-            next_jid = qsub.ord(name, hold_jid)
-
+        qsub = Qsub(test=self.settings.test, backend=self.backend)
         if self.settings.mode == "sync":
-            logger.info(f"end {self.name}...")
+            qsub.sync(name, stage=self.name, retries=self.retries, **self.resources())
+        else:
+            next_jid = _ord(qsub, name, hold_jid, self.name, self.settings, **self.resources())
+        _record_stage(self.name, next_jid, qsub, started, rendered)
         return next_jid
 
 
+def _ord(
+    qsub: Qsub,
+    sh_file: str,
+    hold_jid: Optional[str],
+    stage: str,
+    settings: Settings,
+    **extra,
+) -> Optional[str]:
+    """qsub.ord in the sliding window of the workflow if any"""
+    window = settings.window
+    if window is None or qsub.test or qsub.backend.name != "sge":
+        return qsub.ord(sh_file, hold_jid, stage=stage, **extra)
+
+    with open(sh_file) as f:
+        tasks = qsub.config.array_tasks(f.read().splitlines())
+    n_tasks = len(tasks) if tasks is not None else 1
+    window.wait(n_tasks)
+    jid = qsub.ord(sh_file, hold_jid, stage=stage, **extra)
+    window.add(jid, n_tasks)
+    return jid
+
+
+def _record_stage(name: str, jid: Optional[str], qsub: Qsub, started: float, rendered: float):
+    from qsubpy import metrics
+
+    if qsub.test or qsub.qsub_seconds is None:
+        return
+    metrics.record(
+        "stage",
+        stage=name,
+        jid=jid,
+        backend=qsub.backend.name,
+        render_seconds=rendered - started,
+        qsub_seconds=qsub.qsub_seconds,
+        submit_seconds=qsub.submitted_at - started,
+        wait_seconds=qsub.wait_seconds,
+    )
+
+
+def bundle_stages(stages: List[Stage], names: List[str], settings: Settings) -> Dict[str, Tuple]:
+    """group stages by bundle, or by needs and resources with auto_bundle.
+    Returns {node name: (Stage or Bundle, needs)}, where needs on bundled stages are
+    replaced with their bundle. A stage without needs depends on the previous stage,
+    so only stages with the same needs (e.g. needs: []) are bundled automatically.
+    """
+    needs_of = {}
+    for i, (name, stage) in enumerate(zip(names, stages)):
+        if stage.needs is not None:
+            needs_of[name] = list(stage.needs)
+        else:
+            needs_of[name] = [] if i == 0 else [names[i - 1]]
+
+    groups: Dict = {}
+    for name, stage in zip(names, stages):
+        if stage.bundle is not None:
+            key = str(stage.bundle)
+        elif (
+            settings.auto_bundle
+            and stage.array_cmd is None
+            and stage.ls_patten is None
+            and stage.chunks is None
+            and stage.scatter is None
+            and stage.outputs is None
+        ):
+            key = ("auto", tuple(sorted(needs_of[name])), stage.mem, stage.slot, stage.backend)
+        else:
+            key = ("stage", name)
+        groups.setdefault(key, []).append(name)
+
+    node_of = {}
+    nodes = {}
+    for key, members in groups.items():
+        if isinstance(key, tuple) and len(members) == 1:
+            node = members[0]
+            nodes[node] = stages[names.index(node)]
+        else:
+            node = key if isinstance(key, str) else f"bundle_{members[0]}"
+            if node in names:
+                raise ValueError(f"bundle {node} has the same name as a stage")
+            nodes[node] = Bundle(node, [stages[names.index(m)] for m in members], members, settings)
+        for member in members:
+            node_of[member] = node
+
+    ret = {}
+    for node, runner in nodes.items():
+        members = runner.member_names if isinstance(runner, Bundle) else [node]
+        needs = []
+        for member in members:
+            for need in needs_of[member]:
+                if need not in node_of:
+                    raise ValueError(f"{member} needs unknown stage {need}")
+                if node_of[need] != node:
+                    if node_of[need] not in needs:
+                        needs.append(node_of[need])
+                elif stages[names.index(member)].needs is not None:
+                    raise ValueError(f"{member} needs {need} in the same bundle {node}")
+        ret[node] = (runner, needs)
+    return ret
+
+
+def split_holds(stage, parents: List, parent_jids: List[Optional[str]]) -> Tuple[List[str], List[str]]:
+    """split jids of parents into whole-job holds and element-wise holds.
+    An elementwise stage holds a parent element-wise only if both run the same elements
+    in the same tasks, and options.order_array is in config.
+    """
+    hold_jids, array_hold_jids = [], []
+    key = stage.element_key() if stage.elementwise else None
+    if key is not None and read_config().order_array_options is None:
+        logger.warning(f"options.order_array is not in config, {stage.name} holds parents as a whole")
+        key = None
+    for parent, jid in zip(parents, parent_jids):
+        if jid is None:
+            continue
+        if key is not None and parent.element_key() == key:
+            array_hold_jids.append(jid)
+        else:
+            if stage.elementwise:
+                logger.info(f"elements of {parent.name} differ from {stage.name}, hold it as a whole")
+            hold_jids.append(jid)
+    return hold_jids, array_hold_jids
+
+
+def _as_list(value) -> Optional[List[str]]:
+    if value is None or isinstance(value, list):
+        return value
+    return [value]
+
+
+def retry_mode(args: argparse.Namespace):
+    from qsubpy.journal import latest_job_of_stage
+    from qsubpy.retry import retry_job
+
+    target: str = args.target
+    if target.isdigit():
+        jid = target
+    else:
+        jid = latest_job_of_stage(target)["jid"]
+
+    new_jid = retry_job(jid, dry_run=args.dry_run)
+    if new_jid is not None:
+        logger.info(f"retry {jid} as {new_jid}")
+        print(new_jid)
+
+
+def _print_task_log(task: int, jid: str, bundle: str, record: Dict):
+    from qsubpy.logs import read_task_log
+
+    out, err = read_task_log(bundle, record)
+    print(f"==> task {task} (jid: {jid}, exit code: {record['status']}) <==")
+    print(out, end="")
+    if err != "":
+        print(f"--- stderr of task {task} ---")
+        print(err, end="")
+
+
+def logs_mode(args: argparse.Namespace):
+    """show aggregated logs of a job, or of the jobs of a stage including retries"""
+    from qsubpy.journal import list_jobs, load_job
+    from qsubpy.logs import bundle_of_script, read_record, records
+
+    target: str = args.target
+    if target.isdigit():
+        jobs = [load_job(target)]
+    else:
+        # the newest job first, so that a retried task shows its last log
+        jobs = [r for r in reversed(list_jobs()) if r.get("stage") == target]
+        if len(jobs) == 0:
+            raise ValueError(f"no job of stage {target} is found")
+
+    bundles = []
+    for job in jobs:
+        if not os.path.exists(job["script"]):
+            continue
+        with open(job["script"]) as f:
+            bundle = bundle_of_script(f.read(), job["jid"])
+        if bundle is not None:
+            bundles.append((job["jid"], bundle))
+    if len(bundles) == 0:
+        raise ValueError(f"logs of {target} are not aggregated")
+
+    if args.task is not None:
+        for jid, bundle in bundles:
+            record = read_record(bundle, args.task)
+            if record is not None:
+                _print_task_log(args.task, jid, bundle, record)
+                return
+        raise ValueError(f"no log of task {args.task} of {target}, it may not be finished")
+
+    latest: Dict[int, Tuple] = {}
+    for jid, bundle in bundles:
+        for task, record in records(bundle):
+            latest.setdefault(task, (jid, bundle, record))
+
+    if args.failed:
+        for task in sorted(latest):
+            jid, bundle, record = latest[task]
+            if record["status"] != 0:
+                _print_task_log(task, jid, bundle, record)
+        return
+
+    print("task\tjid\texit_code\tstdout_bytes\tstderr_bytes")
+    for task in sorted(latest):
+        jid, _, record = latest[task]
+        print(f"{task}\t{jid}\t{record['status']}\t{record['stdout']}\t{record['stderr']}")
+
+
+def serve_mode(args: argparse.Namespace):
+    import signal
+    import threading
+    from qsubpy.daemon import Daemon, serve
+
+    config = read_config()
+    path = os.path.expanduser(args.socket or config.daemon_socket)
+    daemon = Daemon(config, rate=args.rate, burst=args.burst)
+    server = serve(daemon, path)
+    # shutdown blocks until serve_forever returns, so call it from another thread
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    logger.info(f"qsubpy serve on {path}, {daemon.bucket.rate} qsub per second")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+        # submit queued requests before exit. requests left by a kill are submitted when it starts again
+        logger.info(f"stop qsubpy serve after {daemon.queued()} queued requests are submitted")
+        daemon.stop()
+        logger.info("stop qsubpy serve")
+
+
+def report_mode(args: argparse.Namespace):
+    from qsubpy.history import collect_finished, report, format_report
+
+    if args.collect and not args.dry_run:
+        n = collect_finished()
+        logger.info(f"collected {n} tasks")
+    print(format_report(report()))
+    if args.prometheus is not None:
+        from qsubpy.metrics import write_prometheus
+
+        write_prometheus(args.prometheus)
+
+
+def gc_mode(args: argparse.Namespace):
+    from qsubpy.journal import list_jobs
+    from qsubpy.monitor import get_monitor
+    from qsubpy.store import gc
+
+    config = read_config()
+    active = get_monitor().active_jids()
+    # scripts of jobs submitted from other directories are kept by the records in the store
+    keep = {job["script"] for job in list_jobs() if job["jid"] in active}
+    removed = gc(config.store_dir, keep, min_age=args.min_age, dry_run=args.dry_run, active=active)
+    if args.dry_run:
+        for path in removed:
+            logger.info(f"dry_run, {path} would be removed")
+    else:
+        logger.info(f"removed {len(removed)} files from {config.store_dir}")
+
+
 def parse_common_variables(common_variables_str: List[str]) -> Dict[str, str]:
     d = {}
     for l in common_variables_str:
@@ -186,8 +801,27 @@ def parse_common_variables(common_variables_str: List[str]) -> Dict[str, str]:
     return d
 
 
+def compile_workflow(path: str) -> str:
+    """write the compiled plan of the workflow. common variables, --backend and
+    --auto_resources are applied when the plan is run, not compiled.
+    """
+    import copy
+    from qsubpy.config import get_default_config_path, read_config
+    from qsubpy.plan import compile_plan, write_plan
+
+    # the default config is generated before its hash is taken
+    read_config()
+    settings = Settings(path, dry_run=True)
+    raw = copy.deepcopy(settings.settings)
+    stages = [Stage(_stage, settings).to_plan() for _stage in settings.stages]
+    plan = compile_plan(path, get_default_config_path(), raw, stages)
+    plan_path = write_plan(plan)
+    logger.info(f"compiled {path} to {plan_path}")
+    return plan_path
+
+
 def workflow_mode(args: argparse.Namespace):
-    import time
+    from qsubpy.dag import build_dag, run_dag
 
     path: str = args.workflow
     dry_run: bool = args.dry_run
@@ -195,27 +829,72 @@ def workflow_mode(args: argparse.Namespace):
     time_dict = {}
     start_time = time.time()
 
-    settings = Settings(path, dry_run)
+    if args.compile:
+        compile_workflow(path)
+        return
+
+    from qsubpy.config import get_default_config_path
+    from qsubpy.plan import load_plan
+
+    with span("load_plan"):
+        plan = load_plan(path, get_default_config_path())
+    settings = Settings(
+        path,
+        dry_run,
+        force=args.force,
+        auto_resources=args.auto_resources,
+        backend=args.backend,
+        settings=plan["settings"] if plan is not None else None,
+        via_daemon=args.via_daemon,
+    )
     settings.common_varialbes.update(parse_common_variables(args.common_variables))
     settings.start_log()
 
-    hold_jid = None
-    for _stage in settings.stages:
-
+    if plan is not None:
+        logger.info(f"use the compiled plan of {path}")
+        stages = [
+            Stage.from_plan(_plan, _stage, settings)
+            for _plan, _stage in zip(plan["stages"], settings.stages)
+        ]
+    else:
+        stages = [Stage(_stage, settings) for _stage in settings.stages]
+    names = [
+        stage.name if stage.name is not None else f"stage{i}"
+        for i, stage in enumerate(stages, start=1)
+    ]
+    nodes = bundle_stages(stages, names, settings)
+    stage_of = {node: runner for node, (runner, _) in nodes.items()}
+    dag = build_dag(list(nodes), [needs for _, needs in nodes.values()])
+    logger.debug(f"dag: {dag}")
+
+    def run(name: str, parent_jids: List[Optional[str]]) -> Optional[str]:
         stage_start = time.time()
 
-        # get params
-        stage = Stage(_stage, settings)
-
-        # update hold jid if mode is ord
-        hold_jid = stage.run_stage(hold_jid)
+        stage = stage_of[name]
+        # hold all parents if mode is ord. parents with the same elements are held element-wise
+        hold_jids, array_hold_jids = split_holds(stage, [stage_of[p] for p in dag[name]], parent_jids)
+        hold_jid = ",".join(hold_jids) if len(hold_jids) > 0 else None
+        array_hold_jid = ",".join(array_hold_jids) if len(array_hold_jids) > 0 else None
+        parents_rerun = any(not stage_of[p].skipped for p in dag[name])
+        with span(f"stage {name}"):
+            next_jid = stage.run_stage(hold_jid, parents_rerun=parents_rerun, array_hold_jid=array_hold_jid)
 
         stage_end = time.time()
 
         if settings.mode == "sync":
-            key = stage.name + "_proceeded_time"
+            key = name + "_proceeded_time"
             time_dict[key] = stage_end - stage_start
             logger.info(f"proceeded time is {time_dict[key]}")
+        return next_jid
+
+    # independent stages run concurrently only in sync mode. qsub returns immediately in other modes.
+    run_dag(dag, run, max_workers=None if settings.mode == "sync" else 1)
+
+    if settings.mode == "ord" and any(stage.backend == "local" for stage in stages):
+        from qsubpy.backends import get_backend
+
+        logger.info("wait for local jobs")
+        get_backend("local").wait_all()
 
     end_time = time.time()
     if settings.mode == "sync":
@@ -224,4 +903,9 @@ def workflow_mode(args: argparse.Namespace):
             for k, v in time_dict.items():
                 f.write(k + ":" + str(v) + "\n")
 
+    if args.prometheus is not None and not settings.dry_run:
+        from qsubpy.metrics import write_prometheus
+
+        write_prometheus(args.prometheus)
+
     logger.info("done!")
@@ -0,0 +1,101 @@
+"""scatter lines of a large file over array tasks
+
+Instead of materializing the lines as a bash array in each task, qsubpy
+writes a line index of the file at submission:
+
+    <index>  fixed width byte offsets of the first line of each task,
+             followed by the size of the file
+
+Task i reads records i and i+1 of the index with a single seek, and then
+reads only its byte range [start, end) of the file. The file itself is
+neither copied nor split.
+"""
+import os
+import shlex
+import hashlib
+
+from typing import List
+
+from qsubpy.manifest import INDEX_WIDTH, INDEX_RECORD
+
+
+def content_index_path(path: str, lines_per_task: int, directory: str) -> str:
+    """path of the index named by the path, size and mtime of the file"""
+    st = os.stat(path)
+    key = f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}:{lines_per_task}"
+    h = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(directory, h + ".scatter.idx")
+
+
+def write_line_index(path: str, index: str, lines_per_task: int = 1) -> int:
+    """write offsets of every lines_per_task lines of path to index.
+    Returns:
+        int: number of tasks
+    """
+    if lines_per_task < 1:
+        raise ValueError("lines_per_task should be positive integer")
+
+    offsets = []
+    pos = 0
+    with open(path, "rb") as f:
+        for i, line in enumerate(f):
+            if i % lines_per_task == 0:
+                offsets.append(pos)
+            pos += len(line)
+    if len(offsets) == 0:
+        raise ValueError(f"{path} has no line to scatter")
+    offsets.append(pos)
+
+    tmp = f"{index}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"".join(str(o).zfill(INDEX_WIDTH).encode("ascii") + b"\n" for o in offsets))
+    os.replace(tmp, index)
+    return len(offsets) - 1
+
+
+def scatter_len(index: str) -> int:
+    return os.path.getsize(index) // INDEX_RECORD - 1
+
+
+def read_task_lines(path: str, index: str, task_id: int) -> List[str]:
+    """read lines of task_id (1-origin) from the file"""
+    with open(index, "rb") as f:
+        f.seek((task_id - 1) * INDEX_RECORD)
+        records = f.read(INDEX_RECORD * 2).split()
+    if len(records) != 2:
+        raise IndexError(f"task {task_id} is out of range of {index}")
+
+    start, end = (int(r) for r in records)
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start).decode("utf-8").splitlines()
+
+
+def bash_scatter(path: str, index: str, task: str, lines_per_task: int) -> str:
+    """bash lines to read lines of the task from the file.
+    task is a bash arithmetic expression of the 0-origin task index.
+    qsubpy_scatter prints the lines of the task, and qsubpy_offset is the 0-origin
+    index of its first line. If lines_per_task is 1, elem is set to the line,
+    else qsubpy_chunk to the lines, like following
+
+    { IFS= read -r qsubpy_start; IFS= read -r qsubpy_end; } < <(dd if=/path/to/idx bs=17 skip=$(($SGE_TASK_ID-1)) count=2 2>/dev/null)
+    qsubpy_scatter() { tail -c +$((10#$qsubpy_start+1)) /path/to/file | head -c $((10#$qsubpy_end-10#$qsubpy_start)); }
+    qsubpy_offset=$((($SGE_TASK_ID-1)*1))
+    IFS= read -r elem < <(qsubpy_scatter) || [ -n "$elem" ]
+    """
+    path = shlex.quote(os.path.abspath(path))
+    index = shlex.quote(os.path.abspath(index))
+    lines = [
+        "{ IFS= read -r qsubpy_start; IFS= read -r qsubpy_end; } < "
+        + f"<(dd if={index} bs={INDEX_RECORD} skip=$(({task})) count=2 2>/dev/null)",
+        "qsubpy_scatter() { tail -c +$((10#$qsubpy_start+1)) "
+        + path
+        + " | head -c $((10#$qsubpy_end-10#$qsubpy_start)); }",
+        f"qsubpy_offset=$((({task})*{lines_per_task}))",
+    ]
+    if lines_per_task == 1:
+        # the last line may not end with a newline
+        lines.append('IFS= read -r elem < <(qsubpy_scatter) || [ -n "$elem" ]')
+    else:
+        lines.append("mapfile -t qsubpy_chunk < <(qsubpy_scatter)")
+    return "\n".join(lines)
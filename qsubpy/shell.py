@@ -0,0 +1,164 @@
+"""shell commands of qsubpy (array sizing, qsub, ...)
+
+By default each command runs in a fresh /bin/bash. With persistent = true in
+[shell] of config, commands are sent to long-lived bash co-processes instead,
+so that fork/exec and init of bash are paid once per process. Each command
+runs in a subshell of the co-process, so exit, cd or set -e in a command never
+break the session. stdout ends with a marker line tagged with the exit code,
+and stderr is written to a file of the session. Common variables are set once
+per session. If a session is dead before a command is sent, the command runs
+in a one-shot bash instead. A command is never rerun once it is sent, since it
+may have run (e.g. qsub) before the session died.
+"""
+import os
+import uuid
+import atexit
+import tempfile
+import threading
+import subprocess
+
+from typing import Dict, List, Optional, Tuple
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+BASH = "/bin/bash"
+
+
+class ShellError(RuntimeError):
+    pass
+
+
+class CommandLostError(ShellError):
+    """the session died after the command was sent, so the command may have run"""
+
+
+class ShellSession:
+    def __init__(self, variables: Tuple[str, ...] = ()):
+        self.token = f"__QSUBPY_END_{uuid.uuid4().hex}__"
+        fd, self.stderr_path = tempfile.mkstemp(prefix="qsubpy_shell_", suffix=".err")
+        os.close(fd)
+        self.proc = subprocess.Popen(
+            [BASH, "--noprofile", "--norc"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        if variables:
+            self._send("\n".join(variables) + "\n")
+
+    def _send(self, text: str):
+        try:
+            self.proc.stdin.write(text.encode("utf-8"))
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise ShellError(f"shell session is dead: {e}")
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def run(self, cmd: str) -> subprocess.CompletedProcess:
+        self._send(
+            f"( {cmd}\n) < /dev/null 2> {self.stderr_path}\n"
+            f"printf '\\n{self.token} %d\\n' $?\n"
+        )
+
+        lines = []
+        while True:
+            line = self.proc.stdout.readline()
+            if line == b"":
+                raise CommandLostError(f"shell session exited while running {cmd}")
+            if line.startswith(self.token.encode("utf-8")):
+                returncode = int(line.split()[1])
+                break
+            lines.append(line)
+        # drop the newline printed before the marker
+        stdout = b"".join(lines)[:-1]
+        with open(self.stderr_path, "rb") as f:
+            stderr = f.read()
+        return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+    def close(self):
+        if self.alive():
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=1)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+        if os.path.exists(self.stderr_path):
+            os.remove(self.stderr_path)
+
+
+class ShellPool:
+    """idle sessions per common variables. a session runs one command at a time,
+    so concurrent commands (e.g. qsub_many) get their own sessions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle: Dict[Tuple[str, ...], List[ShellSession]] = {}
+        self._all: List[ShellSession] = []
+
+    def _acquire(self, variables: Tuple[str, ...]) -> ShellSession:
+        with self._lock:
+            idle = self._idle.get(variables, [])
+            while idle:
+                session = idle.pop()
+                if session.alive():
+                    return session
+                session.close()
+        session = ShellSession(variables)
+        with self._lock:
+            self._all.append(session)
+        return session
+
+    def _release(self, variables: Tuple[str, ...], session: ShellSession):
+        with self._lock:
+            self._idle.setdefault(variables, []).append(session)
+
+    def run(self, cmd: str, variables: Tuple[str, ...] = ()) -> subprocess.CompletedProcess:
+        session = self._acquire(variables)
+        try:
+            ret = session.run(cmd)
+        except ShellError:
+            session.close()
+            raise
+        self._release(variables, session)
+        return ret
+
+    def close(self):
+        with self._lock:
+            sessions, self._all, self._idle = self._all, [], {}
+        for session in sessions:
+            session.close()
+
+
+_POOL: Optional[ShellPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> ShellPool:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ShellPool()
+            atexit.register(_POOL.close)
+        return _POOL
+
+
+def run_shell(
+    cmd: str, variables: Optional[List[str]] = None, persistent: bool = False
+) -> subprocess.CompletedProcess:
+    """run cmd with bash after variables like a="b" are set, and capture stdout and stderr"""
+    variables = tuple(variables or [])
+    if persistent:
+        try:
+            return get_pool().run(cmd, variables)
+        except CommandLostError:
+            raise
+        except (ShellError, OSError) as e:
+            logger.warning(f"{e}, fall back to one-shot bash")
+
+    script = "\n".join(variables + (cmd,))
+    return subprocess.run(script, shell=True, capture_output=True, executable=BASH)
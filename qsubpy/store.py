@@ -0,0 +1,143 @@
+"""content-addressed store of generated scripts
+
+Scripts without a job name are written to <store dir>/<hash[:2]>/<hash>.sh
+instead of tmp_<uuid>.sh in the working directory. Identical scripts are
+written once and reused. Manifests of such scripts are stored in
+<store dir>/manifests, named by the hash of their elements.
+
+The store is shared by all working directories, so each submission of a
+stored script is recorded to <store dir>/jobs/<jid>, and gc keeps scripts
+of jobs in the scheduler wherever they are submitted from.
+"""
+import os
+import time
+import hashlib
+
+from typing import Iterable, List, Optional, Set
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def script_path(content: str, root: str) -> str:
+    h = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return os.path.join(root, h[:2], h + ".sh")
+
+
+def manifest_dir(root: str) -> str:
+    path = os.path.join(root, "manifests")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def jobs_dir(root: str) -> str:
+    return os.path.join(root, "jobs")
+
+
+def record_submission(root: str, jid: str, script: str):
+    """record that the stored script is submitted as jid. scripts out of the store are ignored."""
+    script = os.path.abspath(script)
+    if not script.startswith(os.path.abspath(root) + os.sep):
+        return
+    os.makedirs(jobs_dir(root), exist_ok=True)
+    path = os.path.join(jobs_dir(root), jid)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(script)
+    os.replace(tmp, path)
+
+
+def submitted_scripts(root: str, jids: Iterable[str]) -> Set[str]:
+    """stored scripts submitted as jids"""
+    scripts = set()
+    for jid in jids:
+        path = os.path.join(jobs_dir(root), jid)
+        if os.path.exists(path):
+            with open(path) as f:
+                scripts.add(f.read())
+    return scripts
+
+
+def store_script(content: str, root: str) -> str:
+    """write the script once and return its path"""
+    path = script_path(content, root)
+    if os.path.exists(path):
+        logger.debug(f"reuse {path}")
+        # keep it from gc of old scripts
+        os.utime(path)
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(content)
+    os.replace(tmp, path)
+    return path
+
+
+def gc(
+    root: str,
+    keep: Set[str],
+    min_age: float = 3600,
+    dry_run: bool = False,
+    active: Optional[Set[str]] = None,
+) -> List[str]:
+    """remove scripts in the store except keep and scripts newer than min_age seconds.
+    If active jids in the scheduler are given, their submitted scripts are kept too,
+    and records of other submissions are removed.
+    Manifests which are not referenced by remaining scripts are also removed.
+    """
+    if not os.path.isdir(root):
+        return []
+
+    keep = {os.path.abspath(p) for p in keep}
+    if active is not None:
+        keep |= submitted_scripts(root, active)
+    now = time.time()
+    removed = []
+    remaining = []
+    manifests = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.abspath(os.path.join(dirpath, filename))
+            if os.path.basename(dirpath) == "jobs":
+                # a job submitted just now may not be in qstat yet
+                if active is not None and filename not in active and now - os.path.getmtime(path) >= min_age:
+                    removed.append(path)
+                continue
+            if os.path.basename(dirpath) == "manifests":
+                manifests.append(path)
+                continue
+            if path in keep or now - os.path.getmtime(path) < min_age:
+                remaining.append(path)
+                continue
+            removed.append(path)
+
+    referenced = set()
+    for path in remaining:
+        with open(path) as f:
+            content = f.read()
+        referenced |= {m for m in manifests if m in content}
+
+    for path in manifests:
+        # index is removed together with its manifest
+        manifest = path[: -len(".idx")] if path.endswith(".idx") else path
+        if manifest in referenced:
+            continue
+        if os.path.exists(manifest) and now - os.path.getmtime(manifest) < min_age:
+            continue
+        removed.append(path)
+
+    for path in removed:
+        logger.debug(f"remove {path}")
+        if not dry_run:
+            os.remove(path)
+
+    # remove empty shards
+    if not dry_run:
+        for entry in os.listdir(root):
+            path = os.path.join(root, entry)
+            if entry not in ["manifests", "jobs"] and os.path.isdir(path) and not os.listdir(path):
+                os.rmdir(path)
+    return removed
@@ -1,5 +1,11 @@
+import os
+
 from qsubpy.config import Config
-from typing import Optional, List
+from qsubpy.utils import STATE_DIR
+from typing import Callable, Optional, List, Tuple
+
+# directory of exit status of tasks, relative to the working directory of jobs
+STATUS_DIR = STATE_DIR + "/status"
 
 
 class Template:
@@ -20,37 +26,186 @@ class Template:
         array_command: Optional[str] = None,
         mem: Optional[str] = None,
         slot: Optional[str] = None,
+        manifest: Optional[str] = None,
+        chunks: Optional[int] = None,
+        bundle: Optional[int] = None,
+        common_variables_hole: Optional[str] = None,
+        order: Optional[Callable] = None,
+        max_concurrent: Optional[int] = None,
+        scatter: Optional[Tuple[str, int, str]] = None,
+        log: Optional[str] = None,
     ) -> List[str]:
+        """header and body of the script. scatter is (file, lines_per_task, index).
+        If log is given, tasks of array jobs append their stdout and stderr to the log bundle.
+        """
         self._make_header(mem, slot)
         self._make_body()
 
-        self.body.append("\n" + self.config.make_common_variables_params())
+        if common_variables_hole is not None:
+            self.body.append("\n" + common_variables_hole)
+        else:
+            self.body.append("\n" + self.config.make_common_variables_params())
+
+        if chunks is not None and array_command is None:
+            raise ValueError("chunks need ls or array_command")
+        if bundle is not None and array_command is not None:
+            raise ValueError("bundle cannot be an array job of ls or array_command")
+        if scatter is not None and (array_command is not None or bundle is not None or chunks is not None):
+            raise ValueError("scatter cannot be used with ls, array_command, chunks or bundle")
+
+        if bundle is not None:
+            self.header.append(self.config.array_header(bundle))
+            self.body.append(self.task_status())
 
         if array_command is not None:
-            array_header, array_body = self.config.array_header_with_cmd(array_command)
+            if chunks is not None:
+                array_header, array_body = self.config.array_header_with_chunks(
+                    array_command, chunks, manifest, order
+                )
+            elif manifest is not None:
+                array_header, array_body = self.config.array_header_with_manifest(
+                    array_command, manifest, order
+                )
+            else:
+                array_header, array_body = self.config.array_header_with_cmd(
+                    array_command
+                )
+            self.header.append(array_header)
+            self.body.append(self.task_status(log))
+            self.body.append(array_body)
+
+        if scatter is not None:
+            array_header, array_body = self.config.array_header_with_scatter(*scatter)
             self.header.append(array_header)
+            self.body.append(self.task_status(log))
             self.body.append(array_body)
 
+        if max_concurrent is not None and (array_command, bundle, scatter) != (None, None, None):
+            self.header.append(self.config.max_concurrent_header(max_concurrent))
+        if log is not None and (array_command, scatter) != (None, None):
+            self.header.append(self.config.log_header)
+
         self.body.append("")
 
         return self.header + self.body
 
+    def task_status(self, log: Optional[str] = None) -> str:
+        """record exit code of each task to STATUS_DIR/$JOB_ID.tasks as "<task id>\t<exit code>",
+        like following
+
+        mkdir -p .qsubpy/status
+        trap 'printf "%d\t%d\n" $SGE_TASK_ID $? >> .qsubpy/status/${JOB_ID}.tasks' EXIT
+
+        If log is given, stdout and stderr of the task are appended to the log bundle at exit too.
+        """
+        status = f"{STATUS_DIR}/${{{self.config.job_id[1:]}}}.tasks"
+        if log is not None:
+            return self.aggregate_log(log, status)
+        trap = (
+            "trap 'printf \"%d\\t%d\\n\" "
+            + self.config.array_job_id
+            + f" $? >> {status}' EXIT"
+        )
+        return "\n".join([f"mkdir -p {STATUS_DIR}", trap])
+
+    def aggregate_log(self, log: str, status: str) -> str:
+        """write stdout and stderr of the task to node local files, and at exit append them
+        to the log bundle as gzip members and write the record of the task to its index
+        (see qsubpy.logs). The bundle is locked by flock while appending.
+        """
+        from qsubpy.logs import INDEX_RECORD, LENGTH_WIDTH, STATUS_WIDTH
+
+        task = self.config.array_job_id
+        record = "\\t".join([f"%0{LENGTH_WIDTH}d"] * 3 + [f"%0{STATUS_WIDTH}d"]) + "\\n"
+        return "\n".join(
+            [
+                f"mkdir -p {STATUS_DIR} {os.path.dirname(log)}",
+                f"qsubpy_log={log}",
+                'qsubpy_log_tmp=$(mktemp -d "${TMPDIR:-/tmp}/qsubpy_log.XXXXXX")',
+                'exec 3>&1 4>&2 > "$qsubpy_log_tmp/o" 2> "$qsubpy_log_tmp/e"',
+                "qsubpy_exit() {",
+                "    local rc=$?",
+                "    exec 1>&3 2>&4",
+                f'    printf "%d\\t%d\\n" {task} $rc >> {status}',
+                "    (",
+                "        flock 9",
+                '        start=$(stat -c %s "$qsubpy_log" 2>/dev/null || echo 0)',
+                '        gzip -c "$qsubpy_log_tmp/o" >> "$qsubpy_log"',
+                '        middle=$(stat -c %s "$qsubpy_log")',
+                '        gzip -c "$qsubpy_log_tmp/e" >> "$qsubpy_log"',
+                '        end=$(stat -c %s "$qsubpy_log")',
+                f'        printf "{record}" $start $(($middle-$start)) $(($end-$middle)) $rc'
+                + f' | dd of="$qsubpy_log.idx" bs={INDEX_RECORD} seek=$(({task}-1)) conv=notrunc iflag=fullblock 2>/dev/null',
+                '    ) 9>> "$qsubpy_log.lock"',
+                '    rm -rf "$qsubpy_log_tmp"',
+                "    exit $rc",
+                "}",
+                "trap qsubpy_exit EXIT",
+            ]
+        )
+
+    def bundle_body(self, members: List[Tuple[str, List[str]]]) -> List[str]:
+        """run the command of the i-th member in task i. stdout and stderr of each member
+        are written to <member name>.o$JOB_ID and <member name>.e$JOB_ID, like following
+
+        case $SGE_TASK_ID in
+        1)
+        exec > a.o${JOB_ID} 2> a.e${JOB_ID}
+        echo a
+        ;;
+        esac
+        """
+        job_id = f"${{{self.config.job_id[1:]}}}"
+        lines = [f"case {self.config.array_job_id} in"]
+        for i, (name, cmd) in enumerate(members, start=1):
+            lines.append(f"{i})")
+            lines.append(f"exec > {name}.o{job_id} 2> {name}.e{job_id}")
+            lines += [c.rstrip("\n") for c in cmd]
+            lines.append(";;")
+        lines += ["esac", ""]
+        return lines
 
-# TODO! implement chunk mode... below is example
-"""
-#!/bin/bash
-
-arrays=(
-    "1 2 3"
-    "11 22 33"
-    "111 222 333"
-)
-
-for array in "${arrays[@]}"; do
-    echo "------------"
-    data=(${array[@]})
-    for a in ${data[@]}; do
-        echo ${a}
-    done
-done
-"""
+    def chunk_body(self, cmd: List[str], parallel: int = 1) -> List[str]:
+        """run cmd for each elem of qsubpy_chunk, at most parallel elements at once.
+        exit code of each element is appended to STATUS_DIR/$JOB_ID.elements
+        as "<1-origin element index>\t<exit code>", and the task fails if any element fails.
+        """
+        status = f"{STATUS_DIR}/${{{self.config.job_id[1:]}}}.elements"
+        lines = [
+            "qsubpy_elem() {",
+            "elem=$1",
+        ]
+        lines += [c.rstrip("\n") for c in cmd]
+        lines += [
+            "}",
+            "",
+            "qsubpy_failed=0",
+            "qsubpy_wait() {",
+            "    local rc=0",
+            "    wait $1 || rc=$?",
+            f'    printf "%d\\t%d\\n" $2 $rc >> {status}',
+            "    if [ $rc -ne 0 ]; then",
+            '        echo "element $2 failed with exit code $rc" >&2',
+            "        qsubpy_failed=1",
+            "    fi",
+            "}",
+            "",
+            "qsubpy_pids=()",
+            "qsubpy_indices=()",
+            'for qsubpy_i in "${!qsubpy_chunk[@]}"; do',
+            '    qsubpy_elem "${qsubpy_chunk[$qsubpy_i]}" &',
+            "    qsubpy_pids+=($!)",
+            "    qsubpy_indices+=($(($qsubpy_offset+$qsubpy_i+1)))",
+            f"    if [ ${{#qsubpy_pids[@]}} -ge {parallel} ]; then",
+            "        qsubpy_wait ${qsubpy_pids[0]} ${qsubpy_indices[0]}",
+            '        qsubpy_pids=("${qsubpy_pids[@]:1}")',
+            '        qsubpy_indices=("${qsubpy_indices[@]:1}")',
+            "    fi",
+            "done",
+            'for qsubpy_i in "${!qsubpy_pids[@]}"; do',
+            "    qsubpy_wait ${qsubpy_pids[$qsubpy_i]} ${qsubpy_indices[$qsubpy_i]}",
+            "done",
+            "exit $qsubpy_failed",
+            "",
+        ]
+        return lines
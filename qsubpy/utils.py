@@ -1,10 +1,16 @@
+import os
 import logging
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from argparse import ArgumentParser
 
+from qsubpy.profiling import traced
+
 
 logger = logging.getLogger(__name__)
 
+# directory of qsubpy state, relative to the working directory
+STATE_DIR = ".qsubpy"
+
 
 def sanitize_dict_key(d: Dict) -> Dict:
     def change_dict_key(old_key, new_key, default_value=None):
@@ -23,7 +29,17 @@ def add_default_args(parser: ArgumentParser, handler) -> ArgumentParser:
     parser.add_argument("--mem", type=str, default="4G", help="default memory")
     parser.add_argument("--slot", type=str, default="1", help="default slots")
     parser.add_argument("-n", "--name", type=str, default=None, help="job name")
+    parser.add_argument(
+        "--backend",
+        default=None,
+        choices=["sge", "local"],
+        help="run jobs with qsub (sge, default) or in processes on this host (local)",
+    )
+
+    return add_common_args(parser, handler)
+
 
+def add_common_args(parser: ArgumentParser, handler) -> ArgumentParser:
     parser.add_argument(
         "--dry_run", action="store_true", help="Only make sh files for qsub. not run."
     )
@@ -33,20 +49,39 @@ def add_default_args(parser: ArgumentParser, handler) -> ArgumentParser:
         choices=["error", "warning", "warn", "info", "debug"],
         help="set log level",
     )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="write a trace of qsubpy's own phases to the path and print their summary",
+    )
+    parser.add_argument(
+        "--cprofile",
+        type=str,
+        default=None,
+        help="write a cProfile dump of qsubpy to the path and print the top hot spots",
+    )
 
     parser.set_defaults(handler=handler)
 
     return parser
 
 
-def make_uuid() -> str:
-    """make uuid4
-    Returns:
-        str: uuid4
-    """
-    import uuid
-
-    return "tmp_" + str(uuid.uuid4())
+def add_bulk_args(parser: ArgumentParser) -> ArgumentParser:
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=4,
+        help="max number of concurrent qsub when many scripts are given",
+    )
+    parser.add_argument(
+        "--jid_table",
+        type=str,
+        default=None,
+        help="write jid table as json to the path instead of stdout",
+    )
+    return parser
 
 
 def read_sh(path: str):
@@ -66,6 +101,7 @@ def read_sh(path: str):
     return lines
 
 
+@traced("render")
 def make_sh_file(
     cmd: list,
     mem: Optional[str],
@@ -73,8 +109,15 @@ def make_sh_file(
     name: Optional[str],
     ls_pattern: str = None,
     array_command: str = None,
-    chunks=None,
+    chunks: Optional[int] = None,
     common_variables=None,
+    manifest: bool = False,
+    chunk_parallel: bool = False,
+    bundle: Optional[List[Tuple[str, List[str]]]] = None,
+    balance: bool = False,
+    max_concurrent: Optional[int] = None,
+    scatter: Optional[Tuple[str, int]] = None,
+    aggregate_logs: Optional[bool] = None,
 ) -> str:
     """
     make sh file with qsub options. return generated file name.
@@ -83,18 +126,26 @@ def make_sh_file(
         cmd (list): command list
         mem (str): required memory, eg., 4G
         slot (str): required slot, eg., 1
-        name (str): job name
+        name (str): job name. If None, the script is written to the script store.
         ls_pattern (str): mimic ls eg., /path/to/*.py
+        chunks (int): number of elements packed into one array task
         common_variables (dict): common variable in bash script.
+        manifest (bool): freeze array elements to <name>.manifest at submission.
+        chunk_parallel (bool): run elements of a chunk in parallel up to slot.
+        bundle (list): (name, cmd) of members run as tasks of one array job. cmd is not used.
+        balance (bool): order array elements by cost in the manifest, see qsubpy.balance.
+        max_concurrent (int): max number of running tasks of the array job.
+        scatter (tuple): (file, lines_per_task) to run each task on its lines of the file.
+        aggregate_logs (bool): append logs of tasks to a log bundle, see qsubpy.logs.
+            If None, logs.aggregate of config is used.
     Returns:
         str: generated file name
     """
     from qsubpy.templates import Template
     from qsubpy.config import read_config
+    from qsubpy.store import manifest_dir
 
-    config = read_config()
-    if common_variables is not None:
-        config.common_variables.update(common_variables)
+    config = read_config().with_common_variables(common_variables)
 
     template = Template(config)
 
@@ -104,25 +155,135 @@ def make_sh_file(
     if ls_pattern is not None and array_command is None:
         array_command = " ".join(["ls", ls_pattern])
 
+    # scripts without name are stored in the script store by content
+    use_store = name is None
+    if not use_store and not name.endswith(".sh"):
+        name += ".sh"
+
+    order = None
+    if balance:
+        from qsubpy.balance import balancer
+
+        if array_command is None:
+            raise ValueError("balance needs ls or array_command")
+        # the balanced order of elements is frozen to the manifest
+        manifest = True
+        order = balancer(None if use_store else os.path.basename(name)[: -len(".sh")], chunks)
+
+    manifest_path = None
+    if manifest and use_store:
+        manifest_path = manifest_dir(config.store_dir)
+    elif manifest:
+        manifest_path = name[: -len(".sh")] + ".manifest"
+
+    scatter_index = None
+    if scatter is not None:
+        if balance:
+            raise ValueError("balance cannot be used with scatter")
+        # the index of unnamed scripts is named by the file in the store
+        scatter_index = manifest_dir(config.store_dir) if use_store else name[: -len(".sh")] + ".scatter.idx"
+
+    log = None
+    if aggregate_logs is None:
+        aggregate_logs = config.aggregate_logs
+    if aggregate_logs and (array_command is not None or scatter is not None):
+        from qsubpy.logs import bundle_path
+
+        stage = "job" if use_store else os.path.basename(name)[: -len(".sh")]
+        job_id = f"${{{config.job_id[1:]}}}"
+        log = bundle_path(stage, job_id, os.path.abspath(config.log_dir))
+
     script = template.make_templates(
         array_command=array_command,
         mem=mem,
         slot=slot,
+        manifest=manifest_path,
+        chunks=chunks,
+        bundle=len(bundle) if bundle is not None else None,
+        order=order,
+        max_concurrent=max_concurrent,
+        scatter=(scatter[0], scatter[1], scatter_index) if scatter is not None else None,
+        log=log,
     )
 
-    script += cmd
+    if bundle is not None:
+        script += template.bundle_body(bundle)
+    elif chunks is not None:
+        parallel = 1
+        if chunk_parallel:
+            parallel = int(slot if slot is not None else config.resources.default_slot)
+        script += template.chunk_body(cmd, parallel=parallel)
+    else:
+        script += cmd
+
+    return write_sh_file("\n".join(script), name, config.store_dir)
+
+
+def write_sh_file(content: str, name: Optional[str], store_dir: str) -> str:
+    """write the script to <name>.sh, or to the script store if name is None"""
+    from qsubpy.store import store_script
 
     if name is None:
-        name = make_uuid()
+        return store_script(content, store_dir)
+
     if not name.endswith(".sh"):
         name += ".sh"
-
     with open(name, "w") as f:
-        f.write("\n".join(script))
-
+        f.write(content)
     return name
 
 
+# placeholder of common variables in scripts rendered ahead of time
+COMMON_VARIABLES_HOLE = "# qsubpy: common variables"
+
+
+def render_sh_template(cmd: list, mem: Optional[str], slot: Optional[str]) -> str:
+    """render the script of a stage without array job, leaving common variables
+    as COMMON_VARIABLES_HOLE to be filled by fill_sh_file.
+    """
+    from qsubpy.templates import Template
+    from qsubpy.config import read_config
+
+    script = Template(read_config()).make_templates(
+        mem=mem, slot=slot, common_variables_hole=COMMON_VARIABLES_HOLE
+    )
+    return "\n".join(script + cmd)
+
+
+@traced("render")
+def fill_sh_file(template: str, name: Optional[str], common_variables=None) -> str:
+    """write the script rendered by render_sh_template with common variables"""
+    from qsubpy.config import read_config
+
+    config = read_config().with_common_variables(common_variables)
+    content = template.replace(COMMON_VARIABLES_HOLE, config.make_common_variables_params(), 1)
+    return write_sh_file(content, name, config.store_dir)
+
+
+def stage_image_command(image: str, stage_dir: str) -> List[str]:
+    """copy the image to stage_dir once per node and set qsubpy_image to the local copy.
+    Tasks on the same node wait for the copy by flock. The local copy is named by
+    the path and mtime of the image, so a rebuilt image is copied again.
+    """
+    import os
+    import hashlib
+
+    path = os.path.expanduser(image)
+    mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+    h = hashlib.sha256(f"{os.path.abspath(path)}:{mtime}".encode("utf-8")).hexdigest()[:12]
+    local = f"{stage_dir}/qsubpy_images/{h}-{os.path.basename(path)}"
+    return [
+        f"mkdir -p {stage_dir}/qsubpy_images",
+        f"qsubpy_image={local}",
+        "(",
+        "    flock 9",
+        '    if [ ! -f "$qsubpy_image" ]; then',
+        f'        cp {image} "$qsubpy_image.$$" && mv "$qsubpy_image.$$" "$qsubpy_image"',
+        "    fi",
+        ') 9> "$qsubpy_image.lock"',
+    ]
+
+
 def make_singularity_command(
     command: List[str], singularity_img: str, bind_dirs: Optional[List[str]] = None
 ) -> str:
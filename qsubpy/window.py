@@ -0,0 +1,57 @@
+"""sliding window of workflow submission
+
+In ord mode all stages are submitted at once, so a large fan-out floods the
+queue. With window in settings.yml, a stage is submitted only when the jobs
+of the workflow still in the queue are fewer than max_jobs and their tasks
+plus the tasks of the stage are at most max_tasks. Otherwise qsubpy waits
+until earlier jobs drain, watching them with the job monitor.
+"""
+from typing import Dict, Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SubmitWindow:
+    def __init__(self, max_jobs: Optional[int] = None, max_tasks: Optional[int] = None, monitor=None):
+        if max_jobs is not None and max_jobs < 1:
+            raise ValueError("max_jobs of window should be positive integer")
+        if max_tasks is not None and max_tasks < 1:
+            raise ValueError("max_tasks of window should be positive integer")
+        self.max_jobs = max_jobs
+        self.max_tasks = max_tasks
+        self._monitor = monitor
+        # jid -> number of tasks of submitted jobs which may be in the queue
+        self.queued: Dict[str, int] = {}
+
+    @property
+    def monitor(self):
+        if self._monitor is None:
+            from qsubpy.monitor import get_monitor
+
+            self._monitor = get_monitor()
+        return self._monitor
+
+    def fits(self, tasks: int) -> bool:
+        # a stage larger than max_tasks is submitted when the queue is empty
+        if len(self.queued) == 0:
+            return True
+        if self.max_jobs is not None and len(self.queued) >= self.max_jobs:
+            return False
+        if self.max_tasks is not None and sum(self.queued.values()) + tasks > self.max_tasks:
+            return False
+        return True
+
+    def wait(self, tasks: int = 1):
+        """wait until a stage of tasks fits in the window"""
+        while not self.fits(tasks):
+            logger.info(
+                f"wait for {len(self.queued)} jobs ({sum(self.queued.values())} tasks) in the window"
+            )
+            for jid in self.monitor.wait_any(self.queued):
+                self.queued.pop(jid, None)
+
+    def add(self, jid: Optional[str], tasks: int = 1):
+        if jid is not None:
+            self.queued[jid] = tasks
@@ -0,0 +1,30 @@
+import os
+
+from qsubpy.backends import LocalBackend, get_backend, is_local_jid
+from qsubpy.config import read_config
+
+
+def test_get_backend():
+    assert get_backend("local") is get_backend("local")
+    assert get_backend("sge").name == "sge"
+
+
+def test_local_backend(tmp_path, monkeypatch):
+    config = read_config()
+    monkeypatch.chdir(tmp_path)
+    backend = LocalBackend(config, max_workers=2)
+
+    with open("a.sh", "w") as f:
+        f.write("#!/bin/bash\necho $JOB_ID > a.out\n")
+    with open("b.sh", "w") as f:
+        f.write(f"#!/bin/bash\n{config.array_header(3)}\ncat a.out > b.$SGE_TASK_ID\nexit $((SGE_TASK_ID - 1))\n")
+
+    a = backend.submit("a.sh", [])
+    b = backend.submit("b.sh", [a])
+    assert is_local_jid(a) and is_local_jid(b)
+    status = backend.wait([a, b])
+    assert status == {a: 0, b: 2}
+    for task in [1, 2, 3]:
+        with open(f"b.{task}") as f:
+            assert f.read().strip() == a
+    assert os.path.exists(f"b.sh.o{b}.3")
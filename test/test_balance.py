@@ -0,0 +1,37 @@
+from qsubpy.balance import balance_elements, element_runtimes, estimate_costs
+
+
+def test_balance_without_chunks():
+    assert balance_elements(["a", "b", "c"], [1, 3, 2]) == ["b", "c", "a"]
+
+
+def test_balance_chunks():
+    elements = list("abcdefg")
+    costs = [10, 9, 8, 1, 1, 1, 1]
+    balanced = balance_elements(elements, costs, chunks=3)
+    assert sorted(balanced) == elements
+    bins = [balanced[i : i + 3] for i in range(0, len(balanced), 3)]
+    assert [len(b) for b in bins] == [3, 3, 1]
+    loads = [sum(costs[elements.index(e)] for e in b) for b in bins[:2]]
+    assert max(loads) - min(loads) <= 8
+    # the heaviest element is not packed with the second heaviest
+    assert not {"a", "b"} <= set(bins[0])
+
+
+def test_estimate_costs(tmp_path):
+    big = tmp_path / "big.fq"
+    small = tmp_path / "small.fq"
+    big.write_bytes(b"x" * 1000)
+    small.write_bytes(b"x" * 10)
+    elements = [str(small), str(big), "not_a_file"]
+    assert estimate_costs(elements) == [10, 1000, 505]
+
+    history = [
+        {"stage": "align", "element": str(small), "wallclock": 20},
+        {"stage": "align", "element": str(small), "wallclock": 40},
+        {"stage": "other", "element": str(big), "wallclock": 1},
+    ]
+    runtimes = element_runtimes("align", history)
+    assert runtimes == {str(small): 30}
+    # 3 seconds per byte from the small file
+    assert estimate_costs(elements, runtimes) == [30, 3000, 1515]
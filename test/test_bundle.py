@@ -0,0 +1,98 @@
+import os
+import argparse
+
+import pytest
+
+from qsubpy.run import Bundle, Settings, Stage, bundle_stages, workflow_mode
+
+
+def write_workflow(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    return str(path)
+
+
+def load(path):
+    settings = Settings(path, dry_run=True)
+    stages = [Stage(s, settings) for s in settings.stages]
+    return stages, [s.name for s in stages], settings
+
+
+def test_bundle_stages(tmp_path):
+    path = write_workflow(
+        tmp_path / "wf.yml",
+        """
+stages:
+  - {name: prepare, cmd: echo prepare}
+  - {name: stats_a, cmd: echo a, bundle: stats}
+  - {name: stats_b, cmd: echo b, bundle: stats, needs: [prepare]}
+  - {name: merge, cmd: cat, needs: [stats_a, stats_b]}
+""",
+    )
+    nodes = bundle_stages(*load(path))
+    assert list(nodes) == ["prepare", "stats", "merge"]
+    assert isinstance(nodes["stats"][0], Bundle)
+    assert nodes["stats"][0].member_names == ["stats_a", "stats_b"]
+    assert nodes["stats"][1] == ["prepare"]
+    assert nodes["merge"][1] == ["stats"]
+
+
+def test_auto_bundle(tmp_path):
+    path = write_workflow(
+        tmp_path / "wf.yml",
+        """
+auto_bundle: true
+stages:
+  - {name: a, cmd: echo a, needs: []}
+  - {name: b, cmd: echo b, needs: []}
+  - {name: c, cmd: echo c, needs: [], mem: 8G}
+  - {name: d, cmd: echo d}
+""",
+    )
+    nodes = bundle_stages(*load(path))
+    assert list(nodes) == ["bundle_a", "c", "d"]
+    assert nodes["d"][1] == ["c"]
+
+
+def test_bundle_invalid(tmp_path):
+    path = write_workflow(
+        tmp_path / "wf.yml",
+        """
+stages:
+  - {name: a, cmd: echo a, bundle: x}
+  - {name: b, cmd: echo b, bundle: x, mem: 8G}
+""",
+    )
+    with pytest.raises(ValueError):
+        bundle_stages(*load(path))
+
+
+def test_bundle_local(tmp_path, monkeypatch):
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath(os.environ.get("QSUBPY_CONFIG", "config.toml")))
+    monkeypatch.chdir(tmp_path)
+    path = write_workflow(
+        tmp_path / "wf.yml",
+        """
+mode: sync
+backend: local
+stages:
+  - {name: a, cmd: echo a, bundle: x}
+  - {name: b, cmd: echo b >&2, bundle: x}
+""",
+    )
+    args = argparse.Namespace(
+        workflow=path,
+        dry_run=False,
+        common_variables=[],
+        force=False,
+        auto_resources=False,
+        backend=None,
+        prometheus=None,
+        compile=False,
+        via_daemon=False,
+    )
+    workflow_mode(args)
+    [a_out] = [p for p in os.listdir() if p.startswith("a.o")]
+    [b_err] = [p for p in os.listdir() if p.startswith("b.e")]
+    assert open(a_out).read() == "a\n"
+    assert open(b_err).read() == "b\n"
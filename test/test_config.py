@@ -1,4 +1,9 @@
-from qsubpy.config import Config, read_config
+import subprocess
+
+import pytest
+
+from qsubpy.config import Config, SingularityConfig, read_config
+from qsubpy.utils import stage_image_command
 
 
 def test_config_resource():
@@ -15,7 +20,73 @@ def test_array_job():
     assert array_header == "#$ -t 1-2:1"
     assert array_body == "array=($(echo 'a b'))\nelem=${array[$(($SGE_TASK_ID-1))]}"
     
+def test_array_job_chunks():
+    config = read_config("config.toml")
+
+    array_header, array_body = config.array_header_with_chunks("cat test/barcodes.tsv", 4)
+    assert array_header == "#$ -t 1-3:1"
+    assert array_body == "\n".join(
+        [
+            "qsubpy_offset=$((($SGE_TASK_ID-1)*4))",
+            "array=($(cat test/barcodes.tsv))",
+            'qsubpy_chunk=("${array[@]:$qsubpy_offset:4}")',
+        ]
+    )
+
+
 def test_ord_qsub():
     config = read_config("config.toml")
     ord_qsub = config.ord_qsub_command("22222222")
-    assert ord_qsub == ["qsub", "-hold_jid", "22222222"]
\ No newline at end of file
+    assert ord_qsub == ["qsub", "-hold_jid", "22222222"]
+    assert config.ord_qsub_command("1", "2,3") == ["qsub", "-hold_jid", "1", "-hold_jid_ad", "2,3"]
+    assert config.ord_qsub_command("", "2") == ["qsub", "-hold_jid_ad", "2"]
+
+
+def test_read_config_cached():
+    config = read_config("config.toml")
+    assert read_config("config.toml") is config
+
+
+def test_common_variables_overlay():
+    config = read_config("config.toml")
+    overlay = config.with_common_variables({"fasta": "/path/to/fasta"})
+    assert overlay.make_common_variables_list() == ['fasta="/path/to/fasta"']
+    assert config.make_common_variables_list() == []
+    assert config.with_common_variables(None) is config
+
+
+def test_resolve_image(tmp_path):
+    (tmp_path / "ubuntu.sif").write_text("image")
+    singularity = SingularityConfig({"singularity": {"image_root": str(tmp_path), "default_ext": "sif"}})
+    assert singularity.resolve_image("ubuntu") == str(tmp_path / "ubuntu.sif")
+    with pytest.raises(FileNotFoundError):
+        singularity.resolve_image("ubuntuu")
+
+    # resolved once per process
+    (tmp_path / "ubuntu.sif").unlink()
+    assert singularity.resolve_image("ubuntu") == str(tmp_path / "ubuntu.sif")
+
+
+def test_stage_image(tmp_path):
+    image = tmp_path / "ubuntu.sif"
+    image.write_text("image")
+    lines = stage_image_command(str(image), "$TMPDIR") + ['cat "$qsubpy_image"']
+    script = "\n".join(lines)
+    env = {"TMPDIR": str(tmp_path / "node"), "PATH": "/usr/bin:/bin"}
+    procs = [subprocess.Popen(["bash", "-c", script], stdout=subprocess.PIPE, env=env) for _ in range(4)]
+    assert [p.communicate()[0] for p in procs] == [b"image"] * 4
+    staged = [p for p in (tmp_path / "node" / "qsubpy_images").iterdir() if p.name.endswith("ubuntu.sif")]
+    assert len(staged) == 1
+
+
+def test_max_concurrent(tmp_path, monkeypatch):
+    import os
+    from qsubpy.utils import make_sh_file
+
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath("config.toml"))
+    monkeypatch.chdir(tmp_path)
+    with open(make_sh_file(["echo $elem"], None, None, "t", array_command="seq 1 3", max_concurrent=2)) as f:
+        lines = f.read().splitlines()
+    assert "#$ -t 1-3:1" in lines and "#$ -tc 2" in lines
+    with open(make_sh_file(["echo a"], None, None, "u", max_concurrent=2)) as f:
+        assert "#$ -tc 2" not in f.read()
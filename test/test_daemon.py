@@ -0,0 +1,109 @@
+import os
+import json
+import threading
+
+import pytest
+
+from qsubpy.daemon import Daemon, DaemonError, TokenBucket, request, serve
+from qsubpy.journal import load_job
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+    assert [bucket.delay() for _ in range(3)] == [0.0, 0.0, 0.5]
+    now[0] = 10.0
+    assert bucket.delay() == 0.0
+
+
+class FakeQsub:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, cwd, hold_jids, array_hold_jids, script, config):
+        self.calls.append((cwd, hold_jids, array_hold_jids, os.path.basename(script)))
+        return str(10000001 + len(self.calls))
+
+
+def test_daemon(tmp_path, monkeypatch):
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath("config.toml"))
+    qsub = FakeQsub()
+    daemon = Daemon(journal=str(tmp_path / "serve.jsonl"), rate=1000, submit=qsub)
+    path = str(tmp_path / "serve.sock")
+    server = serve(daemon, path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        a = request("submit", path=path, script="a.sh", cwd=str(tmp_path), record={"stage": "a"})["ticket"]
+        b = request(
+            "submit", path=path, script="b.sh", cwd=str(tmp_path), hold_jids=["999"], array_hold_jids=[a]
+        )["ticket"]
+        assert daemon.result(b, timeout=5) == {"jid": "10000003"}
+        assert qsub.calls == [(str(tmp_path), [], [], "a.sh"), (str(tmp_path), ["999"], ["10000002"], "b.sh")]
+
+        job = load_job("10000003", root=str(tmp_path / ".qsubpy" / "jobs"))
+        assert job["ticket"] == b and job["array_hold_jids"] == ["10000002"]
+        assert load_job("10000002", root=str(tmp_path / ".qsubpy" / "jobs"))["stage"] == "a"
+
+        with pytest.raises(DaemonError):
+            request("unknown", path=path)
+        # only one daemon per socket
+        with pytest.raises(DaemonError):
+            serve(Daemon(journal=str(tmp_path / "other.jsonl"), submit=qsub), path)
+    finally:
+        server.shutdown()
+        server.server_close()
+        daemon.stop()
+
+
+def test_daemon_resume(tmp_path, monkeypatch):
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath("config.toml"))
+    journal = tmp_path / "serve.jsonl"
+    entries = [
+        {"ticket": "daemon-1-1-1", "request": {"script": "a.sh", "cwd": str(tmp_path)}},
+        {"ticket": "daemon-1-1-1", "result": {"jid": "10000001"}},
+        {"ticket": "daemon-1-1-2", "request": {"script": "b.sh", "cwd": str(tmp_path)}},
+        {"ticket": "daemon-1-1-2", "result": {"jid": "10000002"}},
+        {"ticket": "daemon-1-1-3", "request": {"script": "c.sh", "cwd": str(tmp_path), "hold_jids": ["daemon-1-1-2"]}},
+    ]
+    journal.write_text("".join(json.dumps(e) + "\n" for e in entries))
+
+    qsub = FakeQsub()
+    daemon = Daemon(journal=str(journal), rate=1000, submit=qsub)
+    # handled requests not held by queued ones are dropped
+    assert [json.loads(line)["ticket"] for line in journal.read_text().splitlines()] == [
+        "daemon-1-1-2",
+        "daemon-1-1-3",
+    ]
+    daemon.start()
+    assert daemon.result("daemon-1-1-3", timeout=5) == {"jid": "10000002"}
+    assert qsub.calls == [(str(tmp_path), ["10000002"], [], "c.sh")]
+    daemon.stop()
+
+
+def test_daemon_resume_submitting(tmp_path, monkeypatch):
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath("config.toml"))
+    journal = tmp_path / "serve.jsonl"
+    entries = [
+        {"ticket": "daemon-1-1-1", "request": {"script": "a.sh", "cwd": str(tmp_path)}},
+        {"ticket": "daemon-1-1-1", "submitting": True},
+        {"ticket": "daemon-1-1-2", "request": {"script": "b.sh", "cwd": str(tmp_path)}},
+        {"ticket": "daemon-1-1-2", "submitting": True},
+        {"ticket": "daemon-1-1-3", "request": {"script": "c.sh", "cwd": str(tmp_path), "hold_jids": ["daemon-1-1-1"]}},
+    ]
+    journal.write_text("".join(json.dumps(e) + "\n" for e in entries))
+
+    qsub = FakeQsub()
+    # the daemon stopped after qsub of a.sh, and before qsub of b.sh or while it was running
+    daemon = Daemon(
+        journal=str(journal), rate=1000, submit=qsub, lookup=lambda script, config: {"a.sh": "10000001"}.get(script)
+    )
+    assert daemon.results["daemon-1-1-1"] == {"jid": "10000001"}
+    assert load_job("10000001", root=str(tmp_path / ".qsubpy" / "jobs"))["ticket"] == "daemon-1-1-1"
+    daemon.start()
+    assert daemon.result("daemon-1-1-3", timeout=5) == {"jid": "10000002"}
+    daemon.stop()
+    # neither a.sh nor b.sh is submitted again
+    assert qsub.calls == [(str(tmp_path), ["10000001"], [], "c.sh")]
+    with pytest.raises(DaemonError):
+        daemon.dispatch({"op": "wait", "jids": ["daemon-1-1-2"]})
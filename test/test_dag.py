@@ -0,0 +1,29 @@
+import pytest
+
+from qsubpy.dag import build_dag, topological_sort, run_dag
+
+
+def test_build_dag_default_chain():
+    dag = build_dag(["a", "b", "c"], [None, None, None])
+    assert dag == {"a": [], "b": ["a"], "c": ["b"]}
+
+
+def test_topological_sort():
+    dag = build_dag(["qc", "align", "merge"], [[], [], ["qc", "align"]])
+    assert topological_sort(dag) == ["qc", "align", "merge"]
+
+    with pytest.raises(ValueError):
+        topological_sort({"a": ["b"], "b": ["a"]})
+
+
+def test_run_dag_hold_jids():
+    dag = build_dag(["qc", "align", "merge"], [[], [], ["qc", "align"]])
+    jids = {"qc": "1", "align": "2", "merge": "3"}
+    holds = {}
+
+    def run(name, parent_jids):
+        holds[name] = ",".join(parent_jids)
+        return jids[name]
+
+    assert run_dag(dag, run) == jids
+    assert holds == {"qc": "", "align": "", "merge": "1,2"}
@@ -0,0 +1,29 @@
+from qsubpy.run import Settings, Stage, split_holds
+
+
+def load(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    settings = Settings(str(path), dry_run=True)
+    return {s["name"]: Stage(s, settings) for s in settings.stages}
+
+
+def test_split_holds(tmp_path):
+    stages = load(
+        tmp_path / "wf.yml",
+        """
+stages:
+  - {name: prepare, cmd: echo prepare}
+  - {name: align, ls: "*.fastq", cmd: echo $elem}
+  - {name: sort, ls: "*.fastq", cmd: echo $elem, elementwise: true, needs: [prepare, align]}
+  - {name: call, ls: "*.fastq", cmd: echo $elem, needs: [sort]}
+  - {name: stats, ls: "*.fastq", chunks: 2, cmd: echo $elem, elementwise: true, needs: [sort]}
+""",
+    )
+    parents = [stages["prepare"], stages["align"]]
+    assert split_holds(stages["sort"], parents, ["1", "2"]) == (["1"], ["2"])
+    assert split_holds(stages["sort"], parents, ["1", None]) == (["1"], [])
+    # only elementwise stages hold element-wise
+    assert split_holds(stages["call"], [stages["sort"]], ["3"]) == (["3"], [])
+    # chunks change elements of each task
+    assert split_holds(stages["stats"], [stages["sort"]], ["3"]) == (["3"], [])
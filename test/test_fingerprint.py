@@ -0,0 +1,49 @@
+from qsubpy.fingerprint import stage_fingerprint, FingerprintStore
+
+
+def test_stage_fingerprint(tmp_path):
+    inputs = tmp_path / "in.txt"
+    inputs.write_text("a")
+    fingerprint = stage_fingerprint("echo a", {"a": "b"}, inputs=[str(inputs)])
+
+    assert fingerprint == stage_fingerprint("echo a", {"a": "b"}, inputs=[str(inputs)])
+    assert fingerprint != stage_fingerprint("echo a", {"a": "c"}, inputs=[str(inputs)])
+    assert fingerprint != stage_fingerprint("echo b", {"a": "b"}, inputs=[str(inputs)])
+
+    inputs.write_text("ab")
+    assert fingerprint != stage_fingerprint("echo a", {"a": "b"}, inputs=[str(inputs)])
+
+
+def test_fingerprint_store(tmp_path):
+    store = FingerprintStore(str(tmp_path / "fingerprints"))
+    outputs = tmp_path / "out.txt"
+
+    store.set("stage1", "abc")
+    assert not store.up_to_date("stage1", "abc", [str(outputs)])
+
+    outputs.write_text("done")
+    assert store.up_to_date("stage1", "abc", [str(outputs)])
+    assert not store.up_to_date("stage1", "def", [str(outputs)])
+    assert not store.up_to_date("stage2", "abc", [str(outputs)])
+
+
+def test_fingerprint_store_resolves_ticket(tmp_path, monkeypatch):
+    from qsubpy import monitor
+    from qsubpy.journal import record_job
+
+    class FakeMonitor:
+        def exit_status(self, jid):
+            return {"10000001": 0}.get(jid)
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(monitor, "get_monitor", lambda: FakeMonitor())
+    store = FingerprintStore(str(tmp_path / "fingerprints"))
+    outputs = tmp_path / "out.txt"
+    outputs.write_text("done")
+
+    # the daemon has not submitted the ticket
+    store.set("stage1", "abc", "daemon-1-1-1")
+    assert not store.up_to_date("stage1", "abc", [str(outputs)])
+
+    record_job("10000001", "a.sh", ticket="daemon-1-1-1")
+    assert store.up_to_date("stage1", "abc", [str(outputs)])
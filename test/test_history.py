@@ -0,0 +1,37 @@
+from qsubpy.history import parse_qacct_records, usage_of, suggest, report, format_bytes
+
+
+def load_usages():
+    with open("test/qacct_out_array.txt") as f:
+        out = f.read()
+    usages = [usage_of(r) for r in parse_qacct_records(out)]
+    for usage in usages:
+        usage.update({"stage": "stage3", "fingerprint": "abc", "mem": "4G", "slot": "1"})
+    return usages
+
+
+def test_usage_of():
+    usages = load_usages()
+    assert [u["task"] for u in usages] == [1, 2]
+    assert usages[1]["maxvmem"] == 3 * 1024 ** 3
+    assert usages[1]["wallclock"] == 200
+    assert usages[1]["cpu"] == 390
+
+
+def test_suggest():
+    history = load_usages()
+    assert suggest("stage3", "abc", history=history) == ("4G", "2")
+    assert suggest("stage3", "abc", q=50, headroom=1.0, history=history) == ("1G", "1")
+    assert suggest("stage1", history=history) is None
+
+
+def test_report():
+    row = report(load_usages())[0]
+    assert row["tasks"] == 2
+    assert row["max_mem"] == "3G"
+    assert row["mem_used"] == 0.5
+
+
+def test_format_bytes():
+    assert format_bytes(512 * 1024 ** 2) == "512M"
+    assert format_bytes(4.1 * 1024 ** 3) == "5G"
@@ -0,0 +1,54 @@
+import os
+import argparse
+import subprocess
+
+from qsubpy.journal import record_job
+from qsubpy.logs import bundle_of_script, read_record, read_task_log, records
+from qsubpy.run import logs_mode
+from qsubpy.utils import make_sh_file
+
+
+def run_task(sh_file, jid, task):
+    env = dict(os.environ, SGE_TASK_ID=str(task), JOB_ID=jid)
+    # skip the body of config, which sources ~/.bashrc
+    with open(sh_file) as f:
+        script = f.read().split("set -eu", 1)[1]
+    return subprocess.run(["bash", "-euc", script], capture_output=True, env=env)
+
+
+def test_aggregate_logs(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath("config.toml"))
+    monkeypatch.chdir(tmp_path)
+    cmd = ['echo "out $elem"', 'echo "err $elem" >&2', 'if [ "$elem" = b ]; then exit 3; fi']
+    sh_file = make_sh_file(cmd, None, None, "stage", array_command="echo a b c", aggregate_logs=True)
+    with open(sh_file) as f:
+        script = f.read()
+    assert "#$ -o /dev/null" in script.splitlines()
+
+    for task in [3, 1, 2]:
+        p = run_task(sh_file, "123", task)
+        assert p.stdout == b""
+        assert p.returncode == (3 if task == 2 else 0)
+
+    bundle = bundle_of_script(script, "123")
+    assert bundle == os.path.join(str(tmp_path), ".qsubpy", "logs", "stage.123.log.gz")
+    assert read_task_log(bundle, read_record(bundle, 3)) == ("out c\n", "err c\n")
+    assert [(t, r["status"]) for t, r in records(bundle)] == [(1, 0), (2, 3), (3, 0)]
+    assert read_record(bundle, 4) is None
+
+    record_job("123", sh_file, stage="stage")
+    logs_mode(argparse.Namespace(target="stage", task=None, failed=True))
+    out = capsys.readouterr().out
+    assert "==> task 2 (jid: 123, exit code: 3) <==\nout b\n" in out
+    assert "task 1" not in out
+
+
+def test_aggregate_logs_unfinished_task(tmp_path, monkeypatch):
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath("config.toml"))
+    monkeypatch.chdir(tmp_path)
+    sh_file = make_sh_file(["echo $elem"], None, None, "s", array_command="echo a b c", aggregate_logs=True)
+    run_task(sh_file, "7", 3)
+    with open(sh_file) as f:
+        bundle = bundle_of_script(f.read(), "7")
+    assert read_record(bundle, 1) is None
+    assert [t for t, _ in records(bundle)] == [3]
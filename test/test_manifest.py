@@ -0,0 +1,36 @@
+import subprocess
+
+from qsubpy.config import read_config
+from qsubpy.manifest import write_manifest, read_element, manifest_len, bash_lookup, manifest_of_script
+
+
+def test_manifest(tmp_path):
+    path = str(tmp_path / "elems.manifest")
+    assert write_manifest(["a", "bb", "ccc"], path) == 3
+    assert manifest_len(path) == 3
+    assert read_element(path, 1) == "a"
+    assert read_element(path, 3) == "ccc"
+
+
+def test_array_header_with_manifest(tmp_path):
+    config = read_config("config.toml")
+    path = str(tmp_path / "barcodes.manifest")
+
+    array_header, array_body = config.array_header_with_manifest(
+        "cat test/barcodes.tsv", path
+    )
+    assert array_header == "#$ -t 1-10:1"
+
+    elem = subprocess.run(
+        array_body + "\necho $elem",
+        shell=True,
+        capture_output=True,
+        executable="/bin/bash",
+        env={"SGE_TASK_ID": "2", "PATH": "/usr/bin:/bin"},
+    )
+    assert elem.stdout.decode("utf-8").strip() == "AAACCTGCACCGGAAA-1"
+
+
+def test_manifest_of_script():
+    assert manifest_of_script(bash_lookup("/a/b.manifest", "$SGE_TASK_ID-1")) == "/a/b.manifest"
+    assert manifest_of_script(bash_lookup("/a/b.manifest", "$qsubpy_offset", count=2)) is None
@@ -0,0 +1,27 @@
+from qsubpy.history import parse_qacct_records
+from qsubpy.metrics import load_metrics, prometheus_text, record, record_tasks, task_metrics
+
+
+def load_records():
+    with open("test/qacct_out_array.txt") as f:
+        return parse_qacct_records(f.read())
+
+
+def test_task_metrics():
+    metrics = task_metrics({"jid": "33734360", "stage": "stage3"}, load_records())
+    assert [m["task"] for m in metrics] == [1, 2]
+    assert [m["queue_wait_seconds"] for m in metrics] == [30, 60]
+    assert [m["wallclock_seconds"] for m in metrics] == [100, 200]
+
+
+def test_prometheus_text(tmp_path):
+    path = str(tmp_path / "metrics.jsonl")
+    record("stage", path, stage="stage3", jid="1", render_seconds=0.5, qsub_seconds=0.2, wait_seconds=None)
+    record_tasks({"jid": "1", "stage": "stage3"}, load_records(), path)
+    assert len(load_metrics(path)) == 3
+
+    text = prometheus_text(load_metrics(path)).splitlines()
+    assert 'qsubpy_stage_render_seconds{stage="stage3"} 0.5' in text
+    assert 'qsubpy_task_queue_wait_seconds_sum{stage="stage3"} 90.0' in text
+    assert 'qsubpy_task_wallclock_seconds_count{stage="stage3"} 2' in text
+    assert not any(line.startswith("qsubpy_stage_wait_seconds") for line in text)
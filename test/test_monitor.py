@@ -0,0 +1,59 @@
+import threading
+
+from qsubpy.monitor import JobMonitor, parse_qstat, parse_qacct, exit_status_of
+
+
+QSTAT_OUT = """job-ID     prior   name       user         state submit/start at     queue                          jclass                         slots ja-task-ID
+------------------------------------------------------------------------------------------------------------------------------------------------
+  33733899 0.25000 tmp_fa9ac8 user         r     06/01/2020 12:00:00 all.q@node01                                                      1
+  33734360 0.25000 tmp_9f1d1f user         qw    06/01/2020 12:00:00                                                                   1 1-10:1
+"""
+
+
+def test_parse_qstat():
+    assert parse_qstat(QSTAT_OUT) == {"33733899", "33734360"}
+
+
+def test_exit_status_of():
+    out = "jobnumber    33734360\nexit_status  0\nfailed       0\njobnumber    33734360\nexit_status  137\nfailed       0\n"
+    assert exit_status_of(parse_qacct(out)) == 137
+    assert exit_status_of(parse_qacct("")) is None
+
+
+class StubConfig:
+    def __init__(self, qstat_path):
+        self.qstat_command = ["cat", qstat_path]
+        self.poll_interval = 0.01
+        self.max_poll_interval = 0.05
+        self.qacct_timeout = 5
+        self.qacct_command_of = lambda jid: ["echo", "exit_status", jid[-1]]
+
+
+def test_monitor_wait(tmp_path):
+    qstat = tmp_path / "qstat.txt"
+    qstat.write_text(QSTAT_OUT)
+    monitor = JobMonitor(StubConfig(str(qstat)))
+
+    timer = threading.Timer(0.1, lambda: qstat.write_text(""))
+    timer.start()
+    statuses = monitor.wait(["33733899", "33734360"], timeout=5)
+    assert statuses == {"33733899": 9, "33734360": 0}
+
+
+def test_monitor_waits_for_qacct_record(tmp_path):
+    qstat = tmp_path / "qstat.txt"
+    qstat.write_text("")
+    qacct = tmp_path / "qacct.txt"
+    qacct.write_text("")
+    config = StubConfig(str(qstat))
+    config.qacct_command_of = lambda jid: ["cat", str(qacct)]
+    monitor = JobMonitor(config)
+
+    # qacct has no record for a while after the job leaves qstat
+    timer = threading.Timer(0.1, lambda: qacct.write_text("exit_status  1\n"))
+    timer.start()
+    assert monitor.wait(["33733899"], timeout=5) == {"33733899": 1}
+
+    config.qacct_timeout = 0.1
+    qacct.write_text("")
+    assert monitor.wait(["33734360"], timeout=5) == {"33734360": None}
@@ -0,0 +1,37 @@
+import os
+
+from qsubpy.config import get_default_config_path
+from qsubpy.plan import load_plan
+from qsubpy.run import Settings, Stage, compile_workflow
+from qsubpy.utils import fill_sh_file, make_sh_file, render_sh_template
+
+
+def test_fill_sh_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath(get_default_config_path()))
+    monkeypatch.chdir(tmp_path)
+    expected = make_sh_file(["echo $a"], "8G", "2", "expected", common_variables={"a": "1"})
+    template = render_sh_template(["echo $a"], "8G", "2")
+    filled = fill_sh_file(template, "filled", {"a": "1"})
+    assert open(expected).read() == open(filled).read()
+
+
+def test_compile_workflow(tmp_path, monkeypatch):
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath(get_default_config_path()))
+    monkeypatch.chdir(tmp_path)
+    with open("wf.yml", "w") as f:
+        f.write("stages:\n  - {name: a, cmd: echo a}\n  - {name: b, array_cmd: seq 1 3, cmd: echo $elem}\n")
+
+    compile_workflow("wf.yml")
+    plan = load_plan("wf.yml", get_default_config_path())
+    assert plan is not None
+    a, b = plan["stages"]
+    assert a["script_template"] is not None
+    assert b["script_template"] is None
+
+    settings = Settings("wf.yml", dry_run=True, backend="local", settings=plan["settings"])
+    stage = Stage.from_plan(a, settings.stages[0], settings)
+    assert stage.cmd == ["echo a"] and stage.backend == "local"
+
+    with open("wf.yml", "a") as f:
+        f.write("  - {name: c, cmd: echo c}\n")
+    assert load_plan("wf.yml", get_default_config_path()) is None
@@ -0,0 +1,37 @@
+import json
+import threading
+
+from qsubpy import profiling
+
+
+def test_span_disabled():
+    profiling.clear()
+    with profiling.span("a"):
+        pass
+    assert profiling.spans() == []
+
+
+def test_span_tree(tmp_path):
+    profiling.clear()
+    profiling.enable()
+    try:
+        with profiling.span("workflow"):
+            with profiling.span("stage", stage="a"):
+                with profiling.span("render"):
+                    pass
+            t = threading.Thread(target=lambda: profiling.traced("submit")(lambda: None)())
+            t.start()
+            t.join()
+    finally:
+        profiling.disable()
+
+    paths = sorted(s["path"] for s in profiling.spans())
+    assert paths == ["workflow", "workflow/stage", "workflow/stage/render", "workflow/submit"]
+    assert profiling.summary().splitlines()[1].endswith("  workflow")
+
+    path = str(tmp_path / "trace.json")
+    profiling.write_trace(path)
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    assert {e["name"] for e in events} == {"workflow", "stage", "render", "submit"}
+    profiling.clear()
@@ -13,4 +13,10 @@ def test_get_jid_array():
     
     exspected = "33734360"
     jid = qsub.get_jid(out)
-    assert jid == exspected, f'expected jid is {exspected}, but get {jid}'
\ No newline at end of file
+    assert jid == exspected, f'expected jid is {exspected}, but get {jid}'
+
+def test_qsub_many(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(qsub, "qsub_with_jid", lambda cmd: cmd[-1].split(".")[0])
+    jids = qsub.qsub_many(["1.sh", "2.sh", "3.sh"], max_workers=2)
+    assert jids == {"1.sh": "1", "2.sh": "2", "3.sh": "3"}
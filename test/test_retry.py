@@ -0,0 +1,90 @@
+import os
+
+from qsubpy.config import read_config
+from qsubpy.retry import failed_tasks, make_retry_script
+
+SCRIPT = [
+    "#!/bin/bash",
+    "#$ -S /bin/bash",
+    "#$ -t 1-4:1",
+    "set -eu",
+    "echo $SGE_TASK_ID",
+]
+
+
+def test_array_tasks():
+    config = read_config("config.toml")
+    assert config.array_tasks(SCRIPT) == [1, 2, 3, 4]
+    assert config.array_tasks(SCRIPT[:2]) is None
+
+
+def test_failed_tasks(tmp_path):
+    config = read_config("config.toml")
+    script = tmp_path / "a.sh"
+    script.write_text("\n".join(SCRIPT))
+    (tmp_path / "123.tasks").write_text("1\t0\n2\t1\n4\t0\n")
+
+    record = {"jid": "123", "script": str(script)}
+    assert failed_tasks(record, config, status_dir=str(tmp_path)) == [2, 3]
+
+
+def test_make_retry_script():
+    config = read_config("config.toml")
+    assert make_retry_script(SCRIPT, [2, 3], config) == [
+        "#!/bin/bash",
+        "#$ -S /bin/bash",
+        "#$ -t 1-2:1",
+        "qsubpy_retry_tasks=(2 3)",
+        "SGE_TASK_ID=${qsubpy_retry_tasks[$(($SGE_TASK_ID-1))]}",
+        "set -eu",
+        "echo $SGE_TASK_ID",
+    ]
+
+
+class FakeMonitor:
+    def __init__(self, active):
+        self.active = active
+
+    def active_jids(self):
+        return self.active
+
+
+def test_retry_refuses_running_job(tmp_path, monkeypatch):
+    import pytest
+    from qsubpy import monitor
+    from qsubpy.journal import record_job
+    from qsubpy.retry import retry_job
+
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath("config.toml"))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.sh").write_text("\n".join(SCRIPT))
+    record_job("123", "a.sh")
+    monkeypatch.setattr(monitor, "get_monitor", lambda: FakeMonitor({"123"}))
+    with pytest.raises(ValueError):
+        retry_job("123")
+
+
+def test_sync_fails_without_failed_tasks(tmp_path, monkeypatch):
+    import pytest
+    from qsubpy.qsub import Qsub
+
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath("config.toml"))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.sh").write_text("\n".join(SCRIPT))
+    # every task succeeded, but the job failed e.g. by qacct
+    (tmp_path / ".qsubpy" / "status").mkdir(parents=True)
+    (tmp_path / ".qsubpy" / "status" / "123.tasks").write_text("1\t0\n2\t0\n3\t0\n4\t0\n")
+
+    class FakeBackend:
+        name = "fake"
+
+        def submit(self, sh_file, hold_jids, array_hold_jids=None):
+            return "123"
+
+        def wait(self, jids):
+            return {jid: 1 for jid in jids}
+
+    qsub = Qsub()
+    qsub.backend = FakeBackend()
+    with pytest.raises(RuntimeError):
+        qsub.sync("a.sh", retries=2)
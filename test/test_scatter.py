@@ -0,0 +1,75 @@
+import os
+import subprocess
+
+import pytest
+
+from qsubpy.config import read_config
+from qsubpy.scatter import read_task_lines, scatter_len, write_line_index
+from qsubpy.utils import make_sh_file
+
+
+def test_write_line_index(tmp_path):
+    path = tmp_path / "table.tsv"
+    path.write_text("a\t1\nb c\t2\n\nd\t4")
+    index = str(tmp_path / "table.idx")
+
+    assert write_line_index(str(path), index, 1) == 4
+    assert scatter_len(index) == 4
+    assert read_task_lines(str(path), index, 2) == ["b c\t2"]
+    assert read_task_lines(str(path), index, 4) == ["d\t4"]
+    with pytest.raises(IndexError):
+        read_task_lines(str(path), index, 5)
+
+    assert write_line_index(str(path), index, 3) == 2
+    assert read_task_lines(str(path), index, 1) == ["a\t1", "b c\t2", ""]
+    assert read_task_lines(str(path), index, 2) == ["d\t4"]
+
+    (tmp_path / "empty").write_text("")
+    with pytest.raises(ValueError):
+        write_line_index(str(tmp_path / "empty"), index, 1)
+
+
+def run_task(sh_file, task):
+    env = dict(os.environ, SGE_TASK_ID=str(task), JOB_ID="1")
+    # skip the body of config, which sources ~/.bashrc
+    with open(sh_file) as f:
+        script = f.read().split("set -eu", 1)[1]
+    p = subprocess.run(["bash", "-euc", script], capture_output=True, env=env, check=True)
+    return p.stdout.decode("utf-8")
+
+
+def test_scatter_script(tmp_path, monkeypatch):
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath("config.toml"))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "table.tsv").write_text("a  1\nb\t2\nc 3")
+
+    sh_file = make_sh_file(['echo "[$elem]"'], None, None, "one", scatter=("table.tsv", 1))
+    with open(sh_file) as f:
+        assert "#$ -t 1-3:1" in f.read().splitlines()
+    assert run_task(sh_file, 1) == "[a  1]\n"
+    assert run_task(sh_file, 3) == "[c 3]\n"
+
+    sh_file = make_sh_file(
+        ['echo "$qsubpy_offset ${#qsubpy_chunk[@]} ${qsubpy_chunk[0]}"'],
+        None,
+        None,
+        "two",
+        scatter=("table.tsv", 2),
+    )
+    assert run_task(sh_file, 1) == "0 2 a  1\n"
+    assert run_task(sh_file, 2) == "2 1 c 3\n"
+
+
+def test_scatter_store_index_reused(tmp_path, monkeypatch):
+    monkeypatch.setenv("QSUBPY_CONFIG", os.path.abspath("config.toml"))
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "table.tsv").write_text("a\nb\n")
+    config = read_config()
+
+    store = tmp_path / "store"
+    store.mkdir()
+    header, body = config.array_header_with_scatter("table.tsv", 1, str(store))
+    assert header == "#$ -t 1-2:1"
+    indices = os.listdir(store)
+    assert len(indices) == 1 and indices[0].endswith(".scatter.idx")
+    assert config.array_header_with_scatter("table.tsv", 1, str(store)) == (header, body)
@@ -0,0 +1,39 @@
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+
+from qsubpy.shell import CommandLostError, ShellPool, run_shell
+
+
+def test_run_shell_persistent_same_as_one_shot():
+    for cmd in ["echo a; echo b", "printf a", "true", "echo err >&2; exit 3", "cd /; set -e; false"]:
+        expected = run_shell(cmd)
+        p = run_shell(cmd, persistent=True)
+        assert (p.returncode, p.stdout, p.stderr) == (expected.returncode, expected.stdout, expected.stderr)
+
+
+def test_shell_pool_variables():
+    pool = ShellPool()
+    try:
+        assert pool.run('echo "$a"', ('a="x y"',)).stdout == b"x y\n"
+        assert pool.run('echo "${a:-none}"').stdout == b"none\n"
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            outs = list(executor.map(lambda i: pool.run(f"echo {i}").stdout, range(8)))
+        assert outs == [f"{i}\n".encode() for i in range(8)]
+    finally:
+        pool.close()
+
+
+def test_run_shell_fallback():
+    from qsubpy.shell import get_pool
+
+    # the session is killed by the command, which is not rerun since it may have run
+    with pytest.raises(CommandLostError):
+        run_shell("kill -9 $$", persistent=True)
+    # commands are rerun in one-shot bash only if sessions are dead before they are sent
+    run_shell("true", persistent=True)
+    for sessions in get_pool()._idle.values():
+        for session in sessions:
+            session.proc.kill()
+            session.proc.wait()
+    assert run_shell("echo a", persistent=True).stdout == b"a\n"
@@ -0,0 +1,40 @@
+import os
+import sys
+import time
+import subprocess
+
+# budget of qsubpy startup on top of the python interpreter itself
+STARTUP_BUDGET = 0.3
+HEAVY_MODULES = ["yaml", "toml", "subprocess", "qsubpy.run", "qsubpy.config", "qsubpy.qsub"]
+
+
+def run_python(args, env=None) -> float:
+    """best wall time of 3 runs"""
+    times = []
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, check=True, capture_output=True, env=env)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def test_no_heavy_import():
+    code = "import sys, qsubpy.cli; print(','.join(m for m in %r if m in sys.modules))"
+    p = subprocess.run(
+        [sys.executable, "-c", code % HEAVY_MODULES], check=True, capture_output=True
+    )
+    assert p.stdout.decode("utf-8").strip() == ""
+
+
+def test_help_without_config(tmp_path):
+    env = dict(os.environ)
+    env["HOME"] = str(tmp_path)
+    env.pop("QSUBPY_CONFIG", None)
+    subprocess.run([sys.executable, "-m", "qsubpy.cli", "--help"], check=True, capture_output=True, env=env)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_startup_budget():
+    baseline = run_python(["-c", "pass"])
+    assert run_python(["-c", "import qsubpy.cli"]) - baseline < STARTUP_BUDGET
+    assert run_python(["-m", "qsubpy.cli", "--help"]) - baseline < STARTUP_BUDGET
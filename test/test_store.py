@@ -0,0 +1,71 @@
+import os
+import time
+
+from qsubpy.store import store_script, gc
+
+
+def test_store_script(tmp_path):
+    root = str(tmp_path)
+    path = store_script("echo a", root)
+    assert store_script("echo a", root) == path
+    assert store_script("echo b", root) != path
+    with open(path) as f:
+        assert f.read() == "echo a"
+
+
+def test_gc(tmp_path):
+    root = str(tmp_path)
+    manifests = tmp_path / "manifests"
+    manifests.mkdir()
+    manifest = manifests / "abc.manifest"
+    manifest.write_text("a\n")
+    (manifests / "abc.manifest.idx").write_text("0" * 16 + "\n")
+
+    active = store_script(f"tail {manifest}", root)
+    finished = store_script("echo finished", root)
+    old = time.time() - 7200
+    for path in [active, finished, str(manifest)]:
+        os.utime(path, (old, old))
+
+    assert gc(root, {active}) == [finished]
+
+    removed = gc(root, set())
+    assert sorted(removed) == sorted(
+        [active, str(manifest), str(manifest) + ".idx"]
+    )
+
+
+def test_gc_keeps_jobs_submitted_from_other_directories(tmp_path, monkeypatch):
+    import argparse
+    from qsubpy import monitor
+    from qsubpy.run import gc_mode
+    from qsubpy.store import record_submission
+
+    root = tmp_path / "store"
+    with open("config.toml") as f:
+        config = f.read().replace('dir = "~/.cache/qsubpy/scripts"', f'dir = "{root}"')
+    (tmp_path / "config.toml").write_text(config)
+    monkeypatch.setenv("QSUBPY_CONFIG", str(tmp_path / "config.toml"))
+
+    running = store_script("echo running", str(root))
+    finished = store_script("echo finished", str(root))
+    record_submission(str(root), "123", running)
+    record_submission(str(root), "456", finished)
+    old = time.time() - 7200
+    for path in [running, finished] + [str(root / "jobs" / jid) for jid in ["123", "456"]]:
+        os.utime(path, (old, old))
+
+    class FakeMonitor:
+        def active_jids(self):
+            return {"123"}
+
+    monkeypatch.setattr(monitor, "get_monitor", lambda: FakeMonitor())
+    # run from a directory without the journal of the jobs
+    other = tmp_path / "other"
+    other.mkdir()
+    monkeypatch.chdir(other)
+    gc_mode(argparse.Namespace(min_age=3600, dry_run=False))
+
+    assert os.path.exists(running)
+    assert not os.path.exists(finished)
+    assert os.listdir(root / "jobs") == ["123"]
@@ -0,0 +1,35 @@
+from qsubpy.window import SubmitWindow
+
+
+class FakeMonitor:
+    """jobs finish in the order of submission, one per wait"""
+
+    def __init__(self):
+        self.waits = 0
+
+    def wait_any(self, jids):
+        self.waits += 1
+        return {sorted(jids, key=int)[0]}
+
+
+def test_window_max_jobs():
+    monitor = FakeMonitor()
+    window = SubmitWindow(max_jobs=2, monitor=monitor)
+    for jid in ["1", "2", "3", "4"]:
+        window.wait()
+        window.add(jid)
+    assert monitor.waits == 2
+    assert sorted(window.queued) == ["3", "4"]
+
+
+def test_window_max_tasks():
+    monitor = FakeMonitor()
+    window = SubmitWindow(max_tasks=100, monitor=monitor)
+    window.add("1", 60)
+    window.add("2", 30)
+    window.wait(50)
+    assert sorted(window.queued) == ["2"]
+    window.add("3", 50)
+    # a stage larger than max_tasks waits for an empty queue
+    window.wait(1000)
+    assert window.queued == {}